@@ -49,6 +49,7 @@ setup(
     install_requires=read_requirements(),
     extras_require={
         "gpu": ["faiss-gpu>=1.7.0"],
+        "onnx": ["onnxruntime>=1.16.0", "onnx>=1.14.0"],
         "dev": [
             "pytest>=7.0.0",
             "black>=23.0.0",
@@ -0,0 +1,89 @@
+"""Async MySQL module, which lets coroutines run SQL without blocking the event loop
+
+pymysql is blocking, so the statements run on a dedicated thread pool, sized
+to the connection pool: at most MYSQL_ASYNC_WORKERS statements are in flight,
+the others wait in the executor queue instead of each holding an OS thread.
+AsyncMySQLDatabase mirrors the MySQLDatabase methods and returns the same
+(flag, result) tuples, on the same connection pool.
+
+A timeout is enforced on the server from the start of the statement (see
+MySQLDatabase.execute: MAX_EXECUTION_TIME hint, KILL QUERY at the deadline).
+The await itself gives up SQL_TIMEOUT_GRACE seconds later, so a statement
+still queued in the executor by then is dropped.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, List, Optional, Tuple
+
+from mysql import MySQLDatabase, TIMEOUT_ERROR
+from globals import *
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_db_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool of the async statements
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MYSQL_ASYNC_WORKERS, thread_name_prefix='mysql-async')
+    return _executor
+
+
+class AsyncMySQLDatabase():
+    """
+    Awaitable MySQLDatabase. One instance may be shared by any number of
+    coroutines; each statement checks a connection out of the pool of db.
+    """
+
+    def __init__(self, in_product=True, read_only=False, db: Optional[MySQLDatabase] = None,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.db = db if db is not None else MySQLDatabase(in_product=in_product, read_only=read_only)
+        self.executor = executor if executor is not None else get_db_executor()
+
+    async def _run(self, func, *args, timeout: Optional[float] = None, **kwargs) -> Tuple[bool, Any]:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, functools.partial(func, *args, timeout=timeout, **kwargs))
+        try:
+            return await asyncio.wait_for(future, None if timeout is None else timeout + SQL_TIMEOUT_GRACE)
+        except asyncio.TimeoutError:
+            return False, '{} after {}s'.format(TIMEOUT_ERROR, timeout)
+        except Exception as e:
+            # e.g. PoolTimeout: no connection became free within the checkout timeout
+            return False, '[ERROR] {}'.format(str(e))
+
+    async def fetch(self, sql, timeout=None):
+        """
+        Execute the given sql and fetch results from db.
+        """
+        return await self._run(self.db.fetch, sql, timeout=timeout)
+
+    async def fetch_bounded(self, sql, max_rows=FETCH_MAX_ROWS, max_bytes=FETCH_MAX_BYTES, args=None, timeout=None):
+        """
+        Execute the given sql and fetch at most max_rows rows / max_bytes bytes.
+        """
+        return await self._run(self.db.fetch_bounded, sql, max_rows, max_bytes, args, timeout=timeout)
+
+    async def execute(self, sql, timeout=None):
+        """
+        Execute the given sql.
+        """
+        return await self._run(self.db.execute, sql, timeout=timeout)
+
+    async def executes(self, sqls, timeout=None):
+        """
+        Execute the given sqls in one transaction.
+        """
+        return await self._run(self.db.executes, sqls, timeout=timeout)
+
+    async def fetch_all(self, sqls: Iterable[str], max_rows=FETCH_MAX_ROWS, max_bytes=FETCH_MAX_BYTES,
+                        timeout=None) -> List[Tuple[bool, Any]]:
+        """
+        Run the given sqls concurrently with fetch_bounded; the results are in the order of sqls.
+        """
+        return await asyncio.gather(*[self.fetch_bounded(sql, max_rows, max_bytes, timeout=timeout) for sql in sqls])
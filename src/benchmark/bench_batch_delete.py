@@ -0,0 +1,85 @@
+"""Batch delete: the old OR chain vs chunked IN (...) lists vs the temporary-table join
+
+Fills a scratch table of the configured database with --rows rows, then
+deletes --keys of them (int or text keys) with every strategy and reports the
+rows deleted per second. Run it against a local MySQL-compatible server (a
+MySQL or MariaDB container with the chat2sql database), not production, or
+offline on the SQLite file of DB_BACKEND = 'sqlite' (see db_fixture.py), where
+the temporary-table delete is an IN (SELECT ...) and the OR chain fails past
+SQLite's expression depth of 1000 terms.
+
+Usage (from src/): python -m benchmark.bench_batch_delete --rows 200000 --keys 1000,10000,100000
+"""
+
+import time
+import random
+import argparse
+from typing import List
+
+from mysql import MySQLDatabase
+
+TABLE = 'bench_batch_delete'
+
+
+def legacy_delete_sql(table: str, res_list: list, col_name: str) -> str:
+    """The SQL the old batch_delete built
+    """
+    sql = "DELETE FROM {} WHERE ".format(table)
+    if type(res_list[0]) == int:
+        condition_pattern = col_name + " = {}"
+    else:
+        condition_pattern = col_name + " = '{}'"
+    return sql + ' OR '.join([condition_pattern.format(res) for res in res_list]) + ';'
+
+
+def fill(db: MySQLDatabase, n_rows: int) -> None:
+    db.execute(f"DELETE FROM {TABLE}")
+    flag, error = db.batch_insert_with_mode(TABLE, [[i, f"key-{i}", i % 100] for i in range(n_rows)],
+                                            ['id', 'name', 'bucket'])
+    if not flag:
+        raise RuntimeError(error)
+
+
+def run(n_rows: int, key_counts: List[int], chunk_size: int, seed: int):
+    db = MySQLDatabase()
+    db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    flag, error = db.executes([f"CREATE TABLE {TABLE} (id INT PRIMARY KEY, name VARCHAR(32), bucket INT)",
+                               f"CREATE INDEX idx_{TABLE}_name ON {TABLE} (name)"])
+    if not flag:
+        print(error)
+        return
+    rng = random.Random(seed)
+    methods = [
+        ('OR chain', lambda keys, col: db.execute(legacy_delete_sql(TABLE, keys, col))),
+        (f'IN/{chunk_size}', lambda keys, col: db.batch_delete(TABLE, keys, col, chunk_size=chunk_size, strategy='in')),
+        (f'IN/{chunk_size} commit', lambda keys, col: db.batch_delete(TABLE, keys, col, chunk_size=chunk_size,
+                                                                       strategy='in', commit_every=1)),
+        ('temp table', lambda keys, col: db.batch_delete(TABLE, keys, col, chunk_size=chunk_size, strategy='temp_table')),
+    ]
+    print(f"{n_rows} rows, chunk size {chunk_size}")
+    print(f"{'keys':>7} {'column':>6} {'strategy':>18} {'seconds':>8} {'rows/s':>9}  result")
+    try:
+        for n_keys in key_counts:
+            ids = rng.sample(range(n_rows), min(n_keys, n_rows))
+            for col, keys in [('id', ids), ('name', [f"key-{i}" for i in ids])]:
+                for label, delete in methods:
+                    fill(db, n_rows)
+                    s = time.perf_counter()
+                    flag, error = delete(keys, col)
+                    seconds = time.perf_counter() - s
+                    _, left = db.fetch(f"SELECT COUNT(*) FROM {TABLE}")
+                    deleted = n_rows - left[0][0]
+                    result = 'ok' if flag and deleted == len(keys) else (error or f'{deleted} rows deleted')
+                    print(f"{n_keys:>7} {col:>6} {label:>18} {seconds:>8.2f} {deleted / seconds:>9.0f}  {result}")
+    finally:
+        db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--keys', default='1000,10000,100000', help='Comma separated numbers of keys to delete')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.rows, [int(n) for n in args.keys.split(',')], args.chunk_size, args.seed)
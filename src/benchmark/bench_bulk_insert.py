@@ -0,0 +1,85 @@
+"""Bulk insert: the old single-statement string building vs the chunked executemany path
+
+Inserts --rows synthetic rows (int, text with quotes, float, NULL) into a
+scratch table of the configured database, with both paths, and reports the
+wall time, rows/s and the peak Python memory of building/sending the rows.
+
+Usage (from src/): python -m benchmark.bench_bulk_insert --rows 100000 --chunk-sizes 1000,5000,20000
+"""
+
+import time
+import argparse
+import tracemalloc
+from typing import List
+
+from pymysql.converters import escape_string
+
+from mysql import MySQLDatabase
+
+TABLE = 'bench_bulk_insert'
+
+
+def make_rows(n: int) -> List[list]:
+    # the first row has an int where later rows have NULL, which the old quoting got wrong
+    return [[i, f"AS{i} O'Brien \"quoted\"", i * 0.5, None if i % 7 == 1 else i % 100] for i in range(n)]
+
+
+def legacy_insert_sql(table: str, res_list: List[list], col_list: List[str]) -> str:
+    """The SQL the old batch_insert_with_mode built in append mode
+    """
+    sql = "INSERT INTO {} ({}) VALUES".format(table, ','.join(col_list))
+    value_pattern = "("
+    for attr in res_list[0]:
+        if type(attr) in [int, float, bool]:
+            value_pattern += "{},"
+        else:
+            value_pattern += "'{}',"
+    value_pattern = value_pattern[:-1] + '),'
+    for res in res_list:
+        my_res = [escape_string(v) if isinstance(v, str) else v for v in res]
+        sql += value_pattern.format(*my_res)
+    sql = sql[:-1] + ';'
+    return sql.replace(',None', ',NULL')
+
+
+def timed(func):
+    tracemalloc.start()
+    s = time.perf_counter()
+    flag, error = func()
+    seconds = time.perf_counter() - s
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return flag, error, seconds, peak / 2**20
+
+
+def run(n_rows: int, chunk_sizes: List[int]):
+    db = MySQLDatabase()
+    cols = ['id', 'name', 'score', 'bucket']
+    db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    flag, error = db.execute(f"CREATE TABLE {TABLE} (id INT PRIMARY KEY, name VARCHAR(64), score DOUBLE, bucket INT NULL)")
+    if not flag:
+        print(error)
+        return
+    rows = make_rows(n_rows)
+    print(f"{n_rows} rows, max_allowed_packet={db.max_allowed_packet()}")
+    print(f"{'path':>22} {'seconds':>8} {'rows/s':>9} {'peak MB':>8}  result")
+    try:
+        db.execute(f"DELETE FROM {TABLE}")
+        flag, error, seconds, peak = timed(lambda: db.execute(legacy_insert_sql(TABLE, rows, cols)))
+        print(f"{'string building':>22} {seconds:>8.2f} {n_rows / seconds:>9.0f} {peak:>8.1f}  {'ok' if flag else error}")
+        for chunk_size in chunk_sizes:
+            db.execute(f"DELETE FROM {TABLE}")
+            flag, error, seconds, peak = timed(lambda: db.batch_insert_with_mode(TABLE, rows, cols, mode='append', chunk_size=chunk_size))
+            print(f"{f'executemany/{chunk_size}':>22} {seconds:>8.2f} {n_rows / seconds:>9.0f} {peak:>8.1f}  {'ok' if flag else error}")
+        flag, error, seconds, peak = timed(lambda: db.batch_insert_with_mode(TABLE, rows, cols, mode='redo'))
+        print(f"{'executemany redo':>22} {seconds:>8.2f} {n_rows / seconds:>9.0f} {peak:>8.1f}  {'ok' if flag else error}")
+    finally:
+        db.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--chunk-sizes', default='1000,5000,20000', help='Comma separated executemany chunk sizes')
+    args = parser.parse_args()
+    run(args.rows, [int(n) for n in args.chunk_sizes.split(',')])
@@ -0,0 +1,81 @@
+"""Encode throughput, single-question tail latency and memory of each embedding backend
+
+Every backend runs in its own process, so the RSS numbers are not mixed up
+with the other backends' models. Throughput encodes the catalog's table texts
+in batches (the index build); latency encodes the qa.csv questions one at a
+time (a user request).
+
+Usage (from src/): python -m benchmark.bench_embedding_backends --backends torch,onnx,onnx_int8
+"""
+
+import os
+import time
+import argparse
+import resource
+import multiprocessing as mp
+from typing import List, Dict
+
+from catalog import Catalog
+from embedding_backend import create_backend
+from benchmark.common import load_questions, percentiles
+from globals import *
+
+
+def rss_mb() -> float:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def measure(name: str, batch_size: int, rounds: int, queue) -> None:
+    catalog = Catalog.load(TABLE_JSON_PATH)
+    _, doc_texts = catalog.table_entries()
+    questions = load_questions(QA_PATH)
+    base_rss = rss_mb()
+
+    s = time.perf_counter()
+    backend = create_backend(name)
+    load_s = time.perf_counter() - s
+    model_rss = rss_mb() - base_rss
+
+    backend.encode(questions[:2])  # warm-up
+    s = time.perf_counter()
+    for _ in range(rounds):
+        backend.encode(doc_texts, batch_size=batch_size)
+    throughput = rounds * len(doc_texts) / (time.perf_counter() - s)
+
+    latencies = []
+    for _ in range(rounds):
+        for question in questions:
+            s = time.perf_counter()
+            backend.encode([question])
+            latencies.append(time.perf_counter() - s)
+    p50, p99 = percentiles(latencies)
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put({'backend': name, 'load_s': load_s, 'throughput': throughput, 'p50': p50, 'p99': p99,
+               'model_rss': model_rss, 'peak_rss': peak_rss})
+
+
+def run(backends: List[str], batch_size: int, rounds: int):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    print(f"{'backend':>10} {'load(s)':>8} {'texts/s':>9} {'p50(ms)':>8} {'p99(ms)':>8} {'model MB':>9} {'peak MB':>8}")
+    for name in backends:
+        proc = ctx.Process(target=measure, args=(name, batch_size, rounds, queue))
+        proc.start()
+        proc.join()
+        if proc.exitcode != 0:
+            print(f"{name:>10} failed with exit code {proc.exitcode}")
+            continue
+        r: Dict = queue.get()
+        print(f"{r['backend']:>10} {r['load_s']:>8.1f} {r['throughput']:>9.1f} {r['p50']:>8.1f} {r['p99']:>8.1f} "
+              f"{r['model_rss']:>9.0f} {r['peak_rss']:>8.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', default='torch,onnx,onnx_int8', help='Comma separated backends')
+    parser.add_argument('--batch-size', type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument('--rounds', type=int, default=3, help='Passes over the catalog texts and the questions')
+    args = parser.parse_args()
+    run(args.backends.split(','), args.batch_size, args.rounds)
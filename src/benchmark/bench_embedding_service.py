@@ -0,0 +1,127 @@
+"""Question-encode throughput as the worker count grows: shared sidecar vs one model per worker
+
+Every worker process runs --threads closed-loop client threads (like a
+threaded Flask worker), each encoding distinct question variants for
+--duration seconds. "service" sends them to one embedding_service.py sidecar,
+which micro-batches across workers; "in-process" (with --in-process) loads
+the backend in every worker. RSS is the sum over the processes holding models.
+
+Usage (from src/): python -m benchmark.bench_embedding_service --workers 1,2,4,8
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+import threading
+import multiprocessing as mp
+from typing import List, Dict
+
+from embedding_service import EmbeddingServiceClient
+from benchmark.common import load_questions, percentiles
+from globals import *
+
+
+def rss_mb(pid: int) -> float:
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def worker(mode: str, socket_path: str, worker_idx: int, threads: int, duration: float, start_at: float, queue) -> None:
+    questions = load_questions(QA_PATH)
+    if mode == 'service':
+        client = EmbeddingServiceClient(socket_path)
+        encode = client.encode
+    else:
+        from embedding_backend import create_backend
+        backend = create_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_PATH)
+        encode = backend.encode
+        encode(questions[:1])
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def loop(thread_idx: int):
+        local, i = [], 0
+        while time.time() < start_at:
+            time.sleep(0.001)
+        while time.time() < start_at + duration:
+            # distinct texts, so nothing is answered from a cache
+            text = f"{questions[i % len(questions)]} ({worker_idx}-{thread_idx}-{i})"
+            s = time.perf_counter()
+            encode([text])
+            local.append(time.perf_counter() - s)
+            i += 1
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=loop, args=(idx,)) for idx in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    queue.put({'latencies': latencies, 'rss': rss_mb(os.getpid()) if mode == 'in-process' else 0.0})
+
+
+def measure(mode: str, socket_path: str, n_workers: int, threads: int, duration: float, warmup: float) -> Dict:
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    # leave the workers time to start (and, in-process, to load their model)
+    start_at = time.time() + warmup
+    procs = [ctx.Process(target=worker, args=(mode, socket_path, idx, threads, duration, start_at, queue))
+             for idx in range(n_workers)]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    latencies = [x for r in results for x in r['latencies']]
+    p50, p99 = percentiles(latencies) if latencies else (0.0, 0.0)
+    return {
+        'throughput': len(latencies) / duration,
+        'p50': p50,
+        'p99': p99,
+        'rss': sum(r['rss'] for r in results),
+    }
+
+
+def run(workers: List[int], threads: int, duration: float, socket_path: str, in_process: bool):
+    sidecar = None
+    if not os.path.exists(socket_path):
+        sidecar = subprocess.Popen([sys.executable, 'embedding_service.py', '--socket', socket_path])
+    client = EmbeddingServiceClient(socket_path)
+    try:
+        # the sidecar loads the model and the indexes first
+        client.wait_ready(timeout=600)
+        print(f"{'mode':>10} {'workers':>8} {'req/s':>8} {'p50(ms)':>8} {'p99(ms)':>8} {'batch':>6} {'model MB':>9}")
+        for n_workers in workers:
+            before = client.stats()['batcher']
+            r = measure('service', socket_path, n_workers, threads, duration, warmup=3)
+            after = client.stats()['batcher']
+            batches = after['batches'] - before['batches']
+            batch = (after['texts'] - before['texts']) / batches if batches else 0.0
+            sidecar_rss = rss_mb(sidecar.pid) if sidecar is not None else float('nan')
+            print(f"{'service':>10} {n_workers:>8} {r['throughput']:>8.1f} {r['p50']:>8.1f} {r['p99']:>8.1f} "
+                  f"{batch:>6.1f} {sidecar_rss:>9.0f}")
+            if in_process:
+                r = measure('in-process', socket_path, n_workers, threads, duration, warmup=60)
+                print(f"{'in-process':>10} {n_workers:>8} {r['throughput']:>8.1f} {r['p50']:>8.1f} {r['p99']:>8.1f} "
+                      f"{'-':>6} {r['rss']:>9.0f}")
+    finally:
+        if sidecar is not None:
+            sidecar.terminate()
+            sidecar.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4,8', help='Comma separated worker process counts')
+    parser.add_argument('--threads', type=int, default=4, help='Client threads per worker')
+    parser.add_argument('--duration', type=float, default=20, help='Seconds of load per measurement')
+    parser.add_argument('--socket', default=EMBEDDING_SERVICE_SOCKET, help='Sidecar socket; started here if it does not exist')
+    parser.add_argument('--in-process', action='store_true', help='Also measure one model per worker')
+    args = parser.parse_args()
+    run([int(n) for n in args.workers.split(',')], args.threads, args.duration, args.socket, args.in_process)
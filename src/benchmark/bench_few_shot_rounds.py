@@ -0,0 +1,54 @@
+"""ReAct rounds per question and wall time, with and without the few-shot traces
+
+Every rag_file/qa.csv question is answered through SQLChatAgent._dql_needed_execute
+(one gpt-4o call per round) leave-one-out: its own trace is removed from the
+few-shot index, so it cannot copy its answer.
+
+Usage (from src/): python -m benchmark.bench_few_shot_rounds --repeat 1
+"""
+
+import time
+import argparse
+
+import numpy as np
+
+from model.model_zoo import ModelZoo
+from sql_react_prune import SQLChatAgent
+from knn_icl import get_knn_schema
+from few_shot import FewShotIndex, load_examples
+from benchmark.common import percentiles
+from globals import *
+
+
+def run(repeat: int):
+    agent = SQLChatAgent(model_zoo=ModelZoo().get_model_zoo())
+    few_shot_index = FewShotIndex.load_or_build(get_knn_schema())
+    examples = load_examples(QA_PATH)
+    print(f"{len(examples)} questions, {repeat} repeat(s), k={FEW_SHOT_K}, budget={FEW_SHOT_TOKEN_BUDGET} tokens")
+    print(f"{'mode':>10} {'rounds':>7} {'answered':>9} {'p50(s)':>7} {'p99(s)':>7} {'total(s)':>9}")
+    for use_examples in [False, True]:
+        rounds, answered, latencies = [], 0, []
+        for _ in range(repeat):
+            for example in examples:
+                agent.few_shot_index = few_shot_index.without([example.question])
+                stats = {}
+                s = time.perf_counter()
+                try:
+                    flag, _ = agent._dql_needed_execute(example.question, external_info=None,
+                                                        use_examples=use_examples, stats=stats)
+                except Exception:
+                    flag = False
+                latencies.append(time.perf_counter() - s)
+                rounds.append(stats.get('rounds', 0))
+                answered += int(flag)
+        p50, p99 = percentiles(latencies)
+        mode = 'few-shot' if use_examples else 'baseline'
+        print(f"{mode:>10} {np.mean(rounds):>7.2f} {answered / len(latencies):>9.2f} "
+              f"{p50 / 1000:>7.1f} {p99 / 1000:>7.1f} {sum(latencies):>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=1, help='Passes over the questions per mode')
+    args = parser.parse_args()
+    run(args.repeat)
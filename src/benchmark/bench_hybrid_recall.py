@@ -0,0 +1,56 @@
+"""Offline recall@k, retrieval rounds and latency of dense vs hybrid table retrieval
+
+The gold tables of each rag_file/qa.csv example are the tables its final SQL
+reads from. "Rounds" simulates the ReAct loop calling Retrieve_table until all
+gold tables were returned, each call excluding the tables already retrieved
+(as RAGTool does with table_list_record); fewer rounds means fewer LLM calls.
+
+Usage (from src/): python -m benchmark.bench_hybrid_recall --weights 0,0.3,0.5 --k 3
+"""
+
+import time
+import argparse
+from typing import List
+
+import numpy as np
+
+from knn_icl import KNNSchema
+from benchmark.common import load_examples, percentiles
+from globals import *
+
+MAX_RAG_ROUNDS = 5
+
+
+def run(weights: List[float], k: int):
+    knn_schema = KNNSchema(watch_catalog=False)
+    examples = load_examples(QA_PATH, knn_schema.snapshot.catalog)
+    print(f"{len(examples)} examples with gold tables in the catalog")
+    print(f"{'weight':>7} {'recall@k':>9} {'rounds':>7} {'unsolved':>9} {'p50(ms)':>8} {'p99(ms)':>8}")
+    for weight in weights:
+        recalls, rounds, latencies, unsolved = [], [], [], 0
+        for question, gold in examples:
+            retrieved: List[str] = []
+            for round_idx in range(1, MAX_RAG_ROUNDS + 1):
+                s = time.perf_counter()
+                tables = knn_schema.get_topk_knowledge_v2(question, exclude_list=retrieved, k=k, lexical_weight=weight)
+                latencies.append(time.perf_counter() - s)
+                if round_idx == 1:
+                    recalls.append(len(gold & set(tables)) / len(gold))
+                retrieved.extend(tables)
+                if gold <= set(retrieved):
+                    rounds.append(round_idx)
+                    break
+            else:
+                unsolved += 1
+                rounds.append(MAX_RAG_ROUNDS)
+        p50, p99 = percentiles(latencies)
+        print(f"{weight:>7.2f} {np.mean(recalls):>9.3f} {np.mean(rounds):>7.2f} {unsolved:>9} "
+              f"{p50:>8.2f} {p99:>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', default='0,0.3,0.5', help='Comma separated lexical weights, 0 = dense only')
+    parser.add_argument('--k', type=int, default=3, help='Tables per Retrieve_table call (RAGTool uses 3)')
+    args = parser.parse_args()
+    run([float(w) for w in args.weights.split(',')], args.k)
@@ -0,0 +1,77 @@
+"""LongTermMemory.search on long chats: the former unbounded scan vs the indexed LIMIT query
+
+Saves --chats chats of --turns turns each under negative chat ids, into
+user_memory and into a scratch table of the former layout (tab-joined turns,
+no index), then times the former search (every row of the chat, split in
+Python, sliced to top_k) against LongTermMemory.search. The benchmark rows
+are deleted afterwards. Works on MySQL and on the offline SQLite fixture.
+
+Usage (from src/): python -m benchmark.bench_memory_search --chats 5 --turns 10000 --top-k 3
+"""
+
+import time
+import argparse
+from typing import List, Tuple
+
+from memory import LongTermMemory, MEMORY_COLUMNS, MEMORY_TABLE
+from benchmark.common import percentiles
+
+LEGACY_TABLE = 'bench_user_memory_legacy'
+
+
+def legacy_search(memory: LongTermMemory, chat_id: int, top_k: int) -> List[Tuple[str, str]]:
+    """The search before the LIMIT and the question / answer columns
+    """
+    flag, result = memory.storage.fetch(
+        f"SELECT memory, timestamp FROM {LEGACY_TABLE} WHERE chat_id={chat_id} ORDER BY timestamp DESC")
+    qa_pair = []
+    for item in result:
+        q, a = item[0].strip().split('\t')
+        qa_pair.append((q.strip(), a.strip()))
+    return qa_pair[:top_k]
+
+
+def run(n_chats: int, n_turns: int, top_k: int, repeat: int):
+    memory = LongTermMemory()
+    if not memory.ensure_schema():
+        raise SystemExit(f"{MEMORY_TABLE} not ready, see the log")
+    db = memory.storage
+    chat_ids = [-(i + 1) for i in range(n_chats)]
+    db.execute(f"DROP TABLE IF EXISTS {LEGACY_TABLE}")
+    db.execute(f"CREATE TABLE {LEGACY_TABLE} (chat_id BIGINT, memory TEXT, timestamp BIGINT)")
+    db.batch_delete(MEMORY_TABLE, chat_ids, 'chat_id')
+    try:
+        for chat_id in chat_ids:
+            turns = [(f"question {t} of chat {chat_id}", f"answer {t} " + 'x' * 200, 1_700_000_000 + t)
+                     for t in range(n_turns)]
+            db.batch_insert(MEMORY_TABLE, [[chat_id, q, a, None, ts] for q, a, ts in turns], MEMORY_COLUMNS)
+            db.batch_insert(LEGACY_TABLE, [[chat_id, f"Question: {q}\tAnswer: {a}", ts] for q, a, ts in turns],
+                            ['chat_id', 'memory', 'timestamp'])
+        print(f"{n_chats} chats x {n_turns} turns, top_k={top_k}, {repeat} searches per chat")
+        print(f"{'search':>8} {'p50(ms)':>8} {'p99(ms)':>8}  same result")
+        results = {}
+        for label, search in [('former', lambda c: legacy_search(memory, c, top_k)),
+                              ('indexed', lambda c: memory.search(c, top_k))]:
+            latencies = []
+            for _ in range(repeat):
+                for chat_id in chat_ids:
+                    s = time.perf_counter()
+                    results[label, chat_id] = search(chat_id)
+                    latencies.append(time.perf_counter() - s)
+            p50, p99 = percentiles(latencies)
+            same = all([(f"Question: {q}", f"Answer: {a}") for q, a in results.get(('indexed', c), [])]
+                       == results[('former', c)] for c in chat_ids) if label == 'indexed' else ''
+            print(f"{label:>8} {p50:>8.2f} {p99:>8.2f}  {same}")
+    finally:
+        db.batch_delete(MEMORY_TABLE, chat_ids, 'chat_id')
+        db.execute(f"DROP TABLE IF EXISTS {LEGACY_TABLE}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=5)
+    parser.add_argument('--turns', type=int, default=10000)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    run(args.chats, args.turns, args.top_k, args.repeat)
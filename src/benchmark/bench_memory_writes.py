@@ -0,0 +1,83 @@
+"""LongTermMemory writes under a burst: one INSERT per turn vs the write-behind MemoryWriter
+
+--threads request threads save --turns turns each, as fast as they can, with
+the former synchronous insert and with the writer in every durability. Reports
+the save latency seen by the request, the time until every turn is committed,
+and the INSERT statements sent (the write QPS the database sees). The turns go
+to user_memory under negative chat ids, deleted afterwards; the write-ahead
+log goes to a temporary directory. Works on MySQL and on the offline SQLite fixture.
+
+Usage (from src/): python -m benchmark.bench_memory_writes --threads 16 --turns 500
+"""
+
+import os
+import time
+import tempfile
+import argparse
+import threading
+from typing import Callable, List
+
+from memory import LongTermMemory, MEMORY_COLUMNS, MEMORY_TABLE
+from memory_writer import MemoryWriter
+from benchmark.common import percentiles
+
+
+def burst(save: Callable[[list], bool], n_threads: int, n_turns: int, chat_ids: List[int]) -> List[float]:
+    latencies, lock = [], threading.Lock()
+
+    def worker(idx: int):
+        mine = []
+        for t in range(n_turns):
+            row = [chat_ids[idx], f"question {t}", f"answer {t} " + 'x' * 200, None, 1_700_000_000 + t]
+            s = time.perf_counter()
+            save(row)
+            mine.append(time.perf_counter() - s)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(idx,)) for idx in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def run(n_threads: int, n_turns: int, flush_rows: int, flush_interval: float):
+    memory = LongTermMemory()
+    if not memory.ensure_schema():
+        raise SystemExit(f"{MEMORY_TABLE} not ready, see the log")
+    db = memory.storage
+    chat_ids = [-(i + 1) for i in range(n_threads)]
+    print(f"{n_threads} threads x {n_turns} turns, batches of {flush_rows} rows / {flush_interval}s")
+    print(f"{'mode':>8} {'p50(ms)':>8} {'p99(ms)':>8} {'committed(s)':>13} {'INSERTs':>8} {'rows':>7}")
+    with tempfile.TemporaryDirectory() as wal_dir:
+        for mode in ['former', 'sync', 'async', 'wal']:
+            db.batch_delete(MEMORY_TABLE, chat_ids, 'chat_id')
+            s = time.perf_counter()
+            if mode == 'former':
+                latencies = burst(lambda row: db.batch_insert(MEMORY_TABLE, [row], MEMORY_COLUMNS)[0],
+                                  n_threads, n_turns, chat_ids)
+                statements = n_threads * n_turns
+            else:
+                writer = MemoryWriter(db, MEMORY_TABLE, MEMORY_COLUMNS, durability=mode, flush_rows=flush_rows,
+                                      flush_interval=flush_interval, max_queue=n_threads * n_turns,
+                                      wal_path=os.path.join(wal_dir, 'segment'))
+                latencies = burst(writer.put, n_threads, n_turns, chat_ids)
+                writer.close()
+                statements = writer.stats()['batches']
+            committed = time.perf_counter() - s
+            _, rows = db.fetch(f"SELECT COUNT(*) FROM {MEMORY_TABLE} WHERE chat_id < 0")
+            p50, p99 = percentiles(latencies)
+            print(f"{mode:>8} {p50:>8.3f} {p99:>8.3f} {committed:>13.2f} {statements:>8} {rows[0][0]:>7}")
+        db.batch_delete(MEMORY_TABLE, chat_ids, 'chat_id')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--turns', type=int, default=500)
+    parser.add_argument('--flush-rows', type=int, default=500)
+    parser.add_argument('--flush-interval', type=float, default=0.2)
+    args = parser.parse_args()
+    run(args.threads, args.turns, args.flush_rows, args.flush_interval)
@@ -0,0 +1,76 @@
+"""RefineTool's SQL validation on the offline SQLite fixture: sequential vs concurrent
+
+Runs the final SQL of every rag_file/qa.csv answer with fetch_bounded (the
+query RefineTool sends, without its cache and cost gate) one after the other,
+then all at once through AsyncMySQLDatabase, and reports the latencies. Needs
+DB_BACKEND = 'sqlite' in globals.py and a fixture built by db_fixture.py, so
+the numbers only depend on the fixture's seed and scale.
+
+Usage (from src/):
+    python db_fixture.py --rows 100000
+    python -m benchmark.bench_offline_db --repeat 5
+"""
+
+import re
+import csv
+import time
+import asyncio
+import argparse
+from typing import List
+
+from mysql import MySQLDatabase
+from async_mysql import AsyncMySQLDatabase
+from benchmark.common import percentiles
+from globals import *
+
+
+def load_sqls(path: str) -> List[str]:
+    """The final SQLs of the qa.csv answers
+    """
+    sqls = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if 'SQL:' in row['A']:
+                # the traces keep their line breaks as literal \n
+                sql = row['A'].split('SQL:', 1)[-1].replace('\\n', ' ').strip().strip('`')
+                sqls.append(re.sub(r"^sql\s", '', sql).strip())
+    return sqls
+
+
+def run(repeat: int):
+    if DB_BACKEND != 'sqlite':
+        print(f"DB_BACKEND is {DB_BACKEND}; set it to 'sqlite' and build the fixture with db_fixture.py first")
+        return
+    sqls = load_sqls(QA_PATH)
+    db = MySQLDatabase(in_product=True, read_only=True)
+    print(f"{len(sqls)} SQLs x {repeat} on {SQLITE_PATH}, max_rows={REFINE_MAX_ROWS}")
+    print(f"{'mode':>10} {'ok':>5} {'errors':>7} {'p50(ms)':>8} {'p99(ms)':>8} {'total(s)':>9}")
+
+    latencies, ok = [], 0
+    s = time.perf_counter()
+    for _ in range(repeat):
+        for sql in sqls:
+            t = time.perf_counter()
+            flag, _ = db.fetch_bounded(sql, REFINE_MAX_ROWS, REFINE_MAX_BYTES, timeout=REFINE_SQL_TIMEOUT)
+            latencies.append(time.perf_counter() - t)
+            ok += flag
+    total = time.perf_counter() - s
+    p50, p99 = percentiles(latencies)
+    print(f"{'sequential':>10} {ok:>5} {len(latencies) - ok:>7} {p50:>8.1f} {p99:>8.1f} {total:>9.2f}")
+
+    async_db = AsyncMySQLDatabase(db=db)
+    s = time.perf_counter()
+    results = []
+    for _ in range(repeat):
+        results += asyncio.run(async_db.fetch_all(sqls, REFINE_MAX_ROWS, REFINE_MAX_BYTES, timeout=REFINE_SQL_TIMEOUT))
+    total = time.perf_counter() - s
+    ok = sum(flag for flag, _ in results)
+    print(f"{'concurrent':>10} {ok:>5} {len(results) - ok:>7} {'':>8} {'':>8} {total:>9.2f}")
+    print(db.pool_stats())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,97 @@
+"""Table retrieval latency: per-query NearestNeighbors rebuild vs the prebuilt FAISS index
+
+Embeddings are random unit vectors, so the numbers exclude the query encoding
+(which is the same for both paths) and only measure the retrieval itself.
+
+Usage (from src/): python -m benchmark.bench_table_retrieval --sizes 100,1000,10000
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+from typing import List, Dict
+
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+from catalog import table_retrieval_text
+from vector_index import VectorIndex
+from benchmark.common import percentiles
+
+
+def make_catalog(n_tables: int, n_columns: int = 10) -> Dict:
+    catalog = {}
+    for i in range(n_tables):
+        catalog[f"table_{i}"] = {
+            'description': f"Synthetic table number {i} used for the retrieval benchmark.",
+            'column_info': [[f"col_{j}", f"column {j} of table {i}", "1,2,3,4,5"] for j in range(n_columns)],
+            'evidence': ''
+        }
+    return catalog
+
+
+def random_embeddings(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    x = rng.standard_normal((n, dim)).astype('float32')
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def old_path(catalog_path: str, cache: Dict[str, np.ndarray], query_embedding: np.ndarray, exclude_list: List[str], k: int):
+    """What get_topk_knowledge_v2 did before the index: reload, rebuild, refit
+    """
+    with open(catalog_path, 'r') as f:
+        data = json.load(f)
+    table_name_list, embeddings = [], []
+    for table_name in data.keys():
+        if table_name in exclude_list:
+            continue
+        table_name_list.append(table_name)
+        embeddings.append(cache[table_retrieval_text(table_name, data[table_name])])
+    nrnb = NearestNeighbors(n_neighbors=k).fit(np.stack(embeddings))
+    _, indices = nrnb.kneighbors(query_embedding.reshape(1, -1))
+    return [table_name_list[idx] for idx in indices[0]]
+
+
+def run(sizes: List[int], dim: int, n_queries: int, k: int):
+    rng = np.random.default_rng(0)
+    print(f"{'tables':>8} {'old p50(ms)':>12} {'old p99(ms)':>12} {'index p50(ms)':>14} {'index p99(ms)':>14}")
+    for n_tables in sizes:
+        catalog = make_catalog(n_tables)
+        table_name_list = list(catalog.keys())
+        text_list = [table_retrieval_text(name, catalog[name]) for name in table_name_list]
+        embeddings = random_embeddings(n_tables, dim, rng)
+        cache = dict(zip(text_list, embeddings))
+        index = VectorIndex.build(table_name_list, embeddings)
+        queries = random_embeddings(n_queries, dim, rng)
+        exclude_list = table_name_list[:3]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            catalog_path = os.path.join(tmp_dir, 'catalog.json')
+            with open(catalog_path, 'w') as f:
+                json.dump(catalog, f)
+
+            old_latencies, new_latencies = [], []
+            for query in queries:
+                s = time.perf_counter()
+                expected = old_path(catalog_path, cache, query, exclude_list, k)
+                old_latencies.append(time.perf_counter() - s)
+
+                s = time.perf_counter()
+                got = [name for name, _ in index.search(query, k, exclude=exclude_list)]
+                new_latencies.append(time.perf_counter() - s)
+                assert set(got) == set(expected), "Index and NearestNeighbors disagree"
+
+        old_p50, old_p99 = percentiles(old_latencies)
+        new_p50, new_p99 = percentiles(new_latencies)
+        print(f"{n_tables:>8} {old_p50:>12.2f} {old_p99:>12.2f} {new_p50:>14.3f} {new_p99:>14.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000,5000,10000', help='Comma separated table counts')
+    parser.add_argument('--dim', type=int, default=1024, help='Embedding dimension (bge-m3: 1024)')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=5)
+    args = parser.parse_args()
+    run([int(n) for n in args.sizes.split(',')], args.dim, args.queries, args.k)
@@ -0,0 +1,63 @@
+"""Top-k table retrieval agreement of the embedding backends with the fp32 torch model
+
+The tables are ranked for every rag_file/qa.csv question and for every table
+description of the catalog (a question the table should answer), with each
+backend and with the torch reference. Exits with status 1 when a backend's
+mean overlap@k is below --min-agreement.
+
+Usage (from src/): python -m benchmark.check_backend_agreement --backends onnx,onnx_int8 --k 5
+"""
+
+import sys
+import argparse
+from typing import List
+
+import numpy as np
+
+from catalog import Catalog
+from embedding_backend import create_backend
+from benchmark.common import load_questions
+from globals import *
+
+
+def topk(doc_embeddings: np.ndarray, query_embeddings: np.ndarray, k: int) -> np.ndarray:
+    scores = query_embeddings @ doc_embeddings.T
+    return np.argsort(-scores, axis=1, kind='stable')[:, :k]
+
+
+def run(backends: List[str], k: int, min_agreement: float) -> bool:
+    catalog = Catalog.load(TABLE_JSON_PATH)
+    _, doc_texts = catalog.table_entries()
+    queries = load_questions(QA_PATH) + [item['description'] for item in catalog.data.values() if item['description'].strip()]
+    k = min(k, len(doc_texts))
+    print(f"{len(doc_texts)} tables, {len(queries)} queries, k={k}")
+
+    reference = create_backend('torch')
+    ref_docs = reference.encode(doc_texts)
+    ref_topk = topk(ref_docs, reference.encode(queries), k)
+    del reference
+
+    ok = True
+    print(f"{'backend':>10} {'overlap@k':>10} {'top1':>6} {'exact':>6} {'min cos':>8} {'mean cos':>9}")
+    for name in backends:
+        backend = create_backend(name)
+        docs = backend.encode(doc_texts)
+        got_topk = topk(docs, backend.encode(queries), k)
+        del backend
+        overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(got_topk, ref_topk)])
+        top1 = np.mean(got_topk[:, 0] == ref_topk[:, 0])
+        exact = np.mean((got_topk == ref_topk).all(axis=1))
+        # cosine between the two backends' vectors of the same table text
+        cos = (docs * ref_docs).sum(axis=1)
+        print(f"{name:>10} {overlap:>10.3f} {top1:>6.3f} {exact:>6.3f} {cos.min():>8.4f} {cos.mean():>9.4f}")
+        ok = ok and overlap >= min_agreement
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', default='onnx,onnx_int8', help='Comma separated backends compared with torch')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--min-agreement', type=float, default=0.9, help='Lowest acceptable mean overlap@k')
+    args = parser.parse_args()
+    sys.exit(0 if run(args.backends.split(','), args.k, args.min_agreement) else 1)
@@ -0,0 +1,39 @@
+"""Helpers shared by the benchmarks: the rag_file/qa.csv examples and latency percentiles
+"""
+
+import re
+import csv
+from typing import List, Tuple, Set
+
+import numpy as np
+
+
+def sql_tables(trace: str) -> Set[str]:
+    """Tables the final SQL of a qa.csv answer reads from
+    """
+    sql = trace.split('SQL:', 1)[-1]
+    return set(re.findall(r"\b(?:FROM|JOIN)\s+`?([A-Za-z_][\w]*)`?", sql, flags=re.IGNORECASE))
+
+
+def load_questions(path: str) -> List[str]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [row['Q'] for row in csv.DictReader(f)]
+
+
+def load_examples(path: str, catalog) -> List[Tuple[str, Set[str]]]:
+    """(question, gold tables) of the qa.csv rows whose SQL reads catalog tables
+    """
+    examples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            gold = {table_name for table_name in sql_tables(row['A']) if table_name in catalog}
+            if gold:
+                examples.append((row['Q'], gold))
+    return examples
+
+
+def percentiles(latencies: List[float]) -> Tuple[float, float]:
+    """p50 and p99 in milliseconds
+    """
+    arr = np.array(latencies) * 1000
+    return np.percentile(arr, 50), np.percentile(arr, 99)
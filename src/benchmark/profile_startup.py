@@ -0,0 +1,100 @@
+"""Server cold-start profile: import-time breakdown and time to the first answer
+
+Each measurement runs in a fresh interpreter. The import breakdown comes from
+python -X importtime, summed per top-level package; the timeline goes from
+process start to the port being bindable (after pre_process), retrieval being
+ready (the warm-up stages), and the first retrieval answer; --kickoff also
+times a full first answer through the agent (needs the LLM endpoint).
+
+Usage (from src/): python -m benchmark.profile_startup --top 15
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_breakdown(module: str) -> Tuple[float, List[Tuple[str, float]]]:
+    """Total import seconds of module and the self time summed per top-level package
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=SRC_DIR, capture_output=True, text=True)
+    per_package: Dict[str, float] = defaultdict(float)
+    total = 0.0
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        per_package[package] += int(self_us) / 1e6
+        if name.strip() == module:
+            total = int(cumulative_us) / 1e6
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else f"import {module} failed")
+    return total, sorted(per_package.items(), key=lambda x: x[1], reverse=True)
+
+
+def timeline(question: str, kickoff: bool) -> None:
+    """Runs in the child interpreter; prints the seconds since start of each milestone as JSON
+    """
+    start = time.perf_counter()
+    marks = {}
+    import llm_rest_api
+    marks['import llm_rest_api'] = time.perf_counter() - start
+    llm_rest_api.pre_process()
+    marks['port bindable'] = time.perf_counter() - start
+    while not llm_rest_api.readiness.wait(0.05) and not llm_rest_api.readiness.failed:
+        pass
+    marks['retrieval ready'] = time.perf_counter() - start
+    from knn_icl import get_knn_schema
+    get_knn_schema().create_structured_table_schema(question, k=3)
+    marks['first retrieval'] = time.perf_counter() - start
+    if kickoff:
+        llm_rest_api.sql_chat_agent.kickoff(question, chat_id=-1)
+        marks['first answer'] = time.perf_counter() - start
+    print(json.dumps({'marks': marks, 'readiness': llm_rest_api.readiness.status()}))
+
+
+def run(top: int, question: str, kickoff: bool):
+    for module in ['llm_rest_api', 'knn_icl']:
+        total, packages = import_breakdown(module)
+        print(f"import {module}: {total:.2f}s")
+        for package, seconds in packages[:top]:
+            print(f"  {package:<28} {seconds:>7.3f}s")
+
+    args = [sys.executable, '-m', 'benchmark.profile_startup', '--child', '--question', question]
+    if kickoff:
+        args.append('--kickoff')
+    proc = subprocess.run(args, cwd=SRC_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stderr)
+        return
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    print("timeline:")
+    for mark, seconds in result['marks'].items():
+        print(f"  {mark:<28} {seconds:>7.2f}s")
+    print("warm-up stages:")
+    for name, stage in result['readiness']['stages'].items():
+        seconds = f"{stage['seconds']:.2f}s" if stage['seconds'] is not None else '-'
+        print(f"  {name:<28} {seconds:>8} {stage['status']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--top', type=int, default=15, help='Packages shown per import breakdown')
+    parser.add_argument('--question', default='How many ASes are there in China?')
+    parser.add_argument('--kickoff', action='store_true', help='Also time a full first answer (calls the LLM)')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        timeline(args.question, args.kickoff)
+    else:
+        run(args.top, args.question, args.kickoff)
@@ -0,0 +1,192 @@
+"""Catalog module, which holds the table catalog with its prompt fragments prebuilt
+"""
+
+import os
+import json
+import hashlib
+import threading
+from types import MappingProxyType
+from typing import Dict, List, Tuple, Mapping, NamedTuple, Any, Callable, Optional
+
+from logger import logger
+
+ONE_TABLE_SCHEMA_CARD = "# Table: {table_name}\tTable description: {descr}"
+ONE_COLUMN_CARD = "## Column {idx}: {col_name}, {col_comment}. Value examples: [{sample_data}]"
+EVIDENCE_CARD = "<Evidence>\n{s}\n"
+
+
+def table_retrieval_text(table_name, item):
+    """The text embedded for a table: schema followed by its description
+    """
+    descr, cols = item['description'], item['column_info']
+    s = f"Table name is {table_name}. It contais the following columns:"
+    cols_format = []
+    for idx, col in enumerate(cols):
+        c = f"{idx+1}.{col[0]}, means {col[1]}"
+        cols_format.append(c)
+    col_str = '\t'.join(cols_format)
+    return s+col_str+'\n'+descr
+
+def column_retrieval_text(col):
+    return f"The column name is {col[0]}, which means {col[1]}"
+
+def column_key(table_name, col_name):
+    """Key of a column in the column index; MySQL table names have no '.'
+    """
+    return f"{table_name}.{col_name}"
+
+def render_table_card(table_name, item):
+    column_sumpup = []
+    for idx, col in enumerate(item['column_info']):
+        column_sumpup.append(ONE_COLUMN_CARD.format(
+            idx=idx+1,
+            col_name=col[0],
+            col_comment=col[1],
+            sample_data=col[2]
+        ))
+    column_prompt = '\n'.join(column_sumpup)
+    return ONE_TABLE_SCHEMA_CARD.format(table_name=table_name, descr=item['description'].strip())+'\n'+column_prompt+'\n'
+
+
+class TableCard(NamedTuple):
+    table_name: str
+    card: str
+    evidence: str
+    retrieval_text: str
+    column_keys: Tuple[str, ...]
+    column_texts: Tuple[str, ...]
+
+
+class Catalog:
+    """Immutable snapshot of auto_dump_table_info.json
+
+    Everything the retrieval and the prompts need per table is rendered once
+    when the catalog version is loaded, so building the schema prompt is only
+    a join of prebuilt fragments.
+    """
+
+    def __init__(self, data: Dict[str, Any], version: str):
+        self.version = version
+        self.data: Mapping[str, Any] = MappingProxyType(data)
+        cards = {}
+        for table_name, item in data.items():
+            column_keys, column_texts = [], []
+            for col in item['column_info']:
+                column_keys.append(column_key(table_name, col[0]))
+                column_texts.append(column_retrieval_text(col))
+            cards[table_name] = TableCard(
+                table_name=table_name,
+                card=render_table_card(table_name, item),
+                evidence=(item.get('evidence') or '').strip(),
+                retrieval_text=table_retrieval_text(table_name, item),
+                column_keys=tuple(column_keys),
+                column_texts=tuple(column_texts),
+            )
+        self.cards: Mapping[str, TableCard] = MappingProxyType(cards)
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def __contains__(self, table_name: str) -> bool:
+        return table_name in self.cards
+
+    @classmethod
+    def load(cls, path: str) -> "Catalog":
+        with open(path, 'rb') as f:
+            raw = f.read()
+        return cls(json.loads(raw), version=hashlib.sha1(raw).hexdigest())
+
+    def table_names(self) -> List[str]:
+        return list(self.cards.keys())
+
+    def table_entries(self) -> Tuple[List[str], List[str]]:
+        """Keys and texts of the table index
+        """
+        table_names = self.table_names()
+        return table_names, [self.cards[table_name].retrieval_text for table_name in table_names]
+
+    def column_entries(self, table_names: Optional[List[str]] = None) -> Tuple[List[str], List[str]]:
+        """Keys and texts of the column index, for all tables or the given ones
+        """
+        key_list, text_list, seen = [], [], set()
+        for table_name in (self.table_names() if table_names is None else table_names):
+            card = self.cards[table_name]
+            for key, text in zip(card.column_keys, card.column_texts):
+                if key in seen:
+                    continue
+                seen.add(key)
+                key_list.append(key)
+                text_list.append(text)
+        return key_list, text_list
+
+    def live_texts(self) -> List[str]:
+        """All the texts whose embeddings should stay in the embedding store
+        """
+        texts = []
+        for card in self.cards.values():
+            texts.append(card.retrieval_text)
+            texts.extend(card.column_texts)
+        return texts
+
+    def render_schema(self, table_names: List[str]) -> str:
+        """The <Table Schema> and <Evidence> prompt for the given tables
+        """
+        cards = [self.cards[table_name] for table_name in table_names]
+        evidence_l = [card.evidence for card in cards if card.evidence]
+        if evidence_l != []:
+            evidence_s = EVIDENCE_CARD.format(s=';'.join(evidence_l))
+        else:
+            evidence_s = EVIDENCE_CARD.format(s='No extra evidence.')
+        final_schema = '<Table Schema>\n' + '\n'.join(card.card for card in cards) + '\n'
+        return final_schema+'\n'+evidence_s
+
+
+class CatalogManager:
+    """Watches the catalog file and hands new versions to on_change from a background thread
+
+    datahub_sync rewrites auto_dump_table_info.json; the file's mtime and size
+    are polled every interval seconds and the content hash decides whether it
+    is a new version. A file that does not parse yet (still being written) is
+    retried on the next tick.
+    """
+
+    def __init__(self, path: str, on_change: Callable[[Catalog], None], version: str, interval: float = 30):
+        self.path = path
+        self.on_change = on_change
+        self.version = version
+        self.interval = interval
+        self._last_stat = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalog-reload', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def check(self) -> bool:
+        """Load and apply the catalog if the file changed; returns whether a new version was applied
+        """
+        stat = os.stat(self.path)
+        file_stat = (stat.st_mtime_ns, stat.st_size)
+        if file_stat == self._last_stat:
+            return False
+        catalog = Catalog.load(self.path)
+        applied = False
+        if catalog.version != self.version:
+            logger.info(f"Catalog changed: {self.version[:8]} -> {catalog.version[:8]}, {len(catalog)} tables")
+            self.on_change(catalog)
+            self.version = catalog.version
+            applied = True
+        self._last_stat = file_stat
+        return applied
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Catalog reload failed: {e}")
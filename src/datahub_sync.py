@@ -1,5 +1,6 @@
 import argparse
 import json
+import os
 from typing import Dict, List
 import pdb
 import random
@@ -139,6 +140,14 @@ def transform_datahub_result(d: dict) -> dict:
             result[table_name][col[0]] = col[1]
     return result
 
+def dump_table_info(result: dict, path: str = './auto_dump_table_info.json'):
+    """Write the catalog atomically, so the server's catalog watcher never reads a half-written file
+    """
+    data = json.dumps(result)
+    with open(path + '.tmp', 'w') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
 def run():
     info(f"[Warm] Start!")
     tables = get_product_tables()
@@ -201,9 +210,7 @@ def run():
     with open('./datahub_cold_raw_info.json', 'w') as f:
         f.write(data)
 
-    data = json.dumps(result)
-    with open('./auto_dump_table_info.json', 'w') as f:
-        f.write(data)
+    dump_table_info(result)
     info(f"[Warm] Done!")
 
 def run_cold_start():
@@ -229,9 +236,7 @@ def run_cold_start():
         result[table_name]['column_info'] = table_column_translated
         time.sleep(1)
 
-    data = json.dumps(result)
-    with open('./auto_dump_table_info.json', 'w') as f:
-        f.write(data)
+    dump_table_info(result)
     info(f"[Cold Start] Done!\tTotal {len(result.keys())}")
 
 def check_datahub_bad_tables():
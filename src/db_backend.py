@@ -0,0 +1,207 @@
+"""DB backend module, which lets MySQLDatabase run on a local SQLite file instead of MySQL
+
+MySQLDatabase talks to the connections of its endpoint pool through the
+pymysql API only, so a backend is an endpoint whose connect() returns a
+pymysql-like connection, plus the capabilities MySQLDatabase checks before a
+MySQL-only feature (EXPLAIN FORMAT=JSON, KILL QUERY, information_schema...).
+With DB_BACKEND = 'sqlite' every endpoint is the SQLite file at SQLITE_PATH,
+which db_fixture.py fills from the table catalog: the agent, the tools and the
+memory run unchanged on it, for benchmarks without a MySQL server.
+"""
+
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+import pymysql
+
+
+class Capabilities(NamedTuple):
+    # EXPLAIN FORMAT=JSON, for the cost gate of RefineTool
+    explain_json: bool
+    # KILL QUERY from another connection (otherwise the connection is interrupted in place)
+    kill_query: bool
+    # MAX_EXECUTION_TIME optimizer hint
+    max_execution_time: bool
+    # DELETE t FROM t JOIN ... and indexed CREATE TEMPORARY TABLE ... SELECT
+    delete_join: bool
+    # information_schema tables (columns, UPDATE_TIME)
+    information_schema: bool
+    # @@ server variables such as max_allowed_packet
+    server_variables: bool
+    # SHOW REPLICA STATUS, read replicas
+    replication: bool
+    # RENAME TABLE a TO b, c TO d, as one atomic statement (otherwise ALTER TABLE ... RENAME TO in a transaction)
+    rename_tables: bool
+
+
+MYSQL_CAPABILITIES = Capabilities(True, True, True, True, True, True, True, True)
+SQLITE_CAPABILITIES = Capabilities(False, False, False, False, False, False, False, False)
+
+# quoted strings, where '%s' is not a placeholder
+_QUOTED_RE = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\")")
+# MySQL statements with a SQLite equivalent
+_REWRITES = [
+    (re.compile(r"^\s*show\s+tables\s*;?\s*$", re.IGNORECASE),
+     "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"),
+    (re.compile(r"^\s*show\s+create\s+table\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE),
+     r"SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name = '\1'"),
+    (re.compile(r"^\s*truncate\s+(?:table\s+)?([\w`.]+)\s*;?\s*$", re.IGNORECASE), r"DELETE FROM \1"),
+]
+
+
+def translate(sql: str, args: Optional[Sequence[Any]] = None) -> Tuple[str, Sequence[Any]]:
+    """SQLite statement and parameters of a pymysql statement: %s placeholders become ?
+    """
+    for pattern, replacement in _REWRITES:
+        match = pattern.match(sql)
+        if match:
+            return match.expand(replacement), ()
+    if args is None:
+        # pymysql leaves a statement without arguments as it is, '%' included
+        return sql, ()
+    if isinstance(args, dict):
+        raise pymysql.err.ProgrammingError(1105, "Named parameters are not supported by the sqlite backend")
+    parts = _QUOTED_RE.split(sql)
+    for idx in range(0, len(parts), 2):
+        parts[idx] = parts[idx].replace('%s', '?').replace('%%', '%')
+    return ''.join(parts), tuple(args)
+
+
+def mysql_error(e: sqlite3.Error) -> pymysql.MySQLError:
+    """The pymysql error MySQL would raise for a SQLite error, so callers and their messages do not change
+    """
+    msg = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        return pymysql.err.IntegrityError(1062, msg)
+    if 'interrupted' in msg:
+        return pymysql.err.OperationalError(1317, 'Query execution was interrupted')
+    if 'no such table' in msg:
+        return pymysql.err.ProgrammingError(1146, msg)
+    if 'no such column' in msg:
+        return pymysql.err.OperationalError(1054, msg)
+    if 'syntax error' in msg:
+        return pymysql.err.ProgrammingError(1064, msg)
+    if 'locked' in msg or 'busy' in msg:
+        return pymysql.err.OperationalError(1205, msg)
+    return pymysql.err.OperationalError(1105, msg)
+
+
+@contextmanager
+def _as_mysql_errors():
+    try:
+        yield
+    except sqlite3.Error as e:
+        raise mysql_error(e) from e
+
+
+class SQLiteCursor():
+    """The subset of a pymysql cursor used by MySQLDatabase; SQLite cursors stream like SSCursor
+    """
+
+    def __init__(self, conn: "SQLiteConnection"):
+        self._cursor = conn._conn.cursor()
+        self.rowcount = -1
+        # read by pymysql's executemany only
+        self.max_stmt_length = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def execute(self, sql: str, args: Optional[Sequence[Any]] = None) -> int:
+        sql, params = translate(sql, args)
+        with _as_mysql_errors():
+            self._cursor.execute(sql, params)
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def executemany(self, sql: str, rows: Sequence[Sequence[Any]]) -> int:
+        sql, _ = translate(sql, ())
+        with _as_mysql_errors():
+            self._cursor.executemany(sql, [tuple(row) for row in rows])
+        self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self) -> Optional[Tuple[Any, ...]]:
+        with _as_mysql_errors():
+            return self._cursor.fetchone()
+
+    def fetchmany(self, size: int) -> List[Tuple[Any, ...]]:
+        with _as_mysql_errors():
+            return self._cursor.fetchmany(size)
+
+    def fetchall(self) -> Tuple[Tuple[Any, ...], ...]:
+        with _as_mysql_errors():
+            return tuple(self._cursor.fetchall())
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SQLiteConnection():
+    """The subset of a pymysql connection used by MySQLDatabase and the pool, in autocommit mode
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 30):
+        # the pool hands a connection to one thread at a time, but not always the same one
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self.open = True
+
+    def cursor(self, cursor_class: Any = None) -> SQLiteCursor:
+        return SQLiteCursor(self)
+
+    def thread_id(self) -> int:
+        return id(self)
+
+    def begin(self) -> None:
+        with _as_mysql_errors():
+            self._conn.execute("BEGIN")
+
+    def commit(self) -> None:
+        if self._conn.in_transaction:
+            with _as_mysql_errors():
+                self._conn.execute("COMMIT")
+
+    def rollback(self) -> None:
+        if self._conn.in_transaction:
+            with _as_mysql_errors():
+                self._conn.execute("ROLLBACK")
+
+    def interrupt(self) -> None:
+        """Stop the running statement, like KILL QUERY
+        """
+        self._conn.interrupt()
+
+    def ping(self, reconnect: bool = False) -> None:
+        if not self.open:
+            raise pymysql.err.InterfaceError(0, 'Connection closed')
+        with _as_mysql_errors():
+            self._conn.execute("SELECT 1")
+
+    def close(self) -> None:
+        if self.open:
+            self.open = False
+            self._conn.close()
+
+
+class SQLiteEndpoint(NamedTuple):
+    name: str
+    path: str
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}:sqlite:{self.path}"
+
+    @property
+    def capabilities(self) -> Capabilities:
+        return SQLITE_CAPABILITIES
+
+    def connect(self) -> SQLiteConnection:
+        return SQLiteConnection(self.path)
@@ -0,0 +1,179 @@
+"""DB fixture module, which builds the SQLite database of DB_BACKEND = 'sqlite' from the table catalog
+
+Every table of auto_dump_table_info.json is created with its columns and
+filled with synthetic rows shaped like the catalog's sample values: integer,
+real, date and datetime columns get values in the range of the samples, text
+columns draw from the samples. The rows only depend on the seed and the scale,
+so two fixtures built with the same arguments give the same benchmark numbers.
+The agent's own tables (user_memory, user_ai_chat_detail) are created empty.
+"""
+
+import os
+import re
+import zlib
+import random
+import sqlite3
+import argparse
+import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from catalog import Catalog
+from memory import MEMORY_DDL, MEMORY_INDEX_DDL, MEMORY_TABLE
+from globals import *
+from logger import logger
+
+_DATETIME_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+AGENT_TABLES = [
+    "DROP TABLE IF EXISTS user_memory",
+    MEMORY_DDL.format(table=MEMORY_TABLE),
+    MEMORY_INDEX_DDL.format(table=MEMORY_TABLE),
+    "CREATE TABLE IF NOT EXISTS user_ai_chat_detail "
+    "(id INTEGER PRIMARY KEY, chat_id INTEGER, content TEXT, content_type INTEGER, create_time TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_user_ai_chat_detail_chat ON user_ai_chat_detail (chat_id, create_time)",
+]
+
+
+def _samples(col: Sequence[Any]) -> List[str]:
+    raw = col[2] if len(col) > 2 and col[2] is not None else ''
+    return [s.strip() for s in str(raw).split(',') if s.strip() and s.strip() != 'None']
+
+
+def _is_int(s: str) -> bool:
+    return re.fullmatch(r"-?\d+", s) is not None
+
+
+def _is_real(s: str) -> bool:
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def column_type(samples: List[str]) -> str:
+    """SQLite type of a column from its sample values: INTEGER, REAL, DATE, DATETIME or TEXT
+    """
+    if not samples:
+        return 'TEXT'
+    if all(_is_int(s) for s in samples):
+        return 'INTEGER'
+    if all(_is_real(s) for s in samples):
+        return 'REAL'
+    if all(_DATETIME_RE.match(s) for s in samples):
+        return 'DATETIME'
+    if all(_DATE_RE.match(s) for s in samples):
+        return 'DATE'
+    return 'TEXT'
+
+
+def value_generator(name: str, col_type: str, samples: List[str]) -> Callable[[random.Random, int], Any]:
+    """Function (rng, row number) -> value of the column
+    """
+    if name == 'id':
+        return lambda rng, i: i + 1
+    if col_type == 'INTEGER':
+        values = [int(s) for s in samples]
+        low, high = min(values), max(values)
+        # a sample of equal values is a flag or a type code: keep it, with a neighbour
+        if low == high:
+            return lambda rng, i: low if rng.random() < 0.8 else low + 1
+        # ids and counters keep growing past the newest sample
+        return lambda rng, i: rng.randint(low, high + (high - low))
+    if col_type == 'REAL':
+        values = [float(s) for s in samples]
+        low, high = min(values), max(values)
+        return lambda rng, i: round(rng.uniform(low, high if high > low else low + 1), 4)
+    if col_type in ('DATE', 'DATETIME'):
+        fmt = '%Y-%m-%d %H:%M:%S' if col_type == 'DATETIME' else '%Y-%m-%d'
+        last = max(datetime.datetime.strptime(s, fmt) for s in samples)
+        if col_type == 'DATETIME':
+            return lambda rng, i: (last - datetime.timedelta(seconds=rng.randint(0, 365 * 86400))).strftime(fmt)
+        return lambda rng, i: (last - datetime.timedelta(days=rng.randint(0, 365))).strftime(fmt)
+    if samples:
+        return lambda rng, i: rng.choice(samples)
+    return lambda rng, i: f'{name}_{rng.randint(0, 999)}'
+
+
+def table_ddl(table: str, columns: List[Tuple[str, str]]) -> str:
+    cols = []
+    for name, col_type in columns:
+        cols.append(f'`{name}` INTEGER PRIMARY KEY' if name == 'id' else f'`{name}` {col_type}')
+    return f"CREATE TABLE `{table}` ({', '.join(cols)})"
+
+
+def synthetic_rows(table: str, column_info: List[Sequence[Any]], n_rows: int, seed: int) -> Iterator[Tuple[Any, ...]]:
+    # one stream per table, so the rows of a table do not depend on the other tables or their order
+    rng = random.Random(seed * 1_000_003 + zlib.crc32(table.encode('utf-8')))
+    generators = []
+    for col in column_info:
+        samples = _samples(col)
+        generators.append(value_generator(col[0], column_type(samples), samples))
+    for i in range(n_rows):
+        yield tuple(gen(rng, i) for gen in generators)
+
+
+def build_fixture(path: str, catalog: Dict[str, Any], rows: int = 1000, table_rows: Optional[Dict[str, int]] = None,
+                  tables: Optional[List[str]] = None, seed: int = 0, chunk_size: int = 10000) -> Dict[str, int]:
+    """
+    (Re)create the catalog tables in the SQLite file at path and fill them; returns the rows per table.
+
+    :param rows:       rows of every table, unless in table_rows
+    :param table_rows: rows per table, e.g. {'bgp_ipv4_prefix': 1_000_000}
+    :param tables:     the catalog tables to build, all if None
+    """
+    table_rows = table_rows or {}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # the file is rebuilt from scratch if the load fails
+    conn.execute("PRAGMA synchronous = OFF")
+    counts = {}
+    try:
+        for table, item in catalog.items():
+            if tables is not None and table not in tables:
+                continue
+            column_info = item['column_info']
+            columns = [(col[0], column_type(_samples(col))) for col in column_info]
+            n_rows = table_rows.get(table, rows)
+            conn.execute(f"DROP TABLE IF EXISTS `{table}`")
+            conn.execute(table_ddl(table, columns))
+            sql = "INSERT INTO `{}` VALUES ({})".format(table, ','.join(['?'] * len(columns)))
+            conn.execute("BEGIN")
+            chunk = []
+            for row in synthetic_rows(table, column_info, n_rows, seed):
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    conn.executemany(sql, chunk)
+                    chunk = []
+            if chunk:
+                conn.executemany(sql, chunk)
+            conn.execute("COMMIT")
+            counts[table] = n_rows
+            logger.info(f"Fixture table {table}: {n_rows} rows")
+        for ddl in AGENT_TABLES:
+            conn.execute(ddl)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=SQLITE_PATH, help='SQLite file to build, SQLITE_PATH by default')
+    parser.add_argument('--catalog', default=TABLE_JSON_PATH)
+    parser.add_argument('--rows', type=int, default=1000, help='Rows per table')
+    parser.add_argument('--table-rows', default='', help='Comma separated table=rows overrides, e.g. bgp_ipv4_prefix=1000000')
+    parser.add_argument('--tables', default='', help='Comma separated tables to build, all catalog tables by default')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    table_rows = {}
+    for item in filter(None, args.table_rows.split(',')):
+        table, n = item.split('=')
+        table_rows[table.strip()] = int(n)
+    tables = [t.strip() for t in args.tables.split(',') if t.strip()] or None
+    counts = build_fixture(args.path, dict(Catalog.load(args.catalog).data), args.rows, table_rows, tables, args.seed)
+    print(f"{len(counts)} tables, {sum(counts.values())} rows written to {args.path}")
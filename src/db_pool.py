@@ -0,0 +1,233 @@
+"""Connection pool module, which keeps MySQL connections open across statements
+
+MySQLDatabase used to open and close a connection per statement to stay clear
+of MySQL's wait_timeout. The pool keeps up to max_size connections instead:
+a connection is pinged when it is checked out, and the idle ones are recycled
+well before wait_timeout by a background reaper.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+from logger import logger
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections
+
+    :param connect:          factory of a new connection
+    :param min_size:         connections kept open (and reopened by the reaper)
+    :param max_size:         connections open at most, in use or idle
+    :param idle_timeout:     idle connections older than this (seconds) are closed
+    :param max_lifetime:     connections older than this are closed when they come back
+    :param checkout_timeout: seconds to wait for a free connection when max_size are in use
+    :param ping_interval:    connections idle longer than this are pinged on checkout; 0 pings every checkout
+    """
+
+    def __init__(self, connect: Callable[[], Any], name: str = 'default', min_size: int = 1, max_size: int = 10,
+                 idle_timeout: float = 300, max_lifetime: float = 3600, checkout_timeout: float = 10,
+                 ping_interval: float = 0, reap_interval: float = 30):
+        self.connect = connect
+        self.name = name
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        # idle connections as (connection, created at, returned at), most recently returned last
+        self._idle: List[Tuple[Any, float, float]] = []
+        # id(connection) -> created at, for the connections checked out
+        self._in_use: Dict[int, float] = {}
+        self._opening = 0
+        self._closed = False
+        self._metrics = {
+            'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0,
+            'timeouts': 0, 'ping_failures': 0, 'discarded': 0, 'recycled': 0, 'max_in_use': 0,
+        }
+        self._reaper = None
+        if reap_interval > 0:
+            self._reaper = threading.Thread(target=self._reap_loop, args=(reap_interval,), name=f'pool-reaper-{name}', daemon=True)
+            self._reaper.start()
+
+    def _size(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def _open(self) -> Tuple[Any, float]:
+        """Open a connection for a slot already reserved in self._opening
+        """
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._metrics['created'] += 1
+        return conn, time.monotonic()
+
+    def _close(self, conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._metrics['closed'] += 1
+
+    def _alive(self, conn: Any) -> bool:
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self) -> Any:
+        """Check out a live connection, opening one if the pool is below max_size
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        waited = False
+        while True:
+            with self._cond:
+                while not self._idle and self._size() >= self.max_size:
+                    if self._closed:
+                        raise PoolTimeout(f"Pool {self.name} is closed")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise PoolTimeout(f"No free connection in pool {self.name} after {self.checkout_timeout}s")
+                    if not waited:
+                        waited = True
+                        self._metrics['waits'] += 1
+                    s = time.monotonic()
+                    self._cond.wait(remaining)
+                    self._metrics['wait_seconds'] += time.monotonic() - s
+                if self._idle:
+                    conn, created_at, returned_at = self._idle.pop()
+                    self._in_use[id(conn)] = created_at
+                else:
+                    conn = None
+                    self._opening += 1
+            if conn is None:
+                conn, created_at = self._open()
+                with self._cond:
+                    self._in_use[id(conn)] = created_at
+            elif time.monotonic() - returned_at >= self.ping_interval and not self._alive(conn):
+                with self._cond:
+                    del self._in_use[id(conn)]
+                    self._metrics['ping_failures'] += 1
+                    self._cond.notify()
+                self._close(conn)
+                continue
+            with self._cond:
+                self._metrics['checkouts'] += 1
+                self._metrics['max_in_use'] = max(self._metrics['max_in_use'], len(self._in_use))
+            return conn
+
+    def release(self, conn: Any, discard: bool = False) -> None:
+        """Return a connection; discard it when it may be broken or mid-transaction
+        """
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+            expired = created_at is None or time.monotonic() - created_at > self.max_lifetime
+            keep = not (discard or expired or self._closed)
+            if keep:
+                self._idle.append((conn, created_at, time.monotonic()))
+            else:
+                self._metrics['discarded' if discard else 'recycled'] += 1
+            self._cond.notify()
+        if not keep:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the with block; it is discarded if the block raises
+        """
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    def _reap_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            if self._closed:
+                return
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Pool {self.name} reaper failed: {e}")
+
+    def reap(self) -> None:
+        """Close the connections idle or alive for too long, then reopen up to min_size
+        """
+        now = time.monotonic()
+        with self._cond:
+            stale, fresh = [], []
+            for item in self._idle:
+                expired = now - item[2] > self.idle_timeout or now - item[1] > self.max_lifetime
+                (stale if expired else fresh).append(item)
+            self._idle = fresh
+            self._metrics['recycled'] += len(stale)
+            missing = max(0, self.min_size - self._size())
+            self._opening += missing
+        for conn, _, _ in stale:
+            self._close(conn)
+        for i in range(missing):
+            try:
+                conn, created_at = self._open()
+            except Exception as e:
+                logger.error(f"Pool {self.name} could not open a connection: {e}")
+                # give back the slots reserved for the connections not attempted
+                with self._cond:
+                    self._opening -= missing - i - 1
+                break
+            with self._cond:
+                self._idle.insert(0, (conn, created_at, time.monotonic()))
+                self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._metrics)
+            stats.update(name=self.name, size=self._size(), in_use=len(self._in_use), idle=len(self._idle),
+                         min_size=self.min_size, max_size=self.max_size)
+            return stats
+
+
+_pools: Dict[Any, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(key: Any, factory: Callable[[], ConnectionPool]) -> ConnectionPool:
+    """Process-wide pool of the given key (e.g. an endpoint), created on first use
+    """
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = factory()
+    return pool
+
+def pool_stats() -> List[Dict[str, Any]]:
+    with _pools_lock:
+        return [pool.stats() for pool in _pools.values()]
@@ -0,0 +1,218 @@
+"""DB routing module, which maps the MySQL endpoints to their pools and picks a read replica
+
+MYSQL_ENDPOINTS names the databases: 'primary' (the product data, takes the
+writes), 'metadata' (the agent's own tables, e.g. user_memory) and any read
+replica of the primary listed in MYSQL_REPLICAS. Every endpoint has its own
+connection pool. Read-only agent queries go to a replica picked round-robin or
+by least latency, skipping replicas lagging more than MYSQL_REPLICA_MAX_LAG.
+"""
+
+import time
+import random
+import itertools
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import pymysql
+import pymysql.cursors
+
+from db_pool import ConnectionPool, get_pool
+from db_backend import MYSQL_CAPABILITIES, Capabilities, SQLiteEndpoint
+from globals import *
+from logger import logger
+
+
+class Endpoint(NamedTuple):
+    name: str
+    host: str
+    port: int
+    user: str
+    password: str
+    db: str
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}:{self.host}:{self.port}/{self.db}"
+
+    @property
+    def capabilities(self) -> Capabilities:
+        return MYSQL_CAPABILITIES
+
+    def connect(self):
+        # autocommit: a pooled connection must not keep a read snapshot open between statements
+        return pymysql.connect(host=self.host, port=self.port, user=self.user,
+                               password=self.password, database=self.db, autocommit=True)
+
+
+def get_endpoint(name: str) -> Endpoint:
+    """Endpoint of MYSQL_ENDPOINTS; 'metadata' falls back to 'primary' when not configured
+
+    With DB_BACKEND = 'sqlite', every endpoint is the SQLite file SQLITE_PATH.
+    """
+    if DB_BACKEND == 'sqlite':
+        return SQLiteEndpoint(name=name, path=SQLITE_PATH)
+    if DB_BACKEND != 'mysql':
+        raise ValueError(f"Unknown DB_BACKEND {DB_BACKEND}")
+    config = MYSQL_ENDPOINTS.get(name)
+    if config is None and name == 'metadata':
+        config = MYSQL_ENDPOINTS['primary']
+    if config is None:
+        raise KeyError(f"Unknown MySQL endpoint {name}")
+    return Endpoint(name=name, **config)
+
+
+def endpoint_pool(endpoint: Endpoint) -> ConnectionPool:
+    """Process-wide pool of the endpoint, created on first use
+    """
+    return get_pool(endpoint, lambda: ConnectionPool(
+        endpoint.connect,
+        name=endpoint.label,
+        min_size=MYSQL_POOL_MIN_SIZE,
+        max_size=MYSQL_POOL_MAX_SIZE,
+        idle_timeout=MYSQL_POOL_IDLE_TIMEOUT,
+        max_lifetime=MYSQL_POOL_MAX_LIFETIME,
+        checkout_timeout=MYSQL_POOL_CHECKOUT_TIMEOUT,
+        ping_interval=MYSQL_POOL_PING_INTERVAL,
+    ))
+
+
+def replica_lag(endpoint: Endpoint) -> Optional[float]:
+    """Seconds the replica is behind its source; None when replication is not running
+    """
+    with endpoint_pool(endpoint).connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+            try:
+                cursor.execute("SHOW REPLICA STATUS")
+            except pymysql.MySQLError:
+                # before MySQL 8.0.22
+                cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone()
+    if not status:
+        return None
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+class ReplicaRouter:
+    """Picks the replica of a read-only query
+
+    :param replicas:      the read replicas of primary
+    :param primary:       where reads go when no replica is usable
+    :param selection:     'round_robin' or 'least_latency' (moving average of the statement seconds)
+    :param max_lag:       replicas more seconds behind are skipped; 0 does not check the lag
+    :param lag_fallback:  when every replica lags: 'primary', or 'least_lagged' to keep off the primary
+    :param check_interval: seconds between the lag checks
+    :param explore:       with 'least_latency', share of the reads sent round robin over the usable
+                          replicas, so a replica that was slow once is measured again
+    :param retry_interval: seconds a replica found unreachable by a read gets no reads
+    :param rng:           random.Random drawing the explored reads, seeded in tests
+    """
+
+    def __init__(self, replicas: List[Endpoint], primary: Endpoint, selection: str = 'round_robin',
+                 max_lag: float = 30, lag_fallback: str = 'primary', check_interval: float = 10,
+                 explore: float = 0.05, retry_interval: float = 10, rng: Optional[random.Random] = None):
+        if selection not in ('round_robin', 'least_latency'):
+            raise ValueError(f"Unknown replica selection {selection}")
+        if lag_fallback not in ('primary', 'least_lagged'):
+            raise ValueError(f"Unknown replica lag fallback {lag_fallback}")
+        self.replicas = replicas
+        self.primary = primary
+        self.selection = selection
+        self.max_lag = max_lag
+        self.lag_fallback = lag_fallback
+        self.explore = explore
+        self.retry_interval = retry_interval
+        self._random = rng if rng is not None else random.Random()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # replica -> seconds behind (inf when unknown or unreachable), moving average latency, reads
+        self._lag: Dict[Endpoint, float] = {replica: 0.0 for replica in replicas}
+        self._latency: Dict[Endpoint, float] = {replica: 0.0 for replica in replicas}
+        self._reads: Dict[Endpoint, int] = {endpoint: 0 for endpoint in replicas + [primary]}
+        # replica -> time.monotonic() until which it gets no reads
+        self._down_until: Dict[Endpoint, float] = {}
+        self._checker = None
+        # the replicas count as in sync until the first check, which runs in the background
+        if replicas and max_lag > 0 and check_interval > 0:
+            self._checker = threading.Thread(target=self._check_loop, args=(check_interval,),
+                                             name='replica-lag-checker', daemon=True)
+            self._checker.start()
+
+    def _check_loop(self, interval: float) -> None:
+        while True:
+            self.check_lag()
+            time.sleep(interval)
+
+    def check_lag(self) -> None:
+        for replica in self.replicas:
+            try:
+                lag = replica_lag(replica)
+            except Exception as e:
+                logger.error(f"Replica {replica.label} lag check failed: {e}")
+                lag = None
+            with self._lock:
+                self._lag[replica] = float('inf') if lag is None else lag
+
+    def choose(self) -> Endpoint:
+        with self._lock:
+            if not self.replicas:
+                endpoint = self.primary
+            else:
+                now = time.monotonic()
+                reachable = [r for r in self.replicas if self._down_until.get(r, 0.0) <= now]
+                usable = [r for r in reachable if self.max_lag <= 0 or self._lag[r] <= self.max_lag]
+                if usable:
+                    if self.selection == 'least_latency' and self._random.random() >= self.explore:
+                        endpoint = min(usable, key=lambda r: self._latency[r])
+                    else:
+                        endpoint = usable[next(self._counter) % len(usable)]
+                elif self.lag_fallback == 'least_lagged' and reachable:
+                    endpoint = min(reachable, key=lambda r: self._lag[r])
+                else:
+                    endpoint = self.primary
+            self._reads[endpoint] += 1
+            return endpoint
+
+    def mark_unreachable(self, endpoint: Endpoint, error: Any = None) -> None:
+        """Send no read to the replica for retry_interval seconds, e.g. after a connect to it failed
+        """
+        with self._lock:
+            if endpoint not in self._lag:
+                return
+            self._down_until[endpoint] = time.monotonic() + self.retry_interval
+        logger.error(f"Replica {endpoint.label} unreachable, no reads for {self.retry_interval}s: {error}")
+
+    def record_latency(self, endpoint: Endpoint, seconds: float, alpha: float = 0.2) -> None:
+        with self._lock:
+            if endpoint in self._latency:
+                previous = self._latency[endpoint]
+                self._latency[endpoint] = seconds if previous == 0.0 else (1 - alpha) * previous + alpha * seconds
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            # lag None: the primary, or a replica not replicating / unreachable
+            return [{'endpoint': endpoint.label, 'reads': self._reads[endpoint],
+                     'lag': None if self._lag.get(endpoint, float('inf')) == float('inf') else self._lag[endpoint],
+                     'latency': self._latency.get(endpoint)}
+                    for endpoint in self.replicas + [self.primary]]
+
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_router() -> ReplicaRouter:
+    """Process-wide ReplicaRouter over MYSQL_REPLICAS
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                primary = get_endpoint('primary')
+                replicas = []
+                if primary.capabilities.replication:
+                    replicas = [Endpoint(name=f'replica{idx}', **config) for idx, config in enumerate(MYSQL_REPLICAS)]
+                _router = ReplicaRouter(replicas, primary, MYSQL_REPLICA_SELECTION,
+                                        MYSQL_REPLICA_MAX_LAG, MYSQL_REPLICA_LAG_FALLBACK,
+                                        MYSQL_REPLICA_CHECK_INTERVAL, MYSQL_REPLICA_EXPLORE,
+                                        MYSQL_REPLICA_RETRY_INTERVAL)
+    return _router
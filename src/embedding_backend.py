@@ -0,0 +1,155 @@
+"""Embedding backend module, which lets KNNSchema encode with torch or ONNX Runtime
+
+Backends:
+    torch       SentenceTransformer fp32, the reference
+    onnx        ONNX Runtime export of the same model, CPU
+    onnx_int8   the ONNX export with dynamically quantized int8 weights
+    remote      the shared sidecar of embedding_service.py
+
+Export the ONNX models once with:
+    python embedding_backend.py --export
+Then set EMBEDDING_BACKEND in globals.py, and check the retrieval still agrees
+with the fp32 model with benchmark/check_backend_agreement.py.
+"""
+
+import os
+import argparse
+from abc import ABC, abstractmethod
+from typing import List
+
+import numpy as np
+
+from globals import *
+from logger import logger
+
+
+def l2_normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+
+
+class EmbeddingBackend(ABC):
+    """Encodes texts into L2-normalized float32 vectors
+    """
+    name: str = "base"
+
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+
+    @property
+    def model_name(self) -> str:
+        """Identifies the vectors this backend produces, for the store and the index fingerprints
+        """
+        return f"{self.model_path}:{self.name}"
+
+    @abstractmethod
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """(len(texts), dim) L2-normalized float32 embeddings
+        """
+
+
+class TorchBackend(EmbeddingBackend):
+    name = "torch"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_path)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+        return embeddings.astype('float32')
+
+
+class OnnxBackend(EmbeddingBackend):
+    """bge-m3 dense embedding (CLS pooling) with ONNX Runtime on CPU
+    """
+    name = "onnx"
+
+    def __init__(self, model_path: str, onnx_path: str, max_length: int = EMBEDDING_MAX_LENGTH):
+        super().__init__(model_path)
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        self.onnx_path = onnx_path
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_INTRA_OP_THREADS > 0:
+            options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 0), dtype='float32')
+        result = []
+        # sort by length so each batch pads to a similar length
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            inputs = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_length, return_tensors='np')
+            feed = {name: value.astype('int64') for name, value in inputs.items() if name in self.input_names}
+            last_hidden_state = self.session.run(None, feed)[0]
+            result.append(last_hidden_state[:, 0])
+        embeddings = np.empty((len(texts), result[0].shape[1]), dtype='float32')
+        embeddings[order] = np.concatenate(result)
+        return l2_normalize(embeddings)
+
+
+class OnnxInt8Backend(OnnxBackend):
+    name = "onnx_int8"
+
+
+def create_backend(name: str = EMBEDDING_BACKEND, model_path: str = EMBEDDING_MODEL_PATH) -> EmbeddingBackend:
+    if name == 'torch':
+        return TorchBackend(model_path)
+    elif name == 'onnx':
+        return OnnxBackend(model_path, ONNX_MODEL_PATH)
+    elif name == 'onnx_int8':
+        return OnnxInt8Backend(model_path, ONNX_INT8_MODEL_PATH)
+    elif name == 'remote':
+        # the sidecar of embedding_service.py, which decides the model
+        from embedding_service import RemoteBackend
+        return RemoteBackend()
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+
+def export_onnx(model_path: str = EMBEDDING_MODEL_PATH, onnx_path: str = ONNX_MODEL_PATH, int8_path: str = ONNX_INT8_MODEL_PATH):
+    """Export the transformer to ONNX and write a dynamically quantized int8 copy
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model = AutoModel.from_pretrained(model_path).eval()
+    dummy = tokenizer(["export"], return_tensors='pt')
+    logger.info(f"Exporting {model_path} to {onnx_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy['input_ids'], dummy['attention_mask']),
+            onnx_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'last_hidden_state': {0: 'batch', 1: 'sequence'},
+            },
+            opset_version=17,
+        )
+    logger.info(f"Quantizing {onnx_path} to {int8_path}")
+    # bge-m3 is larger than the 2GB protobuf limit, so the weights live in external data
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+    tokenizer.save_pretrained(os.path.dirname(onnx_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--export', action='store_true', help='Export the ONNX fp32 and int8 models')
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx()
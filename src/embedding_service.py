@@ -0,0 +1,375 @@
+"""Embedding service module, a local sidecar that owns the embedding model and the retrieval indexes
+
+Several server workers share one bge-m3 model instead of loading one each.
+The sidecar listens on a Unix socket; concurrent encode requests from all
+connections (and the encodes of its own KNNSchema) are micro-batched into
+single backend.encode calls. Workers use it through:
+    RemoteBackend      EMBEDDING_BACKEND = 'remote', KNNSchema keeps its indexes locally
+    RemoteKNNSchema    USE_EMBEDDING_SERVICE = True, retrieval itself runs in the sidecar
+
+Start it with:
+    python embedding_service.py --socket ./model/embedding.sock
+
+Wire format: every message is a frame of two big-endian uint32 lengths, a
+JSON header and a binary payload (float32 embeddings, row-major).
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+from typing import List, Dict, Tuple, Any, Optional, Callable
+
+import numpy as np
+
+from catalog import Catalog, CatalogManager
+from embedding_backend import EmbeddingBackend, create_backend
+from globals import *
+from logger import logger
+
+FRAME_HEADER = struct.Struct('!II')
+# KNNSchema methods a client may call; their results must be JSON serializable
+REMOTE_METHODS = {
+    'get_topk_knowledge_v2',
+    'get_topk_knowledge_from_column',
+    'create_structured_table_schema',
+    'create_structured_table_schema_2',
+    'rerank',
+}
+
+
+class EmbeddingServiceError(Exception):
+    """Raised on the client for errors reported by the sidecar"""
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any], payload: bytes = b'') -> None:
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(FRAME_HEADER.pack(len(data), len(payload)) + data + payload)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytes]:
+    header_len, payload_len = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    header = json.loads(_recv_exact(sock, header_len))
+    payload = _recv_exact(sock, payload_len) if payload_len else b''
+    return header, payload
+
+
+def encode_array(embeddings: np.ndarray) -> Tuple[Dict[str, Any], bytes]:
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    return {'shape': list(embeddings.shape)}, embeddings.tobytes()
+
+
+def decode_array(header: Dict[str, Any], payload: bytes) -> np.ndarray:
+    return np.frombuffer(payload, dtype='float32').reshape(header['shape']).copy()
+
+
+class MicroBatcher:
+    """Merges concurrent encode requests into one encode call
+
+    A batch is closed when it holds max_batch texts or max_wait seconds after
+    its first request arrived, whichever comes first; duplicate texts in a
+    batch are encoded once.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch: int, max_wait: float):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'texts': self.texts,
+                'mean_batch_texts': self.texts / self.batches if self.batches else 0.0,
+            }
+
+    def _run(self) -> None:
+        while True:
+            pending = [self._queue.get()]
+            n_texts = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_texts < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                n_texts += len(item[0])
+            self._encode_batch(pending)
+
+    def _encode_batch(self, pending: List[Tuple[List[str], Future]]) -> None:
+        unique = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+        try:
+            embeddings = self.encode(unique) if unique else np.zeros((0, 0), dtype='float32')
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        rows = dict(zip(unique, embeddings))
+        for texts, future in pending:
+            if texts:
+                future.set_result(np.stack([rows[text] for text in texts]))
+            else:
+                future.set_result(np.zeros((0, embeddings.shape[1] if embeddings.ndim == 2 else 0), dtype='float32'))
+        with self._lock:
+            self.batches += 1
+            self.requests += len(pending)
+            self.texts += len(unique)
+
+
+class BatchingBackend(EmbeddingBackend):
+    """Backend of the sidecar: every encode goes through the micro-batcher of the wrapped backend
+    """
+
+    def __init__(self, backend: EmbeddingBackend, max_batch: int = EMBEDDING_SERVICE_MAX_BATCH,
+                 max_wait: float = EMBEDDING_SERVICE_MAX_WAIT_MS / 1000):
+        super().__init__(backend.model_path)
+        self.backend = backend
+        self.name = backend.name
+        self.batcher = MicroBatcher(lambda texts: backend.encode(texts, batch_size=max_batch), max_batch, max_wait)
+
+    @property
+    def model_name(self) -> str:
+        return self.backend.model_name
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.batcher.submit(texts).result()
+
+
+class EmbeddingServiceHandler(socketserver.BaseRequestHandler):
+    """One client connection; requests on it are served in order
+    """
+
+    def handle(self) -> None:
+        while True:
+            try:
+                header, payload = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                response, response_payload = self.server.dispatch(header)
+                response['ok'] = True
+            except Exception as e:
+                logger.error(f"Embedding service request {header.get('op')} failed: {e}")
+                response, response_payload = {'ok': False, 'error': f"{type(e).__name__}: {e}"}, b''
+            try:
+                send_message(self.request, response, response_payload)
+            except OSError:
+                return
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # every thread of every worker opens its own connection
+    request_queue_size = 128
+
+    def __init__(self, path: str, knn_schema):
+        if os.path.exists(path):
+            # a stale socket of a previous run
+            os.unlink(path)
+        self.knn_schema = knn_schema
+        super().__init__(path, EmbeddingServiceHandler)
+
+    def dispatch(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        op = header.get('op')
+        backend = self.knn_schema.backend
+        if op == 'encode':
+            return encode_array(backend.encode(header['texts']))
+        elif op == 'embed_query':
+            return encode_array(self.knn_schema.embed_query(header['query']).reshape(1, -1))
+        elif op == 'call':
+            method = header['method']
+            if method not in REMOTE_METHODS:
+                raise ValueError(f"Method {method} is not served")
+            return {'result': getattr(self.knn_schema, method)(**header.get('kwargs', {}))}, b''
+        elif op == 'info':
+            return {'model_name': backend.model_name, 'backend': backend.name,
+                    'catalog_version': self.knn_schema.snapshot.catalog.version}, b''
+        elif op == 'stats':
+            return {'batcher': backend.batcher.stats(), 'query_cache': self.knn_schema.query_cache.stats()}, b''
+        raise ValueError(f"Unknown op: {op}")
+
+
+class EmbeddingServiceClient:
+    """Client of the sidecar; each thread keeps its own connection
+    """
+
+    def __init__(self, path: str = EMBEDDING_SERVICE_SOCKET, timeout: float = EMBEDDING_SERVICE_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def request(self, header: Dict[str, Any], payload: bytes = b'') -> Tuple[Dict[str, Any], bytes]:
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                send_message(sock, header, payload)
+                response, response_payload = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                # the sidecar restarted: reconnect once
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if attempt == 1:
+                    raise
+        if not response.get('ok'):
+            raise EmbeddingServiceError(response.get('error'))
+        return response, response_payload
+
+    def wait_ready(self, timeout: float = EMBEDDING_SERVICE_CONNECT_TIMEOUT) -> Dict[str, Any]:
+        """info() of the sidecar, retrying while it is still starting
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.info()
+            except (ConnectionError, OSError):
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.5)
+
+    def info(self) -> Dict[str, Any]:
+        return self.request({'op': 'info'})[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return self.request({'op': 'stats'})[0]
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return decode_array(*self.request({'op': 'encode', 'texts': list(texts)}))
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return decode_array(*self.request({'op': 'embed_query', 'query': query}))[0]
+
+    def call(self, method: str, **kwargs) -> Any:
+        return self.request({'op': 'call', 'method': method, 'kwargs': kwargs})[0]['result']
+
+
+class RemoteBackend(EmbeddingBackend):
+    """Encodes through the sidecar; named after the sidecar's model, so the store entries are shared
+    """
+    name = "remote"
+
+    def __init__(self, client: Optional[EmbeddingServiceClient] = None):
+        self.client = client or EmbeddingServiceClient()
+        info = self.client.wait_ready()
+        super().__init__(info['model_name'])
+        self._model_name = info['model_name']
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.client.encode(texts)
+
+
+class RemoteKNNSchema:
+    """Drop-in for KNNSchema whose retrieval runs in the sidecar
+    """
+
+    def __init__(self, client: Optional[EmbeddingServiceClient] = None, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.client = client or EmbeddingServiceClient()
+        self.backend = RemoteBackend(self.client)
+        self.batch_size = batch_size
+        self.catalog_manager = None
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+
+    @property
+    def catalog(self) -> Catalog:
+        """The catalog the sidecar serves, loaded from the same file in this process on first use
+        and hot reloaded like KNNSchema's
+        """
+        if self._catalog is None:
+            with self._catalog_lock:
+                if self._catalog is None:
+                    catalog = Catalog.load(TABLE_JSON_PATH)
+                    if CATALOG_RELOAD_INTERVAL > 0:
+                        self.catalog_manager = CatalogManager(TABLE_JSON_PATH, on_change=self._set_catalog,
+                                                              version=catalog.version,
+                                                              interval=CATALOG_RELOAD_INTERVAL)
+                        self.catalog_manager.start()
+                    self._catalog = catalog
+        return self._catalog
+
+    def _set_catalog(self, catalog: Catalog) -> None:
+        self._catalog = catalog
+
+    def embed_query(self, query):
+        return self.client.embed_query(query)
+
+    def get_topk_knowledge_v2(self, query, exclude_list=[], k=5, **kwargs):
+        return self.client.call('get_topk_knowledge_v2', query=query, exclude_list=list(exclude_list), k=k, **kwargs)
+
+    def get_topk_knowledge_from_column(self, query, exclude_list=[], k=5):
+        return self.client.call('get_topk_knowledge_from_column', query=query, exclude_list=list(exclude_list), k=k)
+
+    def create_structured_table_schema(self, query, exclude_list=[], k=5):
+        schema, table_list = self.client.call('create_structured_table_schema', query=query, exclude_list=list(exclude_list), k=k)
+        return schema, table_list
+
+    def create_structured_table_schema_2(self, query, exclude_list=[], k=5):
+        return self.client.call('create_structured_table_schema_2', query=query, exclude_list=list(exclude_list), k=k)
+
+    def rerank(self, query, table_list, k=5):
+        return self.client.call('rerank', query=query, table_list=list(table_list), k=k)
+
+
+def serve(path: str = EMBEDDING_SERVICE_SOCKET) -> None:
+    from knn_icl import KNNSchema
+    if EMBEDDING_BACKEND == 'remote':
+        raise ValueError("The embedding service needs a local EMBEDDING_BACKEND, not 'remote'")
+    backend = BatchingBackend(create_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL_PATH))
+    knn_schema = KNNSchema(backend=backend)
+    with EmbeddingServer(path, knn_schema) as server:
+        logger.info(f"Embedding service on {path} ({backend.model_name})")
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default=EMBEDDING_SERVICE_SOCKET, help='Unix socket path')
+    args = parser.parse_args()
+    serve(args.socket)
@@ -0,0 +1,208 @@
+"""Embedding store module, which persists the embeddings of the schema texts
+
+Layout of the store directory, one per model under the store path:
+    MANIFEST            current generation number
+    emb.<gen>.npy       (n, dim) matrix in .npy format, memory-mapped read-only
+    emb.<gen>.keys      n digests of (model name, text), row i <-> digest i
+    LOCK                flock'ed by writers, shared by readers while they map a generation
+
+The store is append-only: a writer appends the rows to the .npy file first and
+the digests afterwards, so readers never see a digest whose row is not written.
+Compaction writes a new generation and switches MANIFEST atomically; readers
+notice the new generation and remap; compaction deletes the old files only
+once no reader is between reading MANIFEST and mapping them. Every process maps the same files, so the
+pages are shared by the OS instead of being unpickled into each worker.
+"""
+
+import os
+import re
+import fcntl
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Iterable, Optional
+
+import numpy as np
+
+from logger import logger
+
+DIGEST_SIZE = 16
+# Fixed header size, so the shape in the header can be rewritten in place
+HEADER_SIZE = 128
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def text_digest(model_name: str, text: str) -> bytes:
+    return hashlib.blake2b(f"{model_name}\0{text}".encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+def _write_npy_header(f, dtype: np.dtype, n: int, dim: int) -> None:
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}, {}), }}".format(dtype.str, n, dim)
+    header_len = HEADER_SIZE - len(NPY_MAGIC) - 2
+    header = header.ljust(header_len - 1) + '\n'
+    f.seek(0)
+    f.write(NPY_MAGIC + header_len.to_bytes(2, 'little') + header.encode('latin1'))
+
+
+class EmbeddingStore:
+    """Append-only, memory-mapped embedding store keyed by hash(model name, text)
+    """
+
+    def __init__(self, path: str, model_name: str, dtype: str = 'float16'):
+        # a model of its own directory: compacting a model's rows never sees the others', nor their dim
+        self.path = os.path.join(path, re.sub(r'[^\w.-]', '_', model_name))
+        self.model_name = model_name
+        self.dtype = np.dtype(dtype)
+        self.dim: Optional[int] = None
+        self.generation = -1
+        self.digest2row: Dict[bytes, int] = {}
+        self.matrix: Optional[np.memmap] = None
+        self.n_rows = 0
+        self._keys_size = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        with self._file_lock(fcntl.LOCK_SH):
+            self._refresh()
+
+    def __len__(self) -> int:
+        return len(self.digest2row)
+
+    def _file(self, suffix: str, generation: int) -> str:
+        return os.path.join(self.path, f"emb.{generation}.{suffix}")
+
+    def _read_generation(self) -> int:
+        try:
+            with open(os.path.join(self.path, 'MANIFEST'), 'r') as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+
+    def _write_generation(self, generation: int) -> None:
+        manifest = os.path.join(self.path, 'MANIFEST')
+        with open(manifest + '.tmp', 'w') as f:
+            f.write(str(generation))
+        os.replace(manifest + '.tmp', manifest)
+
+    @contextmanager
+    def _file_lock(self, operation: int = fcntl.LOCK_EX):
+        with open(os.path.join(self.path, 'LOCK'), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """Pick up rows appended by other processes, or a new generation after compaction
+
+        Called with the LOCK held, shared or exclusive, so the generation read is not removed under it.
+        """
+        generation = self._read_generation()
+        if generation != self.generation:
+            self.generation = generation
+            self.digest2row = {}
+            self.matrix = None
+            self.n_rows = 0
+            self._keys_size = 0
+        keys_path = self._file('keys', generation)
+        try:
+            keys_size = os.path.getsize(keys_path)
+        except FileNotFoundError:
+            return
+        keys_size -= keys_size % DIGEST_SIZE
+        if keys_size == self._keys_size:
+            return
+
+        with open(keys_path, 'rb') as f:
+            f.seek(self._keys_size)
+            raw = f.read(keys_size - self._keys_size)
+        for i in range(0, len(raw), DIGEST_SIZE):
+            self.digest2row[raw[i:i + DIGEST_SIZE]] = self.n_rows
+            self.n_rows += 1
+        self._keys_size = keys_size
+
+        matrix_path = self._file('npy', generation)
+        if self.dim is None:
+            self.dim = np.load(matrix_path, mmap_mode='r').shape[1]
+        self.matrix = np.memmap(matrix_path, dtype=self.dtype, mode='r', offset=HEADER_SIZE,
+                                shape=(self.n_rows, self.dim))
+
+    def get(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Embeddings of the texts (float32), None for the texts not in the store
+        """
+        with self._lock:
+            digests = [text_digest(self.model_name, text) for text in texts]
+            if any(digest not in self.digest2row for digest in digests):
+                with self._file_lock(fcntl.LOCK_SH):
+                    self._refresh()
+            result = []
+            for digest in digests:
+                row = self.digest2row.get(digest)
+                result.append(None if row is None else np.asarray(self.matrix[row], dtype='float32'))
+            return result
+
+    def add(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """Append the embeddings of new texts
+        """
+        if len(texts) == 0:
+            return
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        with self._lock, self._file_lock():
+            self._refresh()
+            pending: Dict[bytes, int] = {}
+            for i, text in enumerate(texts):
+                digest = text_digest(self.model_name, text)
+                if digest not in self.digest2row and digest not in pending:
+                    pending[digest] = i
+            if not pending:
+                return
+            rows = embeddings[list(pending.values())]
+            self._append(self.generation, list(pending.keys()), rows)
+            self._refresh()
+
+    def _append(self, generation: int, digests: List[bytes], rows: np.ndarray) -> None:
+        n, dim = self.n_rows, rows.shape[1]
+        if self.dim is not None and dim != self.dim:
+            raise ValueError(f"Embedding dim {dim} does not match the store dim {self.dim}")
+        matrix_path = self._file('npy', generation)
+        mode = 'r+b' if os.path.exists(matrix_path) else 'w+b'
+        with open(matrix_path, mode) as f:
+            f.seek(HEADER_SIZE + n * dim * self.dtype.itemsize)
+            f.write(rows.tobytes())
+            f.truncate()
+            _write_npy_header(f, self.dtype, n + len(rows), dim)
+            f.flush()
+            os.fsync(f.fileno())
+        # the digests are the commit point for readers
+        with open(self._file('keys', generation), 'ab') as f:
+            f.write(b''.join(digests))
+
+    def compact(self, live_texts: Iterable[str], min_dead_ratio: float = 0.2) -> bool:
+        """Drop the rows of texts that are no longer live, e.g. after table descriptions changed
+
+        Returns whether a new generation was written.
+        """
+        with self._lock, self._file_lock():
+            self._refresh()
+            if not self.digest2row:
+                return False
+            live = {text_digest(self.model_name, text) for text in live_texts}
+            keep = [(digest, row) for digest, row in self.digest2row.items() if digest in live]
+            dead = len(self.digest2row) - len(keep)
+            if dead == 0 or dead / len(self.digest2row) < min_dead_ratio:
+                return False
+
+            old_generation, new_generation = self.generation, self.generation + 1
+            rows = np.asarray(self.matrix[[row for _, row in keep]]) if keep else np.zeros((0, self.dim), dtype=self.dtype)
+            for suffix in ('npy', 'keys'):
+                if os.path.exists(self._file(suffix, new_generation)):
+                    os.remove(self._file(suffix, new_generation))
+            self.n_rows = 0
+            self._append(new_generation, [digest for digest, _ in keep], rows)
+            self._write_generation(new_generation)
+            # processes that still map the old files keep them alive until they remap
+            for suffix in ('npy', 'keys'):
+                os.remove(self._file(suffix, old_generation))
+            self._refresh()
+            logger.info(f"Compacted embedding store: kept {len(keep)} rows, dropped {dead}")
+            return True
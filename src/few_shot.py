@@ -0,0 +1,137 @@
+"""Few-shot module, which retrieves worked traces from rag_file/qa.csv for the ReAct prompt
+
+Each example is a question with its Thought/Action trace and final SQL. The
+questions are embedded once into a FAISS index (rebuilt when qa.csv or the
+embedding model changes); for every sub-question the most similar traces are
+put into the <Examples> section of sql_react_prompt, as many as fit in the
+token budget.
+"""
+
+import re
+import csv
+import argparse
+import threading
+from typing import List, Dict, NamedTuple, Iterable
+
+import numpy as np
+
+from vector_index import VectorIndex
+from globals import *
+from logger import logger
+
+EXAMPLE_CARD = "Question: {question}\n{trace}"
+
+
+class FewShotExample(NamedTuple):
+    key: str
+    question: str
+    trace: str
+
+
+def clean_trace(trace: str) -> str:
+    """Drop the literal '\\n' the traces carry at their line ends, and blank lines
+    """
+    lines = [re.sub(r"(\\n)+\s*$", "", line).rstrip() for line in trace.strip().splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+
+def load_examples(path: str = QA_PATH) -> List[FewShotExample]:
+    examples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for idx, row in enumerate(csv.DictReader(f)):
+            if row.get('Q') and row.get('A'):
+                examples.append(FewShotExample(key=str(idx), question=row['Q'].strip(), trace=clean_trace(row['A'])))
+    return examples
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for the budget, about 4 characters per token for English and SQL
+    """
+    return max(len(text) // 4, len(text.split()))
+
+
+class FewShotIndex:
+    """Vector index over the example questions, with the examples it was built from
+    """
+
+    def __init__(self, examples: List[FewShotExample], index: VectorIndex):
+        self.examples: Dict[str, FewShotExample] = {example.key: example for example in examples}
+        self.index = index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @classmethod
+    def load_or_build(cls, knn_schema, path: str = QA_PATH, index_path: str = FEW_SHOT_INDEX_PATH,
+                      force: bool = False) -> "FewShotIndex":
+        """Load the on-disk index, rebuilding it when qa.csv or the embedding model changed
+        """
+        examples = load_examples(path)
+        keys, texts = [example.key for example in examples], [example.question for example in examples]
+        fingerprint = VectorIndex.make_fingerprint(knn_schema.backend.model_name, keys, texts)
+        index = None if force else VectorIndex.load(index_path)
+        if index is None or index.fingerprint != fingerprint:
+            logger.info(f"Building {index_path} with {len(keys)} examples")
+            embeddings = knn_schema.backend.encode(texts, batch_size=knn_schema.batch_size)
+            index = VectorIndex.build(keys, embeddings, fingerprint=fingerprint)
+            index.save(index_path)
+        return cls(examples, index)
+
+    def without(self, questions: Iterable[str]) -> "FewShotIndex":
+        """Copy without the examples of the given questions, for leave-one-out evaluation
+        """
+        questions = set(questions)
+        index = self.index.copy()
+        index.remove([key for key, example in self.examples.items() if example.question in questions])
+        return FewShotIndex([example for example in self.examples.values() if example.question not in questions], index)
+
+    def search(self, query_embedding: np.ndarray, k: int = FEW_SHOT_K,
+               min_similarity: float = FEW_SHOT_MIN_SIMILARITY) -> List[FewShotExample]:
+        result = []
+        for key, distance in self.index.search(query_embedding, k):
+            # squared L2 distance of unit vectors -> cosine similarity
+            if 1 - distance / 2 >= min_similarity:
+                result.append(self.examples[key])
+        return result
+
+    def render(self, query_embedding: np.ndarray, k: int = FEW_SHOT_K,
+               token_budget: int = FEW_SHOT_TOKEN_BUDGET) -> str:
+        """The most similar traces, best first, skipping those that would exceed the token budget
+        """
+        cards, used = [], 0
+        for example in self.search(query_embedding, k):
+            card = EXAMPLE_CARD.format(question=example.question, trace=example.trace)
+            tokens = estimate_tokens(card)
+            if used + tokens > token_budget:
+                continue
+            cards.append(card)
+            used += tokens
+        if not cards:
+            return "None"
+        return '\n\n'.join(f"# Example {idx+1}\n{card}" for idx, card in enumerate(cards))
+
+
+_few_shot_index = None
+_few_shot_index_lock = threading.Lock()
+
+def get_few_shot_index() -> FewShotIndex:
+    """Process-wide FewShotIndex, built on first use with the shared KNNSchema's embedding backend
+    """
+    global _few_shot_index
+    if _few_shot_index is None:
+        with _few_shot_index_lock:
+            if _few_shot_index is None:
+                from knn_icl import get_knn_schema
+                _few_shot_index = FewShotIndex.load_or_build(get_knn_schema())
+    return _few_shot_index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build-index', action='store_true', help='Build the few-shot index from QA_PATH if it is stale')
+    parser.add_argument('--force', action='store_true', help='Rebuild the index even if it is up to date')
+    args = parser.parse_args()
+
+    if args.build_index:
+        from knn_icl import KNNSchema
+        FewShotIndex.load_or_build(KNNSchema(watch_catalog=False), force=args.force)
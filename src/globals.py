@@ -2,6 +2,140 @@ global QA_PATH
 global TABLE_PATH
 QA_PATH = './rag_file/qa.csv'
 TABLE_JSON_PATH = './rag_file/auto_dump_table_info.json'
+# Prebuilt FAISS index over the table embeddings, rebuilt when the catalog changes
+TABLE_INDEX_PATH = './model/table_index.faiss'
+# Column-granularity index; a query takes COLUMN_HITS_PER_TABLE*k column hits to score the tables
+COLUMN_INDEX_PATH = './model/column_index.faiss'
+COLUMN_HITS_PER_TABLE = 3
+# Bounded LRU/TTL cache of the user question embeddings, kept apart from the schema store
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 3600
+# Hybrid table retrieval: weight of the BM25 scores fused with the dense scores (0 = dense only),
+# and how many candidates per requested table each retriever contributes
+HYBRID_LEXICAL_WEIGHT = 0.3
+HYBRID_CANDIDATES_PER_K = 4
+# Seconds between checks of TABLE_JSON_PATH for a new catalog version; 0 disables hot reload
+CATALOG_RELOAD_INTERVAL = 30
+# Cross-encoder reranker, loaded once per process
+RERANKER_PATH = './model/bge-reranker-large'
+RERANKER_BATCH_SIZE = 32
+RERANKER_MAX_LENGTH = 512
+# Rerank results cached per (query, candidate set); size 0 disables the cache
+RERANK_CACHE_SIZE = 1024
+RERANK_CACHE_TTL = 3600
+# MySQL endpoints, one connection pool each: 'primary' holds the product data and takes the writes,
+# 'metadata' the agent's own tables (MySQLDatabase(in_product=False); the primary if not set)
+MYSQL_ENDPOINTS = {
+    'primary': {'host': 'localhost', 'port': 3306, 'user': 'root', 'password': '****', 'db': 'chat2sql'},
+}
+# Read replicas of the primary for the read-only agent queries (same keys as MYSQL_ENDPOINTS entries),
+# picked 'round_robin' or by 'least_latency'; replicas more than MAX_LAG seconds behind (checked every
+# CHECK_INTERVAL seconds, 0 = no check) are skipped, and when all lag the reads go to LAG_FALLBACK:
+# 'primary' or 'least_lagged'
+MYSQL_REPLICAS = []
+MYSQL_REPLICA_SELECTION = 'round_robin'
+MYSQL_REPLICA_MAX_LAG = 30
+MYSQL_REPLICA_LAG_FALLBACK = 'primary'
+MYSQL_REPLICA_CHECK_INTERVAL = 10
+# With 'least_latency', share of the reads sent round robin to every usable replica, so the latency of one
+# that was slow once is measured again
+MYSQL_REPLICA_EXPLORE = 0.05
+# Seconds a replica that a read could not connect to gets no reads; they go to the other replicas or the primary
+MYSQL_REPLICA_RETRY_INTERVAL = 10
+# Database behind MySQLDatabase: 'mysql', or 'sqlite' to run offline on the SQLITE_PATH file built by
+# db_fixture.py (no replicas, EXPLAIN cost gate, server-side timeouts or UPDATE_TIME invalidation there)
+DB_BACKEND = 'mysql'
+SQLITE_PATH = './model/offline.sqlite'
+# MySQL connection pool per endpoint: connections kept open / at most, idle seconds before a
+# connection is recycled (well below wait_timeout), lifetime, checkout wait, and the idle seconds
+# after which a connection is pinged on checkout (0 = every checkout)
+MYSQL_POOL_MIN_SIZE = 1
+MYSQL_POOL_MAX_SIZE = 10
+MYSQL_POOL_IDLE_TIMEOUT = 300
+MYSQL_POOL_MAX_LIFETIME = 3600
+MYSQL_POOL_CHECKOUT_TIMEOUT = 10
+MYSQL_POOL_PING_INTERVAL = 0
+# Threads running the statements of async_mysql.AsyncMySQLDatabase; more than the pool size would only wait for a connection
+MYSQL_ASYNC_WORKERS = MYSQL_POOL_MAX_SIZE
+# Streaming fetch: rows read per round trip, and the default caps of MySQLDatabase.fetch_bounded
+FETCH_BATCH_SIZE = 1000
+FETCH_MAX_ROWS = 10000
+FETCH_MAX_BYTES = 16 * 1024 * 1024
+# Rows / bytes of a validation result shown to the LLM by RefineTool, and its seconds to answer
+REFINE_MAX_ROWS = 5
+REFINE_MAX_BYTES = 8192
+REFINE_SQL_TIMEOUT = 5
+# Seconds a caller waits past a statement timeout for the server to stop it (KILL QUERY round trip)
+SQL_TIMEOUT_GRACE = 1
+# Results of the SQLs validated by RefineTool, cached by normalized SQL: bytes at most (0 disables),
+# TTL in seconds, TTL per table family (DATA2URL prefix), and seconds between the checks of the
+# tables' UPDATE_TIME that invalidate the results of changed tables (0: only sql_cache bump())
+SQL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SQL_CACHE_TTL = 600
+SQL_CACHE_FAMILY_TTL = {}
+SQL_CACHE_REFRESH_INTERVAL = 60
+# Cost gate of RefineTool: a SQL whose EXPLAIN estimates more rows examined (or a higher optimizer
+# query_cost) is not run, 0 disables a budget; plans cached per normalized SQL; EXPLAIN timeout in seconds
+SQL_COST_MAX_ROWS_EXAMINED = 20_000_000
+SQL_COST_MAX_QUERY_COST = 0
+SQL_PLAN_CACHE_SIZE = 1024
+SQL_PLAN_CACHE_TTL = 3600
+SQL_EXPLAIN_TIMEOUT = 2
+# Bulk insert: rows per executemany call, and the largest multi-row statement built from them
+# (further capped at 90% of the server's max_allowed_packet)
+INSERT_CHUNK_SIZE = 5000
+INSERT_MAX_STMT_BYTES = 4 * 1024 * 1024
+# Batch delete: values per DELETE ... IN (...) statement, key count from which the 'auto' strategy
+# loads the keys into a temporary table and deletes with a join, and chunks per commit (0: one transaction)
+DELETE_CHUNK_SIZE = 1000
+DELETE_TEMP_TABLE_THRESHOLD = 50000
+DELETE_COMMIT_EVERY = 0
+# Write-behind of LongTermMemory.save: 'sync' waits (up to MEMORY_SYNC_TIMEOUT seconds) for the batch
+# holding the turn to commit, 'async' returns at once, 'wal' also appends the turn to the local
+# MEMORY_WAL_PATH segments first, replayed on the next start after a crash. Batches of up to
+# MEMORY_FLUSH_ROWS rows are written when that many are queued or MEMORY_FLUSH_INTERVAL seconds after
+# the oldest, and on shutdown. With MEMORY_QUEUE_MAX turns queued, save waits up to
+# MEMORY_QUEUE_PUT_TIMEOUT seconds with 'block', then (or at once with 'drop') the turn is dropped
+MEMORY_DURABILITY = 'async'
+MEMORY_FLUSH_ROWS = 500
+MEMORY_FLUSH_INTERVAL = 1.0
+MEMORY_QUEUE_MAX = 10000
+MEMORY_QUEUE_OVERFLOW = 'block'
+MEMORY_QUEUE_PUT_TIMEOUT = 0.1
+MEMORY_SYNC_TIMEOUT = 5
+MEMORY_WAL_PATH = './model/memory_wal/segment'
+MEMORY_WAL_FSYNC = False
+# Few-shot traces from QA_PATH injected into the ReAct prompt: how many, the least cosine
+# similarity to the sub-question, and the token budget of the <Examples> section; 0 disables
+FEW_SHOT_INDEX_PATH = './model/few_shot_index.faiss'
+FEW_SHOT_K = 2
+FEW_SHOT_MIN_SIMILARITY = 0.5
+FEW_SHOT_TOKEN_BUDGET = 1200
+# Shared embedding/retrieval sidecar (embedding_service.py) on a Unix socket: workers use it with
+# USE_EMBEDDING_SERVICE (retrieval in the sidecar) or EMBEDDING_BACKEND = 'remote' (encoding only);
+# concurrent encodes are merged into batches of up to MAX_BATCH texts, waiting at most MAX_WAIT_MS
+USE_EMBEDDING_SERVICE = False
+EMBEDDING_SERVICE_SOCKET = './model/embedding.sock'
+EMBEDDING_SERVICE_MAX_BATCH = 64
+EMBEDDING_SERVICE_MAX_WAIT_MS = 5
+EMBEDDING_SERVICE_TIMEOUT = 30
+EMBEDDING_SERVICE_CONNECT_TIMEOUT = 60
+# Server warm-up: whether the reranker is loaded too (the tools do not rerank), and how long
+# /query waits for retrieval to be ready before answering 503
+WARMUP_RERANKER = False
+READY_WAIT_TIMEOUT = 60
+# Memory-mapped embedding store of the schema texts, and the batch size used to encode misses
+EMBEDDING_STORE_PATH = './model/embedding_store'
+EMBEDDING_STORE_DTYPE = 'float16'
+EMBEDDING_BATCH_SIZE = 32
+# Embedding backend of KNNSchema: 'torch' (fp32 reference), 'onnx', 'onnx_int8' (CPU) or 'remote' (see embedding_backend.py)
+EMBEDDING_MODEL_PATH = './model/bge-m3'
+EMBEDDING_BACKEND = 'torch'
+EMBEDDING_MAX_LENGTH = 512
+ONNX_MODEL_PATH = './model/bge-m3-onnx/model.onnx'
+ONNX_INT8_MODEL_PATH = './model/bge-m3-onnx/model_int8.onnx'
+# ONNX Runtime intra-op threads; 0 lets ONNX Runtime use all physical cores
+ONNX_INTRA_OP_THREADS = 0
 
 DATA2URL = {
     'submarine_': 'https://ki3.org.cn/#/fiberOpticCommunication?sub=cableOverview',
@@ -1,242 +1,297 @@
-import json
-import re
-import time
-import pandas as pd
-import concurrent.futures
+import argparse
 import threading
-from typing import Optional, Dict, Any
+import heapq
+from typing import Optional, Dict, Any, NamedTuple
 from pydantic import BaseModel, Field
+from cachetools import TTLCache
 
-from sklearn.neighbors import NearestNeighbors
-from sentence_transformers import SentenceTransformer
-from FlagEmbedding import BGEM3FlagModel
-from FlagEmbedding import FlagReranker
-from transformers import AutoModel
-from multiprocessing import Process, Manager
-import faiss
-import pickle
-import torch
-
-from mysql import MySQLDatabase
+import numpy as np
+
+from vector_index import VectorIndex
+from embedding_store import EmbeddingStore
+from catalog import Catalog, CatalogManager
+from lexical_index import BM25Index, fuse_scores
+from query_cache import QueryEmbeddingCache
+from embedding_backend import create_backend
 from globals import *
+from logger import logger
+
+MODEL_PATH = EMBEDDING_MODEL_PATH # need to be changed
 
-MODEL_PATH = './model/bge-m3' # need to be changed
+_reranker = None
+_reranker_lock = threading.Lock()
+_knn_schema = None
+_knn_schema_lock = threading.Lock()
+_rerank_cache = TTLCache(maxsize=RERANK_CACHE_SIZE, ttl=RERANK_CACHE_TTL) if RERANK_CACHE_SIZE > 0 else None
+_rerank_cache_lock = threading.Lock()
 
-def load_cache(file_path):
-    try:
-        with open(file_path, 'rb') as f:
-            return pickle.load(f)
-    except FileNotFoundError:
-        return {}
+def get_reranker():
+    """Process-wide FlagReranker, loaded on first use
+    """
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                # FlagEmbedding pulls in torch and transformers, so it is only imported here
+                from FlagEmbedding import FlagReranker
+                _reranker = FlagReranker(RERANKER_PATH, use_fp16=True)
+    return _reranker
 
-def save_cache(file_path, cache):
-    with open(file_path, 'wb') as f:
-        pickle.dump(cache, f)
+def get_knn_schema():
+    """Process-wide KNNSchema, built on first use (or by the warm-up stage of the server)
+
+    With USE_EMBEDDING_SERVICE it is a client of the shared sidecar instead.
+    """
+    global _knn_schema
+    if _knn_schema is None:
+        with _knn_schema_lock:
+            if _knn_schema is None:
+                if USE_EMBEDDING_SERVICE:
+                    from embedding_service import RemoteKNNSchema
+                    _knn_schema = RemoteKNNSchema()
+                else:
+                    _knn_schema = KNNSchema()
+    return _knn_schema
+
+def topk_indices(scores, k):
+    """Indices of the k largest scores; ties keep the candidate order
+    """
+    return heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+
+class RetrievalSnapshot(NamedTuple):
+    """One catalog version together with the indexes built from it
+    """
+    catalog: Catalog
+    table_index: VectorIndex
+    column_index: VectorIndex
+    lexical_index: BM25Index
 
 class KNNSchema(BaseModel):
     """
     RAG：召回和用户问题最相关的Table schema信息
     """
-    model: Optional[SentenceTransformer] = Field(
+    backend: Optional[Any] = Field(
         default=None,
-        description="Sentence transformer model for embeddings"
+        description="EmbeddingBackend used to encode the schema texts and the questions"
     )
-    cache: Optional[Dict[str, Any]] = Field(
+    store: Optional[Any] = Field(
         default=None,
-        description="Cache for embeddings"
+        description="Memory-mapped store of the schema text embeddings"
+    )
+    query_cache: Optional[Any] = Field(
+        default=None,
+        description="LRU/TTL cache of the user question embeddings"
+    )
+    snapshot: Optional[Any] = Field(
+        default=None,
+        description="Current RetrievalSnapshot; replaced as a whole when the catalog is reloaded"
+    )
+    catalog_manager: Optional[Any] = Field(
+        default=None,
+        description="Background watcher of TABLE_JSON_PATH"
+    )
+    watch_catalog: bool = Field(
+        default=True,
+        description="Whether to hot reload TABLE_JSON_PATH when it changes"
+    )
+    batch_size: int = Field(
+        default=EMBEDDING_BATCH_SIZE,
+        description="Batch size used when encoding the texts missing from the store"
     )
     
     def __init__(self, **data):
         super().__init__(**data)
-        if self.model is None:
-            self.model = SentenceTransformer(MODEL_PATH)
-        if self.cache is None:
-            self.cache = load_cache('./model/embedding_cache.pkl')
+        if self.backend is None:
+            self.backend = create_backend(EMBEDDING_BACKEND, MODEL_PATH)
+        if self.store is None:
+            # vectors of different backends differ slightly, so each backend has its own store
+            self.store = EmbeddingStore(EMBEDDING_STORE_PATH, model_name=self.backend.model_name, dtype=EMBEDDING_STORE_DTYPE)
+        if self.query_cache is None:
+            self.query_cache = QueryEmbeddingCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        if self.snapshot is None:
+            self.snapshot = self.build_snapshot()
+        if self.catalog_manager is None and self.watch_catalog and CATALOG_RELOAD_INTERVAL > 0:
+            self.catalog_manager = CatalogManager(TABLE_JSON_PATH, on_change=self.apply_catalog,
+                                                  version=self.snapshot.catalog.version,
+                                                  interval=CATALOG_RELOAD_INTERVAL)
+            self.catalog_manager.start()
+
+    @property
+    def catalog(self):
+        """Catalog of the current snapshot, e.g. to render the schema cards of given tables
+        """
+        return self.snapshot.catalog
+
+    def _load_or_build_index(self, index_path, keys, texts, force=False):
+        """Load the on-disk index, (re)building it when the catalog or model changed
+        """
+        fingerprint = VectorIndex.make_fingerprint(self.backend.model_name, keys, texts)
+        if not force:
+            index = VectorIndex.load(index_path)
+            if index is not None and index.fingerprint == fingerprint:
+                logger.info(f"Loaded index with {len(index)} entries from {index_path}")
+                return index
+        logger.info(f"Building {index_path} with {len(keys)} entries")
+        embeddings = self.get_embeddings(texts)
+        index = VectorIndex.build(keys, embeddings, fingerprint=fingerprint)
+        index.save(index_path)
+        return index
+
+    def build_snapshot(self, force=False):
+        """Load the catalog and its on-disk indexes, rebuilding the stale ones
+        """
+        catalog = Catalog.load(TABLE_JSON_PATH)
+        table_index = self._load_or_build_index(TABLE_INDEX_PATH, *catalog.table_entries(), force=force)
+        column_index = self._load_or_build_index(COLUMN_INDEX_PATH, *catalog.column_entries(), force=force)
+        # drop the embeddings of texts that are no longer in the catalog
+        self.store.compact(catalog.live_texts())
+        lexical_index = BM25Index.from_catalog(catalog, DATA2URL)
+        return RetrievalSnapshot(catalog, table_index, column_index, lexical_index)
+
+    def apply_catalog(self, catalog):
+        """Move to a new catalog version, re-embedding only the added or changed tables
+
+        The indexes are updated on copies and swapped in with the catalog as one
+        snapshot, so in-flight requests keep using the version they started with.
+        """
+        old = self.snapshot
+        dropped = [table_name for table_name in old.catalog.cards if table_name not in catalog]
+        changed = [table_name for table_name, card in catalog.cards.items() if old.catalog.cards.get(table_name) != card]
+        logger.info(f"Applying catalog {catalog.version[:8]}: {len(changed)} added/changed, {len(dropped)} dropped tables")
+
+        table_index = old.table_index.copy()
+        table_index.remove(dropped)
+        if changed:
+            texts = [catalog.cards[table_name].retrieval_text for table_name in changed]
+            table_index.add(changed, self.get_embeddings(texts))
+        table_index.fingerprint = VectorIndex.make_fingerprint(self.backend.model_name, *catalog.table_entries())
+
+        column_index = old.column_index.copy()
+        column_index.remove([key for table_name in dropped + changed if table_name in old.catalog
+                             for key in old.catalog.cards[table_name].column_keys])
+        keys, texts = catalog.column_entries(changed)
+        if keys:
+            column_index.add(keys, self.get_embeddings(texts))
+        column_index.fingerprint = VectorIndex.make_fingerprint(self.backend.model_name, *catalog.column_entries())
+
+        lexical_index = BM25Index.from_catalog(catalog, DATA2URL)
+        self.snapshot = RetrievalSnapshot(catalog, table_index, column_index, lexical_index)
+        table_index.save(TABLE_INDEX_PATH)
+        column_index.save(COLUMN_INDEX_PATH)
+        self.store.compact(catalog.live_texts())
 
     def get_embeddings(self, texts):
-        embeddings = []
-        for text in texts:
-            if text in self.cache:
-                embeddings.append(self.cache[text])
-            else:
-                embedding = self.model.encode(text, convert_to_tensor=True).cpu().data.numpy()
-                self.cache[text] = embedding
-                embeddings.append(embedding)
-        save_cache('embedding_cache.pkl', self.cache)
-        return torch.tensor(embeddings)
-
-    def get_topk_knowledge_v2(self, query, exclude_list=[], k=5):
-        with open(TABLE_JSON_PATH, 'r') as f:
-            self.data = json.load(f)
-        new_schema_list = []
-        descr_list = []
-        table_name_list = []
-        for table_name in self.data.keys():
-            if table_name in exclude_list:
-                continue
-            item = self.data[table_name]
-            descr, cols = item['description'], item['column_info']
-            s = f"Table name is {table_name}. It contais the following columns:"
-            cols_format = []
-            for idx, col in enumerate(cols):
-                c = f"{idx+1}.{col[0]}, means {col[1]}"
-                cols_format.append(c)
-            col_str = '\t'.join(cols_format)
-            new_schema_list.append(s+col_str)
-            descr_list.append(descr)
-            table_name_list.append(table_name)
-
-        concat_list = [item1+'\n'+item2 for item1, item2 in zip(new_schema_list, descr_list)]
-        concat_list.append(query)
-        new_schema_list.append(query) # 平均长度300
-        descr_list.append(query)
-        
-        # schema_embeddings = self.model.encode(new_schema_list, convert_to_tensor=True)
-        # descr_embeddings = self.model.encode(descr_list, convert_to_tensor=True)
-        # concat_embeddings = self.model.encode(concat_list, convert_to_tensor=True)
-        concat_embeddings = self.get_embeddings(concat_list).cpu().data.numpy()
-
-        
-        # # schema
-        # nrnb = NearestNeighbors(n_neighbors=k).fit(schema_embeddings[:-1])
-        # distances1, indices1 = nrnb.kneighbors(schema_embeddings[-1].reshape(1, -1))
-        # # description
-        # nrnb = NearestNeighbors(n_neighbors=k).fit(descr_embeddings[:-1])
-        # distances2, indices2 = nrnb.kneighbors(descr_embeddings[-1].reshape(1, -1))
-        # both
-        nrnb = NearestNeighbors(n_neighbors=k).fit(concat_embeddings[:-1])
-        distances3, indices3 = nrnb.kneighbors(concat_embeddings[-1].reshape(1, -1))
-        top_table_list = [table_name_list[idx] for idx in list(indices3[0])]
+        """Look up the stored embeddings and encode all the misses in one batched call
+
+        Returns a float32 array of shape (len(texts), dim).
+        """
+        embeddings = self.store.get(texts)
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            missing_embeddings = self.backend.encode(missing, batch_size=self.batch_size)
+            self.store.add(missing, missing_embeddings)
+            # round through the store dtype, so cold and warm lookups return the same vectors
+            missing_embeddings = missing_embeddings.astype(self.store.dtype).astype('float32')
+            new_entries = dict(zip(missing, missing_embeddings))
+            embeddings = [new_entries[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+        return np.stack(embeddings).astype('float32')
+
+    def embed_query(self, query):
+        """Embedding of a user question, from the query cache when it was asked recently
+        """
+        embedding = self.query_cache.get(query)
+        if embedding is None:
+            embedding = self.backend.encode([query])[0]
+            self.query_cache.put(query, embedding)
+        return embedding
+
+    def get_topk_knowledge_v2(self, query, exclude_list=[], k=5, snapshot=None, lexical_weight=HYBRID_LEXICAL_WEIGHT):
+        """Embed the query and search the prebuilt table index, fused with BM25 when lexical_weight > 0
+        """
+        snapshot = snapshot or self.snapshot
+        query_embedding = self.embed_query(query)
+        if lexical_weight <= 0:
+            hits = snapshot.table_index.search(query_embedding, k, exclude=exclude_list)
+            return [table_name for table_name, _ in hits]
+
+        n = k * HYBRID_CANDIDATES_PER_K
+        # squared L2 distance of unit vectors -> cosine similarity
+        dense = {table_name: 1 - distance / 2
+                 for table_name, distance in snapshot.table_index.search(query_embedding, n, exclude=exclude_list)}
+        lexical = dict(snapshot.lexical_index.search(query, n, exclude=exclude_list))
+        lexical_only = [table_name for table_name in lexical if table_name not in dense]
+        if lexical_only:
+            distances = snapshot.table_index.distances(query_embedding, lexical_only)
+            dense.update((table_name, 1 - distance / 2) for table_name, distance in zip(lexical_only, distances))
+        fused = fuse_scores(dense, lexical, lexical_weight)
+        top_table_list = sorted(fused, key=fused.get, reverse=True)[:k]
         return top_table_list
     
     def create_structured_table_schema(self, query, exclude_list=[], k=5):
-        with open(TABLE_JSON_PATH, 'r') as f:
-            self.data = json.load(f)
-        top_knowledge_tables = self.get_topk_knowledge_v2(query, exclude_list, k)
-        all_table_prompt_list = []
-        one_table_schema_card = "# Table: {table_name}\tTable description: {descr}"
-        one_column_card = "## Column {idx}: {col_name}, {col_comment}. Value examples: [{sample_data}]"
-        evidence_card = "<Evidence>\n{s}\n"
-        evidence_l = []
-        for table_name in top_knowledge_tables:
-            descr, column_list = self.data[table_name]['description'], self.data[table_name]['column_info']
-            evidence = self.data[table_name]['evidence']
-            if evidence != '':
-                evidence_l.append(evidence.strip())
-            column_sumpup = []
-            for idx, col in enumerate(column_list):
-                column_sumpup.append(one_column_card.format(
-                    idx=idx+1,
-                    col_name=col[0],
-                    col_comment=col[1],
-                    sample_data=col[2]
-                ))
-            column_prompt = '\n'.join(column_sumpup)
-            all_table_prompt_list.append(one_table_schema_card.format(table_name=table_name, descr=descr.strip())+'\n'+column_prompt+'\n')
-        if evidence_l != []:
-            evidence_s = evidence_card.format(s=';'.join(evidence_l))
-        else:
-            evidence_s = evidence_card.format(s='No extra evidence.')
-        final_schema = '<Table Schema>\n' + '\n'.join(all_table_prompt_list) + '\n'
-
-        return final_schema+'\n'+evidence_s, top_knowledge_tables
-    
-    def get_topk_knowledge_from_column(self, query, exclude_list=[], k=5):
-        table2column = {}
-        id2table = {}
-        id2column = {}
-        all_column_list = []
-        idx = 0
-        for table_name in self.data.keys():
-            if table_name in exclude_list:
-                continue
-            column_list = self.data[table_name]['column_info']
-            for item in column_list:
-                id2column[idx] = item
-                if table_name not in table2column:
-                    table2column[table_name] = []
-                table2column[table_name].append(idx)
-                id2table[idx] = table_name
-                all_column_list.append(f"The column name is {item[0]}, which means {item[1]}")
-                idx += 1
-        all_column_list.append(query)
-        # column_embeddings = self.bge_model.encode(all_column_list)['dense_vecs']
-        column_embeddings = self.model.encode(all_column_list, convert_to_tensor=True)
+        snapshot = self.snapshot
+        top_knowledge_tables = self.get_topk_knowledge_v2(query, exclude_list, k, snapshot=snapshot)
+        return snapshot.catalog.render_schema(top_knowledge_tables), top_knowledge_tables
     
-        nrnb = NearestNeighbors(n_neighbors=k).fit(column_embeddings[:-1].cpu().data.numpy())
-        distances, indices = nrnb.kneighbors(column_embeddings[-1].cpu().data.numpy().reshape(1, -1))
-        target_column = [id2column[idx] for idx in list(indices[0])]
-        # print(target_column)
-        target_table = [id2table[idx] for idx in list(indices[0])]
-        return list(set(target_table))
+    def get_topk_knowledge_from_column(self, query, exclude_list=[], k=5, snapshot=None):
+        """Search the column index and rank tables by the summed similarity of their column hits
+        """
+        snapshot = snapshot or self.snapshot
+        exclude_keys = [key for table_name in exclude_list if table_name in snapshot.catalog
+                        for key in snapshot.catalog.cards[table_name].column_keys]
+        query_embedding = self.embed_query(query)
+        hits = snapshot.column_index.search(query_embedding, k * COLUMN_HITS_PER_TABLE, exclude=exclude_keys)
+        table2score = {}
+        for key, distance in hits:
+            table_name = key.split('.', 1)[0]
+            # squared L2 distance of unit vectors -> cosine similarity
+            table2score[table_name] = table2score.get(table_name, 0.0) + 1 - distance / 2
+        top_table_list = sorted(table2score, key=table2score.get, reverse=True)[:k]
+        return top_table_list
+
+    def rerank(self, query, table_list, k=5, snapshot=None):
+        """Score the candidate tables with the cross-encoder in batches and keep the top k
+        """
+        snapshot = snapshot or self.snapshot
+        if not table_list:
+            return []
+        cache_key = (query, frozenset(table_list), snapshot.catalog.version)
+        if _rerank_cache is not None:
+            with _rerank_cache_lock:
+                scores = _rerank_cache.get(cache_key)
+            if scores is not None:
+                return [table_name for table_name, _ in scores[:k]]
+
+        content_l = [[query, snapshot.catalog.cards[table_name].retrieval_text] for table_name in table_list]
+        score = get_reranker().compute_score(content_l, batch_size=RERANKER_BATCH_SIZE, max_length=RERANKER_MAX_LENGTH)
+        if not isinstance(score, list):
+            # a single pair gives a bare float
+            score = [score]
+        scores = [(table_list[idx], score[idx]) for idx in topk_indices(score, len(score))]
+        if _rerank_cache is not None:
+            with _rerank_cache_lock:
+                _rerank_cache[cache_key] = scores
+        return [table_name for table_name, _ in scores[:k]]
 
     def create_structured_table_schema_2(self, query, exclude_list=[], k=5):
-        def rerank(table_list):
-            reranker = FlagReranker('./model/bge-reranker-large', use_fp16=True)
-            content_l = []
-            for table_name in table_list:
-                item = self.data[table_name]
-                descr, cols = item['description'], item['column_info']
-                s = f"Table name is {table_name}. It contais the following columns:"
-                cols_format = []
-                for idx, col in enumerate(cols):
-                    c = f"{idx+1}.{col[0]}, means {col[1]}"
-                    cols_format.append(c)
-                col_str = '\t'.join(cols_format)
-                content_l.append([query, s+col_str+'\n'+descr])
-            score = reranker.compute_score(content_l)
-            new_score = score.copy()
-            new_score.sort(reverse=True)
-            top_score = new_score[:k]
-            result = []
-            for item in top_score:
-                idx = score.index(item)
-                result.append(table_list[idx])
-            # print(result)
-            return result
-
-
-        top_knowledge_tables = self.get_topk_knowledge_v2(query, exclude_list, k=5)
-        top_tables_from_column = self.get_topk_knowledge_from_column(query, exclude_list, k=5)
-        total_table_list = list(set(top_knowledge_tables + top_tables_from_column))
+        snapshot = self.snapshot
+        top_knowledge_tables = self.get_topk_knowledge_v2(query, exclude_list, k=5, snapshot=snapshot)
+        top_tables_from_column = self.get_topk_knowledge_from_column(query, exclude_list, k=5, snapshot=snapshot)
+        total_table_list = list(dict.fromkeys(top_knowledge_tables + top_tables_from_column))
         # total_table_list = top_tables_from_column
-        final_table_list = rerank(total_table_list)
+        final_table_list = self.rerank(query, total_table_list, k, snapshot=snapshot)
         # final_table_list = total_table_list
 
-        final_table_column = dict()
-
-        all_table_prompt_list = []
-        one_table_schema_card = "# Table: {table_name}\tTable description: {descr}"
-        one_column_card = "## Column {idx}: {col_name}, {col_comment}. Value examples: [{sample_data}]"
-        evidence_card = "<Evidence>\n{s}\n"
-        evidence_l = []
-        # for i in range(len(top_knowledge)):
-        for table_name in final_table_list:
-            # table_name = top_knowledge[i][0]
-            descr, column_list = self.data[table_name]['description'], self.data[table_name]['column_info']
-            evidence = self.data[table_name]['evidence']
-            final_table_column[table_name] = {
-                'description': descr,
-                'column_info': column_list
-            }
-            # descr, column_list = final_table_column[table_name]['description'], final_table_column[table_name]['column_info']
-            # evidence = final_table_column[table_name]['evidence']
-            if evidence.strip() != '':
-                evidence_l.append(evidence.strip())
-            column_sumpup = []
-            for idx, col in enumerate(column_list):
-                column_sumpup.append(one_column_card.format(
-                    idx=idx+1,
-                    col_name=col[0],
-                    col_comment=col[1],
-                    sample_data=col[2]
-                ))
-            column_prompt = '\n'.join(column_sumpup)
-            all_table_prompt_list.append(one_table_schema_card.format(table_name=table_name, descr=descr.strip())+'\n'+column_prompt+'\n')
-        if evidence_l != []:
-            evidence_s = evidence_card.format(s=';'.join(evidence_l))
-        else:
-            evidence_s = evidence_card.format(s='No extra evidence.')
-        final_schema = '<Table Schema>\n' + '\n'.join(all_table_prompt_list) + '\n'
-
-        return final_schema+'\n'+evidence_s
+        return snapshot.catalog.render_schema(final_table_list)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build-index', action='store_true', help='Build the table and column indexes from TABLE_JSON_PATH if they are stale')
+    parser.add_argument('--force', action='store_true', help='Rebuild the indexes even if they are up to date')
+    args = parser.parse_args()
+
+    if args.build_index:
+        # KNNSchema loads the indexes and rebuilds them when stale
+        knn_schema = KNNSchema(watch_catalog=False)
+        if args.force:
+            knn_schema.snapshot = knn_schema.build_snapshot(force=True)
@@ -0,0 +1,125 @@
+"""Lexical index module, which keeps a BM25 inverted index over the table catalog
+
+Users often ask with exact identifiers (as_bgp_status, asn, roa, ixp) that the
+dense embeddings blur; the BM25 scores over table names, column names,
+comments and the DATA2URL prefixes are fused with the dense scores.
+"""
+
+import re
+import math
+from collections import defaultdict
+from typing import Dict, List, Tuple, Iterable, Mapping, Any
+
+STOP_WORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'for', 'by', 'with', 'from', 'and', 'or', 'is', 'are',
+    'was', 'were', 'be', 'this', 'that', 'these', 'those', 'it', 'its', 'which', 'what', 'who', 'how',
+    'many', 'much', 'does', 'do', 'did', 'me', 'show', 'list', 'all', 'get', 'give', 'number', 'means',
+    'column', 'table', 'name', 'no', 'none', 'null',
+}
+URL_STOP_WORDS = STOP_WORDS | {'sub', 'children'}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words; identifiers are kept whole and also split on '_'
+    """
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9_]+", text or ''):
+        word = word.lower().strip('_')
+        if not word or word in STOP_WORDS:
+            continue
+        tokens.append(word)
+        m = re.match(r"^([a-z]+)\d+$", word)
+        if m and m.group(1) not in STOP_WORDS:
+            # AS1000 -> as
+            tokens.append(m.group(1))
+        if '_' in word:
+            tokens.extend(part for part in word.split('_') if part and part not in STOP_WORDS)
+    return tokens
+
+
+def url_tokens(url: str) -> List[str]:
+    """Words of the page route, e.g. '#/rpkiDeployment?sub=rpkiAnalysis' -> rpki, deployment, rpki, analysis
+    """
+    route = url.split('#/', 1)[-1]
+    words = []
+    for part in re.split(r"[^A-Za-z0-9]+", route):
+        words.extend(re.findall(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])", part))
+    return [word.lower() for word in words if word.lower() not in URL_STOP_WORDS]
+
+
+def table_document(table_name: str, item: Mapping[str, Any], url_map: Mapping[str, str]) -> List[str]:
+    """Tokens of one table; identifiers are repeated to weigh more than free text
+    """
+    tokens = tokenize(table_name) * 2
+    for col in item['column_info']:
+        tokens.extend(tokenize(col[0]) * 2)
+        tokens.extend(tokenize(col[1]))
+    tokens.extend(tokenize(item['description']))
+    for prefix, url in url_map.items():
+        if table_name.startswith(prefix):
+            tokens.extend(tokenize(prefix))
+            tokens.extend(url_tokens(url))
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index of token -> [(doc, term frequency)]
+    """
+
+    def __init__(self, documents: Mapping[str, List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        self.doc_len: Dict[str, int] = {}
+        for key, tokens in documents.items():
+            self.doc_len[key] = len(tokens)
+            tf: Dict[str, int] = defaultdict(int)
+            for token in tokens:
+                tf[token] += 1
+            for token, freq in tf.items():
+                self.postings[token].append((key, freq))
+        n = len(self.doc_len)
+        self.avg_len = sum(self.doc_len.values()) / n if n else 0.0
+        self.idf = {token: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for token, docs in self.postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def from_catalog(cls, catalog, url_map: Mapping[str, str]) -> "BM25Index":
+        return cls({table_name: table_document(table_name, item, url_map) for table_name, item in catalog.data.items()})
+
+    def scores(self, query: str) -> Dict[str, float]:
+        result: Dict[str, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for key, freq in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[key] / self.avg_len)
+                result[key] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return result
+
+    def search(self, query: str, k: int, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        exclude = set(exclude)
+        scores = self.scores(query)
+        ranked = sorted((item for item in scores.items() if item[0] not in exclude), key=lambda x: x[1], reverse=True)
+        return ranked[:k]
+
+
+def fuse_scores(dense: Dict[str, float], lexical: Dict[str, float], lexical_weight: float) -> Dict[str, float]:
+    """Weighted sum of the min-max normalized dense and lexical scores
+    """
+    def normalize(scores: Dict[str, float]) -> Dict[str, float]:
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        if high == low:
+            return {key: 1.0 for key in scores}
+        return {key: (value - low) / (high - low) for key, value in scores.items()}
+
+    dense_n, lexical_n = normalize(dense), normalize(lexical)
+    keys = list(dict.fromkeys(list(dense) + list(lexical)))
+    return {key: (1 - lexical_weight) * dense_n.get(key, 0.0) + lexical_weight * lexical_n.get(key, 0.0)
+            for key in keys}
@@ -1,15 +1,18 @@
 """FlaskAPI runing module
 """
 
+import sys
 import json
+import signal
 import argparse
+import importlib
 from typing import Dict, Any
 
 from flask import *
 
 from model.model_zoo import ModelZoo
 from sql_react_prune import SQLChatAgent
-from knn_icl import KNNSchema
+from warmup import readiness, start_warmup
 from globals import *
 from logger import logger
 
@@ -28,6 +31,26 @@ def bad_request_error(error):
 def internet_fail_error(error):
     return make_response(jsonify({'msg': 'Internal Server Error', 'ref': 500, 'data':'', 'chatId':-1}), 500)
 
+@app.route('/ready',methods=['get'])
+def ready():
+    status = readiness.status()
+    return make_response(jsonify(status), 200 if status['ready'] else 503)
+
+@app.route('/stats',methods=['get'])
+def stats():
+    # imported here: the DB modules are not needed to answer /ready during the warm-up
+    from db_pool import pool_stats
+    from db_routing import get_router
+    from sql_cache import get_sql_cache
+    from sql_cost import get_cost_gate
+    from memory_writer import get_memory_writer
+    sql_cache, cost_gate = get_sql_cache(), get_cost_gate()
+    return jsonify({'sql_cache': sql_cache.stats() if sql_cache is not None else None,
+                    'cost_gate': cost_gate.stats() if cost_gate is not None else None,
+                    'mysql_pools': pool_stats(),
+                    'mysql_reads': get_router().stats(),
+                    'memory_writer': get_memory_writer().stats()})
+
 @app.route('/query',methods=['post'])
 def query():
     # parse the input from the request body
@@ -39,6 +62,11 @@ def query():
         abort(400)
     query, chat_id = query['query'], int(query['chatId'])
     logger.info(f"Query: {query}")
+    # returns at once if a required warm-up stage failed: that does not recover, /ready has the errors
+    if not readiness.wait(READY_WAIT_TIMEOUT):
+        failed_stages = readiness.failed_stages()
+        msg = f"Warm-up Failed: {', '.join(failed_stages)}" if failed_stages else 'Service Warming Up'
+        return make_response(jsonify({'msg': msg, 'ref': 503, 'data':'', 'chatId': chat_id}), 503)
     
     # Main workflow
     try:
@@ -48,13 +76,34 @@ def query():
     
     return jsonify({'msg': 'OK', 'ref': 200, 'data': reuslt, 'chatId': chat_id})
 
+def warmup_stages():
+    """(name, load function, required) of the background warm-up
+    """
+    def load_retrieval():
+        importlib.import_module('knn_icl').get_knn_schema()
+
+    def load_reranker():
+        importlib.import_module('knn_icl').get_reranker()
+
+    stages = [
+        ('retrieval_imports', lambda: importlib.import_module('knn_icl'), True),
+        ('retrieval', load_retrieval, True),
+    ]
+    if FEW_SHOT_K > 0:
+        stages.append(('few_shot', lambda: importlib.import_module('few_shot').get_few_shot_index(), False))
+    if WARMUP_RERANKER:
+        stages.append(('reranker', load_reranker, False))
+    return stages
+
 def pre_process():
     model_zoo: Dict[str, Any] = ModelZoo().get_model_zoo()
     
     global sql_chat_agent
     sql_chat_agent = SQLChatAgent(
-        model=model_zoo
+        model_zoo=model_zoo
     )
+    # the models load in the background; /ready reports when retrieval is usable
+    start_warmup(warmup_stages())
     
     return app
     
@@ -63,5 +112,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', default=54292, help='Production: 54292; Test: 57329')   
     args = parser.parse_args()
+    # SIGTERM exits through SystemExit, so the atexit hooks (e.g. the memory writer's flush) run
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app = pre_process()
-    app.run(host='0.0.0.0', port=int(args.port))
+    # the debug reloader would import and warm up everything twice
+    app.run(host='0.0.0.0', port=int(args.port), use_reloader=False)
@@ -1,15 +1,81 @@
 """Memory module, which is used to store chat history
+
+user_memory keeps one row per turn: the question and answer in their own
+columns (memory holds free-form notes saved as a list of lines), looked up by
+the (chat_id, timestamp) index, newest first, at most top_k rows per search.
+The table and its index are created on first use. Tables of the former layout,
+with the turn tab-joined in memory, are migrated with `python memory.py --migrate`,
+with the agent stopped. The turns are written in batches behind the request by
+memory_writer.
 """
 
-import os
+import argparse
+import threading
 from typing import Dict, List, Union, Set, Any, Tuple
 import datetime
 
+import pymysql
 from pydantic import BaseModel, Field
 
-from mysql import MySQLDatabase
+from mysql import MySQLDatabase, result_errno
+from memory_writer import get_memory_writer
+from globals import *
 from logger import logger
 
+MEMORY_TABLE = "user_memory"
+MEMORY_COLUMNS = ["chat_id", "question", "answer", "memory", "timestamp"]
+MEMORY_DDL = ("CREATE TABLE {table} (chat_id BIGINT NOT NULL, question TEXT, answer TEXT, memory TEXT, "
+              "timestamp BIGINT NOT NULL)")
+MEMORY_INDEX_DDL = "CREATE INDEX idx_user_memory_chat_ts ON {table} (chat_id, timestamp)"
+
+# unknown table / column, duplicate index name
+_NO_TABLE, _NO_COLUMN, _DUP_INDEX = 1146, 1054, 1061
+
+_schema_ready: Set[str] = set()
+_schema_lock = threading.Lock()
+
+
+def split_legacy_memory(memory: str) -> Tuple[str, str]:
+    """(question, answer) of a 'Question: ...\tAnswer: ...' row of the former layout; (None, None) otherwise
+    """
+    q, sep, a = (memory or '').strip().partition('\t')
+    q, a = q.strip(), a.strip()
+    if not sep or not q.startswith('Question:') or not a.startswith('Answer:'):
+        return None, None
+    return q[len('Question:'):].strip(), a[len('Answer:'):].strip()
+
+
+def ensure_schema(db: MySQLDatabase) -> bool:
+    """
+    Create user_memory and its index if missing; once per process and endpoint. False while the
+    database is unreachable or the table has the former layout, which only --migrate converts.
+    """
+    key = db.endpoint.label
+    if key in _schema_ready:
+        return True
+    with _schema_lock:
+        if key in _schema_ready:
+            return True
+        try:
+            flag, result = db.fetch(f"SELECT question FROM {MEMORY_TABLE} LIMIT 0")
+            if not flag and result_errno(result) == _NO_TABLE:
+                flag, result = db.executes([MEMORY_DDL.format(table=MEMORY_TABLE),
+                                            MEMORY_INDEX_DDL.format(table=MEMORY_TABLE)])
+            elif not flag and result_errno(result) == _NO_COLUMN:
+                result = "former layout, run `python memory.py --migrate` with the agent stopped"
+            elif flag:
+                flag, result = db.execute(MEMORY_INDEX_DDL.format(table=MEMORY_TABLE))
+                if not flag and (result_errno(result) == _DUP_INDEX or 'already exists' in result):
+                    flag = True
+        except Exception as e:
+            # e.g. PoolTimeout, or the connection refused
+            flag, result = False, '[ERROR] {}'.format(str(e))
+        if not flag:
+            logger.error(f"{MEMORY_TABLE} schema check failed: {result}")
+            return False
+        _schema_ready.add(key)
+        return True
+
 
 class Memory(BaseModel):
     """Base model for Memory
@@ -27,41 +93,112 @@ class Memory(BaseModel):
 
 class LongTermMemory(Memory):
     """Inherit from Memory, which is used to store the chat history per user
-    storage: MySQL
+    storage: MySQL, the metadata endpoint
     """
     def __init__(self):
-        storage = MySQLDatabase()
+        storage = MySQLDatabase(in_product=False)
         super().__init__(storage=storage)
+        # no database access here: the schema is checked on the first search / write, not while the agent starts.
+        # This starts the flusher, which replays the rows a crash left in the write-ahead log
+        get_memory_writer()
+
+    def ensure_schema(self) -> bool:
+        return ensure_schema(self.storage)
+
+    def migrate(self, chunk_size: int = INSERT_CHUNK_SIZE) -> Tuple[bool, Any]:
+        """
+        Copy a user_memory of the former layout (chat_id, memory, timestamp) into the
+        current one, splitting the tab-joined turns, and swap the tables; the old
+        table is kept as user_memory_legacy. Rows saved during the copy are not
+        carried over, so run it with the agent stopped on a busy table.
+        """
+        new_table, legacy_table = f"{MEMORY_TABLE}_new", f"{MEMORY_TABLE}_legacy"
+        flag, result = self.storage.executes([f"DROP TABLE IF EXISTS {new_table}",
+                                              MEMORY_DDL.format(table=new_table)])
+        if not flag:
+            return flag, result
+
+        n_rows, chunk = 0, []
+        try:
+            for chat_id, memory, timestamp in self.storage.fetch_iter(
+                    f"SELECT chat_id, memory, timestamp FROM {MEMORY_TABLE}"):
+                question, answer = split_legacy_memory(memory)
+                chunk.append([chat_id, question, answer, None if question is not None else memory, timestamp])
+                if len(chunk) >= chunk_size:
+                    flag, result = self.storage.batch_insert(new_table, chunk, MEMORY_COLUMNS)
+                    if not flag:
+                        return flag, result
+                    n_rows, chunk = n_rows + len(chunk), []
+        except pymysql.MySQLError as e:
+            return False, '[ERROR] {}'.format(str(e))
+        if chunk:
+            flag, result = self.storage.batch_insert(new_table, chunk, MEMORY_COLUMNS)
+            if not flag:
+                return flag, result
+            n_rows += len(chunk)
+
+        # the index is built once over the copied rows
+        flag, result = self.storage.execute(MEMORY_INDEX_DDL.format(table=new_table))
+        if not flag:
+            return flag, result
+        # the swap is atomic: user_memory always exists. MySQL commits each DDL statement, so it is one
+        # RENAME TABLE there; SQLite rolls back the first ALTER of the transaction if the second fails
+        if self.storage.capabilities.rename_tables:
+            flag, result = self.storage.execute(
+                f"RENAME TABLE {MEMORY_TABLE} TO {legacy_table}, {new_table} TO {MEMORY_TABLE}")
+        else:
+            flag, result = self.storage.executes([f"ALTER TABLE {MEMORY_TABLE} RENAME TO {legacy_table}",
+                                                  f"ALTER TABLE {new_table} RENAME TO {MEMORY_TABLE}"])
+        if flag:
+            logger.info(f"{MEMORY_TABLE} migrated: {n_rows} rows, the former table kept as {legacy_table}")
+        return flag, result
 
     def save(self, content: Union[Dict[str, str], List[str]], chat_id: int) -> None:
+        """Queue the turn on the memory writer; with MEMORY_DURABILITY 'sync', wait for its commit
+        """
         timestamp = int(datetime.datetime.now().timestamp())
 
+        question, answer, memory = None, None, None
         if isinstance(content, Dict):
-            memory = f"Question: {content.get('Q', 'null')}\tAnswer: {content.get('A', 'null')}"
+            question, answer = content.get('Q', 'null'), content.get('A', 'null')
         elif isinstance(content, List):
             memory = "\n".join(content)
-                
-        self.storage.batch_insert(
-            table="user_memory",
-            res_list=[chat_id, memory, timestamp],
-            col_list=["chat_id", "memory", "timestamp"],
-            is_replace=False,
-        )
 
-        logger.info(f"User-{chat_id} chat history insert done.")
+        if get_memory_writer().put([chat_id, question, answer, memory, timestamp]):
+            logger.info(f"User-{chat_id} chat history queued.")
+        else:
+            logger.error(f"User-{chat_id} chat history dropped or not committed in time, see the memory writer stats.")
 
     def search(self, chat_id: int, top_k: int = 3) -> Union[List, None]:
-        fetch_sql = f"SELECT memory, timestamp FROM user_memory WHERE chat_id={chat_id} ORDER BY timestamp DESC"
-        flag, result = self.storage.fetch(sql=fetch_sql)
+        """The top_k latest (question, answer) turns of the chat, newest first, including the ones not written yet
+        """
+        if not self.ensure_schema():
+            return None
+        # read before the database: a row written in between is then found twice rather than missed
+        pending = [(row[4], row[1], row[2]) for row in get_memory_writer().pending(
+            lambda row: row[0] == chat_id and row[1] is not None)]
+        fetch_sql = (f"SELECT timestamp, question, answer FROM {MEMORY_TABLE} "
+                     "WHERE chat_id = %s AND question IS NOT NULL ORDER BY timestamp DESC LIMIT %s")
+        flag, result = self.storage.fetch_bounded(fetch_sql, max_rows=top_k, args=(chat_id, top_k))
         if flag:
-            memory_contents: List[str] = [item[0] for item in result]
-
-            qa_pair: List[Tuple[str]] = []
-            for memory in memory_contents:
-                q, a = memory.strip().split('\t')
-                qa_pair.append((q.strip(), a.strip()))
-            return qa_pair[:top_k]
+            turns = list(dict.fromkeys(pending[::-1] + list(result.rows)))
+            turns.sort(key=lambda turn: turn[0], reverse=True)
+            qa_pair: List[Tuple[str]] = [(q.strip(), (a or '').strip()) for _, q, a in turns[:top_k]]
+            return qa_pair
         else:
             return None
-        
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--migrate', action='store_true',
+                        help='Create user_memory and its index, migrating a table of the former layout')
+    args = parser.parse_args()
+
+    if args.migrate:
+        memory = LongTermMemory()
+        flag, result = memory.storage.fetch(f"SELECT question FROM {MEMORY_TABLE} LIMIT 0")
+        if not flag and result_errno(result) == _NO_COLUMN:
+            flag, result = memory.migrate()
+            if not flag:
+                print(f"Migration failed: {result}")
+        print(f"{MEMORY_TABLE} ready" if memory.ensure_schema() else f"{MEMORY_TABLE} not ready, see the log")
@@ -0,0 +1,410 @@
+"""Memory writer module, which persists the LongTermMemory turns behind the request (write-behind)
+
+LongTermMemory.save used to insert its row on the request thread, one INSERT
+and one commit per turn. The rows now go to an in-process queue; a flusher
+thread writes them in multi-row batches once MEMORY_FLUSH_ROWS are queued or
+MEMORY_FLUSH_INTERVAL seconds after the oldest, and drains the queue on
+shutdown. A burst of turns becomes a few batches instead of one statement per
+turn. The durability decides what save waits for:
+
+- 'sync':  the commit of the batch holding the row (group commit: a batch
+           is written as soon as the previous one is done)
+- 'async': nothing; rows still queued are lost if the process dies
+- 'wal':   the append of the row to a local write-ahead log. Each process
+           logs to segments of its own, removed once their rows are committed;
+           the segments of a dead process are replayed by the next writer
+           started. A crash between a commit and the removal replays the batch
+           again: at-least-once.
+
+The queue is bounded: with MEMORY_QUEUE_MAX rows queued or in flight (e.g. the
+database is down), save blocks for MEMORY_QUEUE_PUT_TIMEOUT at most, then the
+row is dropped and counted.
+"""
+
+import os
+import glob
+import fcntl
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from mysql import MySQLDatabase, result_errno
+from globals import *
+from logger import logger
+
+# lock wait timeout, deadlock: server errors worth retrying
+_TRANSIENT_ERRNOS = (1205, 1213)
+
+
+def rejected(error: str) -> bool:
+    """Whether the server refused the rows themselves, so writing them again would fail again
+    """
+    errno = result_errno(error)
+    # 2000-2999 are client / connection errors, 0 no server at all
+    return (1000 <= errno < 2000 or errno >= 3000) and errno not in _TRANSIENT_ERRNOS
+
+
+class WriteAheadLog:
+    """Segmented append-only log of the queued rows of this process, one JSON row per line
+
+    Every process logs to segments of its own, '<prefix>.<pid>.<time ns>', and
+    holds an flock on '<prefix>.<pid>.lock' while it lives. The segments of a
+    lock nobody holds are orphans of a dead process, which the next writer replays.
+
+    :param prefix:       path prefix of the segment files
+    :param segment_rows: rows per segment; a segment is removed when its last row is committed
+    :param fsync:        fsync every append, not only flush it to the OS
+    """
+
+    def __init__(self, prefix: str, segment_rows: int = 1000, fsync: bool = False):
+        self.prefix = prefix
+        self.segment_rows = segment_rows
+        self.fsync = fsync
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        self.pid = os.getpid()
+        # [path, seq of the last row, rows], oldest first; the last one is open for appending
+        self._segments: List[List[Any]] = []
+        self._file = None
+        self._lock_file = None
+
+    def _lock_path(self, pid: int) -> str:
+        return f"{self.prefix}.{pid}.lock"
+
+    def _segment_paths(self, pid: int) -> List[str]:
+        return sorted(glob.glob(glob.escape(f"{self.prefix}.{pid}.") + '[0-9]*'))
+
+    @staticmethod
+    def read_segment(path: str) -> List[List[Any]]:
+        rows = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # the line being written when the process died
+                    logger.error(f"Skipped a partial row of {path}")
+        return rows
+
+    def replay_orphans(self, consume: Callable[[List[Any]], None]) -> int:
+        """
+        Take the lock of this process, pass every row of the segments of dead processes
+        to consume (which may append to this process's segments), then remove them;
+        returns the number of segments. The segments of live processes are left alone.
+        """
+        orphans = []
+        for lock_path in sorted(glob.glob(glob.escape(self.prefix) + '.*.lock')):
+            pid = lock_path[len(self.prefix) + 1:-len('.lock')]
+            if not pid.isdigit():
+                continue
+            try:
+                lock_file = open(lock_path, 'a')
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # its process is alive
+                lock_file.close()
+                continue
+            orphans.append((int(pid), lock_path, lock_file, self._segment_paths(int(pid))))
+
+        # the lock left by a dead process with the same pid becomes this process's lock
+        own = [lock_file for pid, _, lock_file, _ in orphans if pid == self.pid]
+        if own:
+            self._lock_file = own[0]
+        else:
+            self._lock_file = open(self._lock_path(self.pid), 'a')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise RuntimeError(f"Another writer of this process logs to {self.prefix}")
+
+        for _, _, _, segments in orphans:
+            for path in segments:
+                for row in self.read_segment(path):
+                    consume(row)
+        for pid, lock_path, lock_file, segments in orphans:
+            for path in segments:
+                os.remove(path)
+            if pid != self.pid:
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    # another writer replayed it first
+                    pass
+                lock_file.close()
+        return sum(len(segments) for _, _, _, segments in orphans)
+
+    def append(self, seq: int, row: Sequence[Any]) -> None:
+        if self._file is None or self._segments[-1][2] >= self.segment_rows:
+            if self._file is not None:
+                self._file.close()
+            path = f"{self.prefix}.{self.pid}.{time.time_ns()}"
+            self._file = open(path, 'a', encoding='utf-8')
+            self._segments.append([path, seq, 0])
+        self._file.write(json.dumps(list(row), ensure_ascii=False) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._segments[-1][1] = seq
+        self._segments[-1][2] += 1
+
+    def release(self, seq: int) -> None:
+        """Remove the segments whose rows are all committed (up to seq)
+        """
+        while self._segments and self._segments[0][1] <= seq:
+            path = self._segments.pop(0)[0]
+            if not self._segments and self._file is not None:
+                self._file.close()
+                self._file = None
+            os.remove(path)
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            # segments left behind are orphans from now on
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class MemoryWriter:
+    """
+    Write-behind queue of the rows of one table, flushed in batches by a background thread.
+
+    :param db:           MySQLDatabase the batches are inserted with
+    :param durability:   'sync', 'async' or 'wal' (see the module docstring)
+    :param flush_rows:   rows per batch; a batch is written as soon as that many are queued
+    :param flush_interval: seconds a row waits at most for its batch to fill
+    :param max_queue:    rows queued or in flight at most
+    :param overflow:     'block' (up to put_timeout seconds, then drop) or 'drop' when the queue is full
+    :param prepare:      called before a batch until it returns True, e.g. to create the table; False retries later
+    """
+
+    def __init__(self, db: MySQLDatabase, table: str, columns: List[str], durability: str = 'async',
+                 flush_rows: int = 500, flush_interval: float = 1.0, max_queue: int = 10000,
+                 overflow: str = 'block', put_timeout: float = 0.1, sync_timeout: float = 5,
+                 wal_path: Optional[str] = None, wal_fsync: bool = False,
+                 prepare: Optional[Callable[[], bool]] = None):
+        if durability not in ('sync', 'async', 'wal'):
+            raise ValueError(f"Unknown memory durability {durability}")
+        if overflow not in ('block', 'drop'):
+            raise ValueError(f"Unknown memory queue overflow {overflow}")
+        if durability == 'wal' and not wal_path:
+            raise ValueError("The 'wal' durability needs a wal_path")
+        self.db = db
+        self.table = table
+        self.columns = columns
+        self.durability = durability
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self.sync_timeout = sync_timeout
+        self.prepare = prepare
+        self._prepared = prepare is None
+        self.wal = WriteAheadLog(wal_path, segment_rows=flush_rows, fsync=wal_fsync) if durability == 'wal' else None
+        # (seq, row, time.monotonic() when queued)
+        self._queue: Deque[Tuple[int, Sequence[Any], float]] = deque()
+        self._in_flight: List[Tuple[int, Sequence[Any], float]] = []
+        self._seq = 0
+        self._committed_seq = 0
+        # seqs of the rows the server refused, until their 'sync' caller is told
+        self._refused = set()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._committed = threading.Condition(self._lock)
+        self._metrics = {'queued': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'failures': 0, 'replayed': 0}
+        if self.wal is not None:
+            self._replay()
+        self._flusher = threading.Thread(target=self._flush_loop, name=f'{table}-writer', daemon=True)
+        self._flusher.start()
+
+    def _replay(self) -> None:
+        """Queue again the rows left in the log by dead processes, then start this process's log
+        """
+        with self._lock:
+            def requeue(row):
+                self._enqueue(row)
+                self._metrics['replayed'] += 1
+            # the rows are appended to this process's segments before the orphans are removed
+            n_segments = self.wal.replay_orphans(requeue)
+        if n_segments:
+            logger.info(f"{self.table} writer replayed {self._metrics['replayed']} rows of {n_segments} log segments")
+
+    def _enqueue(self, row: Sequence[Any]) -> int:
+        self._seq += 1
+        if self.wal is not None:
+            self.wal.append(self._seq, row)
+        self._queue.append((self._seq, row, time.monotonic()))
+        self._metrics['queued'] += 1
+        self._not_empty.notify()
+        return self._seq
+
+    def _backlog(self) -> int:
+        return len(self._queue) + len(self._in_flight)
+
+    def put(self, row: Sequence[Any]) -> bool:
+        """
+        Queue a row. False if it was dropped (queue full or writer closed), or with
+        'sync' if its batch did not commit within sync_timeout (it stays queued).
+        """
+        with self._lock:
+            if self._closed:
+                self._metrics['dropped'] += 1
+                return False
+            if self._backlog() >= self.max_queue and self.overflow == 'block':
+                self._not_full.wait_for(lambda: self._backlog() < self.max_queue or self._closed, self.put_timeout)
+            if self._backlog() >= self.max_queue or self._closed:
+                self._metrics['dropped'] += 1
+                return False
+            seq = self._enqueue(row)
+            if self.durability == 'sync':
+                committed = self._committed.wait_for(lambda: self._committed_seq >= seq, self.sync_timeout)
+                if seq in self._refused:
+                    self._refused.discard(seq)
+                    return False
+                return committed
+        return True
+
+    def pending(self, match: Callable[[Sequence[Any]], bool]) -> List[Sequence[Any]]:
+        """The rows queued or in flight that match, oldest first
+        """
+        with self._lock:
+            return [row for _, row, _ in self._in_flight + list(self._queue) if match(row)]
+
+    def _next_batch(self) -> List[Tuple[int, Sequence[Any], float]]:
+        """Wait for a full batch, the flush interval of the oldest row or the close; [] when closed and drained
+        """
+        with self._lock:
+            while not self._closed and len(self._queue) < self.flush_rows:
+                wait = None
+                # 'sync' callers are waiting: the rows queued while the previous batch was written form the next one
+                if self._queue and self.durability == 'sync':
+                    break
+                if self._queue:
+                    wait = self._queue[0][2] + self.flush_interval - time.monotonic()
+                    if wait <= 0:
+                        break
+                self._not_empty.wait(wait)
+            n = min(self.flush_rows, len(self._queue))
+            self._in_flight = [self._queue.popleft() for _ in range(n)]
+            return self._in_flight
+
+    def _insert(self, rows: List[Sequence[Any]]) -> Tuple[bool, Any]:
+        """batch_insert as a (flag, result) tuple, including the errors it raises (connection, PoolTimeout)
+        """
+        try:
+            if not self._prepared:
+                self._prepared = self.prepare()
+                if not self._prepared:
+                    return False, '[ERROR] {} is not ready to be written'.format(self.table)
+            return self.db.batch_insert(self.table, [list(row) for row in rows], self.columns)
+        except Exception as e:
+            return False, '[ERROR] {}'.format(str(e))
+
+    def _flush_loop(self) -> None:
+        retry_wait = self.flush_interval
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            flag, result = self._insert([row for _, row, _ in batch])
+            refused = []
+            if not flag and rejected(result):
+                # one bad row must not hold the queue: write the rows one by one, dropping the refused ones
+                logger.error(f"{self.table} writer batch of {len(batch)} rows refused, writing them one by one: {result}")
+                for seq, row, _ in batch:
+                    row_flag, row_result = self._insert([row])
+                    if not row_flag and rejected(row_result):
+                        logger.error(f"{self.table} writer dropped row {row}: {row_result}")
+                        refused.append(seq)
+                    elif not row_flag:
+                        # the connection failed meanwhile; the whole batch is retried (at-least-once)
+                        flag, result = False, row_result
+                        break
+                else:
+                    flag = True
+                    with self._lock:
+                        self._metrics['dropped'] += len(refused)
+                        if self.durability == 'sync':
+                            self._refused.update(refused)
+            with self._lock:
+                self._in_flight = []
+                if flag:
+                    self._committed_seq = batch[-1][0]
+                    self._metrics['written'] += len(batch) - len(refused)
+                    self._metrics['batches'] += 1
+                    if self.wal is not None:
+                        self.wal.release(self._committed_seq)
+                    self._committed.notify_all()
+                    self._not_full.notify_all()
+                else:
+                    # back to the front, in order; the queue fills and applies the backpressure meanwhile
+                    self._queue.extendleft(reversed(batch))
+                    self._metrics['failures'] += 1
+            if flag:
+                retry_wait = self.flush_interval
+            else:
+                logger.error(f"{self.table} writer failed to write {len(batch)} rows, retrying in {retry_wait:.1f}s: {result}")
+                time.sleep(retry_wait)
+                retry_wait = min(retry_wait * 2, 30)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Flush the queued rows and stop; rows left after timeout stay in the log with 'wal', are lost otherwise
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self._flusher.join(timeout)
+        with self._lock:
+            if self._backlog():
+                logger.error(f"{self.table} writer closed with {self._backlog()} rows not written")
+            if self.wal is not None:
+                self.wal.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update(durability=self.durability, backlog=self._backlog(), max_queue=self.max_queue,
+                         rows_per_batch=stats['written'] / stats['batches'] if stats['batches'] else 0.0,
+                         wal_segments=len(self.wal) if self.wal is not None else None)
+            return stats
+
+
+_memory_writer = None
+_memory_writer_lock = threading.Lock()
+
+def get_memory_writer() -> MemoryWriter:
+    """Process-wide MemoryWriter of user_memory, flushed at exit
+    """
+    global _memory_writer
+    if _memory_writer is None:
+        with _memory_writer_lock:
+            if _memory_writer is None:
+                # imported here: memory imports this module
+                from memory import MEMORY_COLUMNS, MEMORY_TABLE, ensure_schema
+                db = MySQLDatabase(in_product=False)
+                writer = MemoryWriter(db, MEMORY_TABLE, MEMORY_COLUMNS,
+                                      durability=MEMORY_DURABILITY, flush_rows=MEMORY_FLUSH_ROWS,
+                                      flush_interval=MEMORY_FLUSH_INTERVAL, max_queue=MEMORY_QUEUE_MAX,
+                                      overflow=MEMORY_QUEUE_OVERFLOW, put_timeout=MEMORY_QUEUE_PUT_TIMEOUT,
+                                      sync_timeout=MEMORY_SYNC_TIMEOUT, wal_path=MEMORY_WAL_PATH,
+                                      wal_fsync=MEMORY_WAL_FSYNC, prepare=lambda: ensure_schema(db))
+                atexit.register(writer.close, MEMORY_SYNC_TIMEOUT)
+                _memory_writer = writer
+    return _memory_writer
@@ -1,104 +1,452 @@
+import re
+import time
+import threading
+from typing import NamedTuple, List, Tuple, Any
+
 import pymysql
-from pymysql.converters import escape_string
+import pymysql.cursors
+
+from db_pool import PoolTimeout, pool_stats
+from db_routing import endpoint_pool, get_endpoint, get_router
+from globals import *
+from logger import logger
+
+
+# pool name -> max_allowed_packet of its server
+_max_allowed_packet = {}
+
+# prefix of the error returned when a statement ran out of time
+TIMEOUT_ERROR = '[ERROR] Timeout'
+# ER_QUERY_TIMEOUT (MAX_EXECUTION_TIME exceeded) and ER_QUERY_INTERRUPTED (KILL QUERY)
+_TIMEOUT_ERRNOS = (3024, 1317)
+_SELECT_RE = re.compile(r"^\s*select\b(?!\s*/\*\+)", re.IGNORECASE)
+# a query fetch_bounded may limit, the trailing LIMIT [offset,] count [OFFSET offset] of one,
+# and what makes a LIMIT unsafe to add: comments, locking reads, INTO, several statements
+_QUERY_RE = re.compile(r"^\s*(select\b|\()", re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\blimit\b", re.IGNORECASE)
+_TAIL_LIMIT_RE = re.compile(r"\blimit\s+(?:\d+\s*,\s*)?(\d+)(?:\s+offset\s+\d+)?$", re.IGNORECASE)
+_UNLIMITABLE_RE = re.compile(r"--|#|/\*|;|\binto\b|\bfor\s+(update|share)\b|\block\s+in\s+share\s+mode\b",
+                             re.IGNORECASE)
+
+
+class QueryTimeout(Exception):
+    """The statement was stopped by the server at its deadline"""
+
+
+def with_max_execution_time(sql: str, timeout: float) -> str:
+    """Add a MAX_EXECUTION_TIME hint to a SELECT, so the server stops it by itself at the deadline
+    """
+    return _SELECT_RE.sub(lambda m: m.group(0) + ' /*+ MAX_EXECUTION_TIME({}) */'.format(max(1, int(timeout * 1000))), sql, count=1)
+
+
+def with_row_limit(sql: str, limit: int) -> str:
+    """
+    The SELECT returning at most limit rows: a LIMIT is appended, or a larger trailing one
+    tightened. A statement where that could change its meaning or syntax (a LIMIT that is not
+    the last clause or not a number, comments, locking reads...) is returned as it is.
+    """
+    body = sql.strip().rstrip(';').rstrip()
+    if not _QUERY_RE.match(body) or _UNLIMITABLE_RE.search(body):
+        return sql
+    tail = _TAIL_LIMIT_RE.search(body)
+    if tail is None:
+        return sql if _LIMIT_RE.search(body) else '{} LIMIT {}'.format(body, limit)
+    if int(tail.group(1)) <= limit:
+        return sql
+    return body[:tail.start(1)] + str(limit) + body[tail.end(1):]
+
+
+def result_errno(error: str) -> int:
+    """MySQL errno of a '[ERROR] (errno, message)' result, 0 if it has none (e.g. a pool timeout)
+    """
+    try:
+        return int(error.split('(', 1)[1].split(',', 1)[0])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+class QueryDeadline():
+    """
+    Issues KILL QUERY on the connection if the with block outlives the timeout.
+
+    The kill is sent from a connection of its own, as the pooled ones may all be
+    busy. A killed connection must not go back to the pool: the KILL may arrive
+    after the statement ended and hit the next one. A backend without KILL QUERY
+    (SQLite) interrupts the connection in place.
+    """
+
+    def __init__(self, db, conn, timeout, endpoint=None):
+        self.db = db
+        self.conn = conn
+        self.endpoint = endpoint if endpoint is not None else db.endpoint
+        self.timeout = timeout
+        self.killed = False
+        self._done = False
+        self._lock = threading.Lock()
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(timeout, self._kill, args=(conn.thread_id(),))
+            self._timer.daemon = True
+
+    def __enter__(self):
+        if self._timer is not None:
+            self._timer.start()
+        return self
+
+    def __exit__(self, *exc):
+        # waits for a kill in progress, so the connection is not released under it
+        with self._lock:
+            self._done = True
+            if self._timer is not None:
+                self._timer.cancel()
+        return False
+
+    def _kill(self, thread_id):
+        with self._lock:
+            if self._done:
+                return
+            self.killed = True
+            if self.endpoint.capabilities.kill_query:
+                self.db.kill_query(thread_id, self.endpoint)
+            else:
+                self.conn.interrupt()
+
+    def error(self, e):
+        """The error message of e, TIMEOUT_ERROR if the deadline stopped the statement
+        """
+        errno = e.args[0] if isinstance(e, pymysql.MySQLError) and e.args else None
+        if isinstance(e, QueryTimeout) or self.killed or (self.timeout is not None and errno in _TIMEOUT_ERRNOS):
+            return '{} after {}s'.format(TIMEOUT_ERROR, self.timeout)
+        return '[ERROR] {}'.format(str(e))
+
+
+class BoundedResult(NamedTuple):
+    rows: List[Tuple[Any, ...]]
+    truncated: bool
+    n_bytes: int
+
+
+def row_bytes(row) -> int:
+    """Approximate size of a row as received: text and binary lengths, 8 bytes per other value
+    """
+    size = 0
+    for value in row:
+        if isinstance(value, (str, bytes, bytearray)):
+            size += len(value)
+        else:
+            size += 8
+    return size
 
 
 class MySQLDatabase():
     """
-    Whenever sending a SQL to MySQL server, use conn_acquire and conn_release to 
-    establish and close a new connection exclusively used for this SQL execution.
-    This can avoid waiting timeout problem caused by MySQL's default setting.
+    Every SQL checks a connection out of a process-wide pool and returns it
+    right after, so MySQLDatabase objects are cheap to create per call. The
+    pool pings connections on checkout and recycles idle ones, which avoids
+    the wait_timeout problem the old connection-per-SQL design worked around.
+
+    in_product selects the endpoint: the product data on the primary, or the
+    metadata DB of the agent's own tables. With read_only, the fetch methods
+    of a product instance read from a replica (see db_routing); the writes
+    always go to the primary.
     """
-    DB_HOST = 'localhost'
 
-    def __init__(self, in_product=True):
-        self.mysql_conn = None
-        self.DB_PORT = 3306
+    def __init__(self, in_product=True, read_only=False):
+        # one instance may be shared by threads (e.g. the DAG executor), so the checked-out connection is per thread
+        self._local = threading.local()
+        self.endpoint = get_endpoint('primary' if in_product else 'metadata')
+        self.read_only = read_only and in_product
+        self.pool = endpoint_pool(self.endpoint)
+
+    @property
+    def mysql_conn(self):
+        return getattr(self._local, 'conn', None)
+
+    @mysql_conn.setter
+    def mysql_conn(self, conn):
+        self._local.conn = conn
+
+    def read_endpoint(self):
+        """Endpoint of the next read: a replica for a read-only instance
+        """
+        return get_router().choose() if self.read_only else self.endpoint
+
+    def _acquire_read(self):
+        """
+        (endpoint, connection) of the next read. A replica that cannot be connected to is reported
+        to the router, which keeps the reads off it for a while, and the read goes to the primary.
+        """
+        endpoint = self.read_endpoint()
+        if endpoint != self.endpoint:
+            try:
+                return endpoint, endpoint_pool(endpoint).acquire()
+            except (pymysql.MySQLError, PoolTimeout) as e:
+                get_router().mark_unreachable(endpoint, e)
+        return self.endpoint, self.pool.acquire()
+
+    @property
+    def capabilities(self):
+        """Features of the backend (see db_backend.Capabilities)
+        """
+        return self.endpoint.capabilities
+
+    def _with_timeout(self, sql, timeout):
+        if timeout is None or not self.capabilities.max_execution_time:
+            return sql
+        return with_max_execution_time(sql, timeout)
+
+    def _record_read(self, endpoint, seconds):
+        if endpoint != self.endpoint:
+            get_router().record_latency(endpoint, seconds)
+
+    def pool_stats(self):
+        """Metrics of every pool of the process
+        """
+        return pool_stats()
     
-    def conn_acquire(self):
-        self.mysql_conn = pymysql.connect(host=self.DB_HOST, port=self.DB_PORT, user='root', 
-                                         password='****', db='chat2sql')
-
-        # # set max_allowed_packet to 1G
-        # with self.mysql_conn.cursor() as cursor:
-        #     cursor.execute('set global max_allowed_packet=1073741824;')
-        # self.mysql_conn.commit()
+    def conn_acquire(self, endpoint=None):
+        endpoint = endpoint if endpoint is not None else self.endpoint
+        self.mysql_conn = endpoint_pool(endpoint).acquire()
+        self._local.endpoint = endpoint
     
-    def conn_release(self):
-        self.mysql_conn.close()
+    def conn_release(self, discard=False):
+        endpoint_pool(self._local.endpoint).release(self.mysql_conn, discard=discard)
+        self.mysql_conn = None
+
+    def _release_after_error(self, discard=False):
+        """Roll back and return the connection; a connection that cannot roll back is dropped
+        """
+        try:
+            self.mysql_conn.rollback()
+            broken = not self.mysql_conn.open
+        except Exception:
+            broken = True
+        self.conn_release(discard=discard or broken)
+
+    def kill_query(self, thread_id, endpoint=None):
+        """
+        Stop the statement running on the given connection thread of the endpoint, from a new connection.
+        """
+
+        endpoint = endpoint if endpoint is not None else self.endpoint
+        try:
+            conn = endpoint.connect()
+        except Exception as e:
+            logger.error(f"KILL QUERY {thread_id} failed to connect: {e}")
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("KILL QUERY %s", (thread_id,))
+            return True
+        except Exception as e:
+            # e.g. the statement ended and its connection is gone
+            logger.error(f"KILL QUERY {thread_id} failed: {e}")
+            return False
+        finally:
+            conn.close()
         
-    def executes(self,sqls):
+    def executes(self, sqls, timeout=None):
         """
         Execute the given sql.
+
+        With a timeout (seconds), the statements still running at the deadline are killed.
         """
 
         self.conn_acquire()
 
+        deadline = QueryDeadline(self, self.mysql_conn, timeout)
         try:
-            with self.mysql_conn.cursor() as cursor:
-                for sql in sqls:
-                    cursor.execute(sql)
-            self.mysql_conn.commit()
+            with deadline:
+                self.mysql_conn.begin()
+                with self.mysql_conn.cursor() as cursor:
+                    for sql in sqls:
+                        cursor.execute(self._with_timeout(sql, timeout))
+                self.mysql_conn.commit()
         except Exception as e:
-            try:
-                self.mysql_conn.rollback()
-            except Exception:
-                pass
-            self.conn_release()
-            return False, '[ERROR] {}'.format(str(e))
+            self._release_after_error(discard=deadline.killed)
+            return False, deadline.error(e)
 
-        self.conn_release()
+        self.conn_release(discard=deadline.killed)
         return True, None
 
-    def execute(self, sql):
+    def execute(self, sql, timeout=None):
         """
         Execute the given sql.
+
+        With a timeout (seconds), a SELECT carries a MAX_EXECUTION_TIME hint, and any
+        statement still running at the deadline is killed.
         """
 
         self.conn_acquire()
 
+        deadline = QueryDeadline(self, self.mysql_conn, timeout)
         try:
-            with self.mysql_conn.cursor() as cursor:
-                cursor.execute(sql)
-            self.mysql_conn.commit()
+            with deadline:
+                with self.mysql_conn.cursor() as cursor:
+                    cursor.execute(self._with_timeout(sql, timeout))
+                self.mysql_conn.commit()
         except Exception as e:
-            try:
-                self.mysql_conn.rollback()
-            except Exception:
-                pass
-            self.conn_release()
-            return False, '[ERROR] {}'.format(str(e))
+            self._release_after_error(discard=deadline.killed)
+            return False, deadline.error(e)
         
-        self.conn_release()
+        self.conn_release(discard=deadline.killed)
         return True, None
     
-    def fetch(self, sql):
+    def fetch(self, sql, timeout=None):
         """
         Execute the given sql and fetch results from db.
+
+        The timeout works as in execute; a timed out statement returns TIMEOUT_ERROR.
         """
 
-        self.conn_acquire()
+        endpoint, self.mysql_conn = self._acquire_read()
+        self._local.endpoint = endpoint
 
         select_results = set()
+        deadline = QueryDeadline(self, self.mysql_conn, timeout, endpoint)
         try:
-            with self.mysql_conn.cursor() as cursor:
-                cursor.execute(sql)
-                select_results = cursor.fetchall()
+            s = time.monotonic()
+            with deadline:
+                with self.mysql_conn.cursor() as cursor:
+                    cursor.execute(self._with_timeout(sql, timeout))
+                    select_results = cursor.fetchall()
+            self._record_read(endpoint, time.monotonic() - s)
         except Exception as e:
-            self.conn_release()
-            return False, '[ERROR] {}'.format(str(e))
+            self._release_after_error(discard=deadline.killed)
+            return False, deadline.error(e)
 
-        self.conn_release()
+        self.conn_release(discard=deadline.killed)
         return True, select_results
+
+    def fetch_iter(self, sql, args=None, batch_size=FETCH_BATCH_SIZE, timeout=None):
+        """
+        Iterate over the rows of the given sql without holding them all in memory.
+
+        The rows are streamed from the server with an unbuffered cursor, batch_size
+        at a time. Errors are raised to the caller, QueryTimeout if the timeout
+        (seconds, covering the execution and the streaming) stopped the statement.
+        If the iteration stops early, the stream is stopped (see _stop_stream) and
+        the connection goes back to the pool.
+        """
+
+        endpoint, conn = self._acquire_read()
+        pool = endpoint_pool(endpoint)
+        streaming, completed = False, False
+        deadline = QueryDeadline(self, conn, timeout, endpoint)
+        try:
+            with deadline:
+                cursor = conn.cursor(pymysql.cursors.SSCursor)
+                s = time.monotonic()
+                cursor.execute(self._with_timeout(sql, timeout), args)
+                self._record_read(endpoint, time.monotonic() - s)
+                streaming = True
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+                cursor.close()
+                completed = True
+        except pymysql.MySQLError as e:
+            if deadline.error(e).startswith(TIMEOUT_ERROR):
+                raise QueryTimeout(str(e)) from e
+            raise
+        finally:
+            # a SQL error leaves the connection usable; a kill by the deadline or a lost connection do not
+            discard = deadline.killed or not conn.open
+            if streaming and not completed and not discard:
+                discard = not self._stop_stream(conn, cursor, endpoint, batch_size)
+            pool.release(conn, discard=discard)
+
+    def _stop_stream(self, conn, cursor, endpoint, batch_size):
+        """
+        Finish a stream its reader left early, so the connection can be reused: up to batch_size
+        unread rows are skipped, a longer result is stopped by KILL QUERY and the rows sent before
+        the kill are read. SQLite steps the statement lazily, closing the cursor stops it.
+        False if the connection is not reusable.
+        """
+        try:
+            if endpoint.capabilities.kill_query and len(cursor.fetchmany(batch_size)) == batch_size:
+                if not self.kill_query(conn.thread_id(), endpoint):
+                    return False
+            try:
+                cursor.close()
+            except pymysql.MySQLError as e:
+                if not e.args or e.args[0] not in _TIMEOUT_ERRNOS:
+                    raise
+            # a KILL that arrived after the statement ended is consumed here, not by the next statement
+            conn.ping(reconnect=False)
+            return conn.open
+        except Exception as e:
+            logger.error(f"Stopping the stream of connection {conn.thread_id()} failed, dropping it: {e}")
+            return False
+
+    def fetch_bounded(self, sql, max_rows=FETCH_MAX_ROWS, max_bytes=FETCH_MAX_BYTES, args=None, timeout=None):
+        """
+        Execute the given sql and fetch at most max_rows rows / max_bytes bytes.
+
+        Reading stops as soon as a cap is hit; the result tells whether rows were left out.
+        A SELECT is limited to max_rows + 1 rows where possible (see with_row_limit), so the
+        server does not produce rows that are not read. A statement stopped by the timeout
+        returns TIMEOUT_ERROR.
+        """
+
+        rows, n_bytes, truncated = [], 0, False
+        batch_size = max(1, min(FETCH_BATCH_SIZE, max_rows + 1))
+        rows_iter = self.fetch_iter(with_row_limit(sql, max_rows + 1), args=args, batch_size=batch_size,
+                                    timeout=timeout)
+        try:
+            for row in rows_iter:
+                size = row_bytes(row)
+                if len(rows) >= max_rows or n_bytes + size > max_bytes:
+                    truncated = True
+                    break
+                rows.append(row)
+                n_bytes += size
+        except QueryTimeout:
+            return False, '{} after {}s'.format(TIMEOUT_ERROR, timeout)
+        except Exception as e:
+            return False, '[ERROR] {}'.format(str(e))
+        finally:
+            rows_iter.close()
+        return True, BoundedResult(rows, truncated, n_bytes)
     
+    def table_update_times(self):
+        """
+        UPDATE_TIME of the tables of the database, as a dict table -> datetime (None if never updated).
+        Empty without information_schema.
+        """
+
+        if not self.capabilities.information_schema:
+            return True, {}
+
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    # MySQL 8 caches the table statistics for a day by default; the variable does not exist before 8.0
+                    try:
+                        cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+                    except pymysql.MySQLError:
+                        pass
+                    cursor.execute("SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES "
+                                   "WHERE TABLE_SCHEMA = DATABASE()")
+                    rows = cursor.fetchall()
+            except pymysql.MySQLError as e:
+                return False, '[ERROR] {}'.format(str(e))
+        return True, {table.lower(): update_time for table, update_time in rows}
+
     def get_column_names(self, table):
         """
         Get column names of the given table.
         """
 
         column_list = list()
-        query_sql = ("SELECT COLUMN_NAME "
-                     "FROM information_schema.COLUMNS "
-                     "WHERE table_schema='website' AND table_name='{}'".format(table))
+        if self.capabilities.information_schema:
+            query_sql = ("SELECT COLUMN_NAME "
+                         "FROM information_schema.COLUMNS "
+                         "WHERE table_schema='website' AND table_name='{}'".format(table))
+        else:
+            query_sql = "SELECT name FROM pragma_table_info('{}')".format(table)
         
         _, resp = self.fetch(query_sql)
         for tuple in resp:
@@ -115,7 +463,27 @@ class MySQLDatabase():
         else:
             return self.batch_insert_with_mode(table,res_list,col_list=col_list,mode='append')
 
-    def batch_insert_with_mode(self, table, res_list, col_list=None,mode='append'):
+    def max_allowed_packet(self):
+        """max_allowed_packet of the write endpoint, the server of the inserts, read once per pool
+        """
+        packet = _max_allowed_packet.get(self.pool.name)
+        if packet is None:
+            flag, result = False, None
+            if self.capabilities.server_variables:
+                # not fetch(): a read-only instance would ask a replica
+                try:
+                    with self.pool.connection() as conn:
+                        with conn.cursor() as cursor:
+                            cursor.execute("SELECT @@max_allowed_packet")
+                            flag, result = True, cursor.fetchall()
+                except Exception as e:
+                    logger.error(f"Reading max_allowed_packet of {self.endpoint.label} failed: {e}")
+            # the server default of MySQL 8 if it cannot be read
+            packet = int(result[0][0]) if flag and result else 64 * 1024 * 1024
+            _max_allowed_packet[self.pool.name] = packet
+        return packet
+
+    def batch_insert_with_mode(self, table, res_list, col_list=None,mode='append',chunk_size=INSERT_CHUNK_SIZE):
         """
 
         Insert batch records to db
@@ -124,69 +492,123 @@ class MySQLDatabase():
         :param res_list:    the 2d list of VALUES to INSERT
         :param col_list:    the list of column names to perform INSERT
                             None if all columns are used
+        :param chunk_size:  rows per executemany call
 
         # append insert into语义(可能会插入报错)
         # replace replace into 语义
         # redo 先delete全表，然后重新插入
+
+        The values are bound as parameters, so each value is quoted by its own type
+        and None becomes NULL. pymysql turns every chunk into multi-row statements no
+        longer than max_allowed_packet allows. All chunks (and the DELETE of redo)
+        run in one transaction: the load is applied entirely or not at all.
         """
 
         if len(res_list) == 0:
             return True, None
+        if mode not in ['append', 'replace', 'redo']:
+            return False, '[ERROR] Unknown insert mode {}'.format(mode)
 
-        # Construct INSERT SQL sentences.
         if col_list is None:
             attr_str = ''
         else:
             attr_str = '({})'.format(','.join(col_list))
-        if mode in ['append','redo']:
-            sql = "INSERT INTO {} {} VALUES".format(table, attr_str)
-        elif mode in ['replace']:
-            sql = "REPLACE INTO {} {} VALUES".format(table, attr_str)
-        else:
-            pass
-        value_pattern = "("
-        for attr in res_list[0]:
-            if type(attr) in [int, float, bool]:
-                value_pattern += "{},"
-            else:
-                value_pattern += "'{}',"
-        value_pattern = value_pattern[:-1] + '),'
-
-        for res in res_list:
-            my_res = [escape_string(v) if isinstance(v,str) else v for v in res]
-            sql += value_pattern.format(*my_res)
-        sql = sql[:-1] + ';'
-        # may not be safe
-        sql = sql.replace(',None',',NULL')
-        if mode=='redo':
-            sqls = ['delete from {}'.format(table),sql]
-            return self.executes(sqls)
-        else:
-            return self.execute(sql)
+        verb = 'REPLACE' if mode == 'replace' else 'INSERT'
+        sql = "{} INTO {} {} VALUES ({})".format(verb, table, attr_str, ','.join(['%s'] * len(res_list[0])))
+        max_stmt_length = min(INSERT_MAX_STMT_BYTES, int(self.max_allowed_packet() * 0.9))
+
+        self.conn_acquire()
+
+        try:
+            self.mysql_conn.begin()
+            with self.mysql_conn.cursor() as cursor:
+                cursor.max_stmt_length = max_stmt_length
+                if mode == 'redo':
+                    cursor.execute('DELETE FROM {}'.format(table))
+                for start in range(0, len(res_list), chunk_size):
+                    cursor.executemany(sql, res_list[start:start + chunk_size])
+            self.mysql_conn.commit()
+        except Exception as e:
+            self._release_after_error()
+            return False, '[ERROR] {}'.format(str(e))
+
+        self.conn_release()
+        return True, None
     
-    def batch_delete(self, table, res_list, col_name):
+    def batch_delete(self, table, res_list, col_name, chunk_size=DELETE_CHUNK_SIZE, strategy='auto',
+                     commit_every=DELETE_COMMIT_EVERY):
         """
         Delete records from db multiple values of one column.
 
-        :param table:       the name of table to perform DELETE
-        :param res_list:    the 1d list values of column to DELETE
-        :param col_name:    the column to define WHERE to DELETE
+        :param table:        the name of table to perform DELETE
+        :param res_list:     the 1d list values of column to DELETE
+        :param col_name:     the column to define WHERE to DELETE
+        :param chunk_size:   values per DELETE statement
+        :param strategy:     'in' deletes chunk by chunk with WHERE col IN (...);
+                             'temp_table' loads the values into a temporary table and deletes with one join;
+                             'auto' picks 'temp_table' from DELETE_TEMP_TABLE_THRESHOLD values
+        :param commit_every: chunks per commit with 'in', 0 commits once at the end
+
+        The values are bound as parameters, so each one is quoted by its own type.
+        With commit_every > 0 the committed chunks stay deleted if a later one fails.
         """
 
         if len(res_list) == 0:
             return True, None
+        if strategy == 'auto':
+            strategy = 'temp_table' if len(res_list) >= DELETE_TEMP_TABLE_THRESHOLD else 'in'
+        if strategy not in ['in', 'temp_table']:
+            return False, '[ERROR] Unknown delete strategy {}'.format(strategy)
 
-        # construct DELETE SQL sentences.
-        sql = "DELETE FROM {} WHERE ".format(table)
+        self.conn_acquire()
 
-        if type(res_list[0]) == int:
-            condition_pattern = col_name + " = {}"
+        try:
+            self.mysql_conn.begin()
+            with self.mysql_conn.cursor() as cursor:
+                if strategy == 'in':
+                    self._delete_in_chunks(cursor, table, res_list, col_name, chunk_size, commit_every)
+                else:
+                    self._delete_with_temp_table(cursor, table, res_list, col_name, chunk_size)
+            self.mysql_conn.commit()
+        except Exception as e:
+            self._release_after_error()
+            return False, '[ERROR] {}'.format(str(e))
+
+        self.conn_release()
+        return True, None
+
+    def _delete_in_chunks(self, cursor, table, res_list, col_name, chunk_size, commit_every):
+        for idx, start in enumerate(range(0, len(res_list), chunk_size)):
+            chunk = res_list[start:start + chunk_size]
+            cursor.execute("DELETE FROM {} WHERE {} IN ({})".format(table, col_name, ','.join(['%s'] * len(chunk))), chunk)
+            if commit_every > 0 and (idx + 1) % commit_every == 0:
+                self.mysql_conn.commit()
+                self.mysql_conn.begin()
+
+    def _delete_with_temp_table(self, cursor, table, res_list, col_name, chunk_size):
+        # the temporary table lives on this connection only
+        keys_table = '_batch_delete_keys'
+        if self.capabilities.delete_join:
+            drop_sql = "DROP TEMPORARY TABLE IF EXISTS {}".format(keys_table)
+            # it takes the type of the column; the index is declared in CREATE: an ALTER TABLE would commit the transaction
+            create_sqls = ["CREATE TEMPORARY TABLE {} (INDEX (k)) SELECT {} AS k FROM {} LIMIT 0".format(keys_table, col_name, table)]
+            delete_sql = "DELETE t FROM {} AS t JOIN {} AS d ON t.{} = d.k".format(table, keys_table, col_name)
         else:
-            condition_pattern = col_name + " = '{}'"
-        
-        sql += ' OR '.join([condition_pattern.format(res) for res in res_list]) + ';'
-        
-        return self.execute(sql)
+            # SQLite: no DELETE ... JOIN, the IN (SELECT ...) over the indexed keys is planned as a semi-join
+            drop_sql = "DROP TABLE IF EXISTS temp.{}".format(keys_table)
+            create_sqls = ["CREATE TEMP TABLE {} (k)".format(keys_table),
+                           "CREATE INDEX temp.{0}_k ON {0} (k)".format(keys_table)]
+            delete_sql = "DELETE FROM {} WHERE {} IN (SELECT k FROM {})".format(table, col_name, keys_table)
+        cursor.execute(drop_sql)
+        for sql in create_sqls:
+            cursor.execute(sql)
+        try:
+            for start in range(0, len(res_list), chunk_size):
+                cursor.executemany("INSERT INTO {} (k) VALUES (%s)".format(keys_table),
+                                   [(value,) for value in res_list[start:start + chunk_size]])
+            cursor.execute(delete_sql)
+        finally:
+            cursor.execute(drop_sql)
     
     def dump(self, table):
         """
@@ -148,6 +148,11 @@ Final Answer: the final answer to the original input question
 {external_info}
 </External Info>
 
+<Examples>
+# Worked traces of similar questions; follow how they find the tables and columns, but always use the tools above.
+{examples}
+</Examples>
+
 <UserInputFormat>
 Question: <User question>
 </UserInputFormat>
@@ -0,0 +1,57 @@
+"""Query cache module, which keeps the embeddings of recent user questions
+
+User questions repeat a lot ("which country does AS1000 belong to") but are
+one-off texts otherwise, so they are kept in a bounded LRU/TTL cache apart from
+the embedding store of the schema texts, which would otherwise grow forever.
+"""
+
+import re
+import threading
+import unicodedata
+from typing import Dict, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+
+def normalize_query(query: str) -> str:
+    """Case, width and whitespace insensitive key; trailing punctuation is dropped
+    """
+    query = unicodedata.normalize('NFKC', query).lower()
+    query = re.sub(r"\s+", ' ', query).strip()
+    return query.rstrip(' ?？.。!！')
+
+
+class QueryEmbeddingCache:
+    """LRU cache with TTL of query embeddings keyed on the normalized question
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 3600):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[np.ndarray]:
+        key = normalize_query(query)
+        with self._lock:
+            embedding = self.cache.get(key)
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return embedding
+
+    def put(self, query: str, embedding: np.ndarray) -> None:
+        with self._lock:
+            self.cache[normalize_query(query)] = embedding
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self.cache),
+            }
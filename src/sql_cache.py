@@ -0,0 +1,213 @@
+"""SQL cache module, which keeps the results of the SQLs validated against the database
+
+The LLM generates the same SQLs over and over, across ReAct rounds and across
+users, and RefineTool used to run every one of them on the production database.
+Successful bounded results are cached under the normalized SQL, with a TTL per
+table family and a bound on the cached bytes. An entry is dropped as soon as
+one of its tables changes: either bump() is called (e.g. after a sync job) or
+the refresher sees a newer UPDATE_TIME of the table in information_schema.
+"""
+
+import re
+import time
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from cachetools import TLRUCache
+
+from mysql import BoundedResult, MySQLDatabase, row_bytes
+from globals import *
+from logger import logger
+
+# quoted strings and identifiers are kept as they are, everything else is case and whitespace insensitive
+_TOKEN_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`|\s+|[^'\"`\s]+")
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+((?:`[^`]+`|\w+)(?:\.(?:`[^`]+`|\w+))?)", re.IGNORECASE)
+# results of these change without any table changing
+_VOLATILE_RE = re.compile(r"\b(?:now|rand|uuid|sysdate|curdate|curtime|current_date|current_time|current_timestamp"
+                          r"|unix_timestamp|utc_date|utc_time|utc_timestamp|connection_id|last_insert_id)\b", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    tokens = []
+    for token in _TOKEN_RE.findall(sql.strip().rstrip(';').strip()):
+        if token.isspace():
+            tokens.append(' ')
+        elif token[0] in '\'"`':
+            tokens.append(token)
+        else:
+            tokens.append(token.lower())
+    return ''.join(tokens)
+
+
+def extract_tables(sql: str) -> List[str]:
+    """Tables read by the sql, without schema prefix and backquotes
+    """
+    tables = []
+    for name in _TABLE_RE.findall(sql):
+        table = name.split('.')[-1].strip('`').lower()
+        if table not in tables:
+            tables.append(table)
+    return tables
+
+
+def table_family(table: str) -> str:
+    """Family of a table: its DATA2URL prefix (e.g. 'bgp_'), or its first word
+    """
+    prefixes = [prefix for prefix in DATA2URL if table.startswith(prefix)]
+    if prefixes:
+        return max(prefixes, key=len)
+    return table.split('_')[0] + '_'
+
+
+class CachedResult(NamedTuple):
+    result: BoundedResult
+    # table -> version when the result was read
+    versions: Tuple[Tuple[str, int], ...]
+    family: str
+    ttl: float
+    n_bytes: int
+
+
+class SQLResultCache:
+    """Byte-bounded LRU cache with per-family TTL of bounded SQL results
+
+    :param max_bytes:   approximate bytes of the cached rows at most
+    :param ttl:         seconds an entry lives, unless its family is in family_ttl
+    :param family_ttl:  TTL per table family, e.g. {'bgp_': 60, 'as_': 86400}
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 600, family_ttl: Optional[Dict[str, float]] = None):
+        self.ttl = ttl
+        self.family_ttl = dict(family_ttl or {})
+        self.cache = TLRUCache(maxsize=max_bytes, ttu=lambda key, value, now: now + value.ttl,
+                               getsizeof=lambda value: value.n_bytes)
+        self._versions: Dict[str, int] = defaultdict(int)
+        # table -> time.monotonic() of its last bump
+        self._bumped_at: Dict[str, float] = {}
+        self._update_times: Dict[str, Any] = {}
+        self._hits: Dict[str, int] = defaultdict(int)
+        self._misses: Dict[str, int] = defaultdict(int)
+        self._invalidated = 0
+        self._lock = threading.Lock()
+        self._refresher = None
+
+    @staticmethod
+    def cacheable(sql: str) -> bool:
+        sql = sql.lstrip().lower()
+        return (sql.startswith('select') or sql.startswith('with')) and not _VOLATILE_RE.search(sql) and bool(extract_tables(sql))
+
+    def get(self, sql: str, max_rows: int, max_bytes: int) -> Optional[BoundedResult]:
+        if not self.cacheable(sql):
+            return None
+        key = (normalize_sql(sql), max_rows, max_bytes)
+        tables = extract_tables(sql)
+        family = table_family(tables[0]) if tables else ''
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None and any(self._versions[table] != version for table, version in entry.versions):
+                del self.cache[key]
+                entry = None
+            if entry is None:
+                self._misses[family] += 1
+                return None
+            self._hits[family] += 1
+            return entry.result
+
+    def put(self, sql: str, max_rows: int, max_bytes: int, result: BoundedResult,
+            started_at: Optional[float] = None) -> None:
+        """Cache a result; started_at (time.monotonic() before the sql ran) skips results a bump may have outdated
+        """
+        if not self.cacheable(sql):
+            return
+        key = (normalize_sql(sql), max_rows, max_bytes)
+        tables = extract_tables(sql)
+        family = table_family(tables[0])
+        n_bytes = sum(row_bytes(row) for row in result.rows) + len(key[0])
+        with self._lock:
+            if started_at is not None and any(self._bumped_at.get(table, float('-inf')) >= started_at for table in tables):
+                return
+            entry = CachedResult(result, tuple((table, self._versions[table]) for table in tables), family,
+                                 self.family_ttl.get(family, self.ttl), n_bytes)
+            try:
+                self.cache[key] = entry
+            except ValueError:
+                # larger than the whole cache
+                pass
+
+    def bump(self, *tables: str) -> None:
+        """Invalidate the cached results that read any of the given tables
+        """
+        with self._lock:
+            for table in tables:
+                self._versions[table.lower()] += 1
+                self._bumped_at[table.lower()] = time.monotonic()
+                self._invalidated += 1
+
+    def refresh(self, db: Optional[MySQLDatabase] = None) -> List[str]:
+        """Bump the tables whose UPDATE_TIME advanced since the last refresh; returns them
+        """
+        db = db if db is not None else MySQLDatabase(in_product=True)
+        flag, update_times = db.table_update_times()
+        if not flag:
+            logger.error(f"SQL cache refresh failed: {update_times}")
+            return []
+        changed = [table for table, update_time in update_times.items()
+                   if table in self._update_times and update_time != self._update_times[table]]
+        self._update_times.update(update_times)
+        if changed:
+            self.bump(*changed)
+            logger.info(f"SQL cache invalidated {len(changed)} tables: {changed[:10]}")
+        return changed
+
+    def start_refresher(self, interval: float) -> None:
+        if self._refresher is not None or interval <= 0:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"SQL cache refresh failed: {e}")
+                time.sleep(interval)
+
+        self._refresher = threading.Thread(target=loop, name='sql-cache-refresher', daemon=True)
+        self._refresher.start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            families = {}
+            for family in set(self._hits) | set(self._misses):
+                hits, misses = self._hits[family], self._misses[family]
+                families[family] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses),
+                                    'ttl': self.family_ttl.get(family, self.ttl)}
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'entries': len(self.cache),
+                'bytes': self.cache.currsize,
+                'max_bytes': self.cache.maxsize,
+                'invalidated': self._invalidated,
+                'families': families,
+            }
+
+
+_sql_cache = None
+_sql_cache_lock = threading.Lock()
+
+def get_sql_cache() -> Optional[SQLResultCache]:
+    """Process-wide SQLResultCache, None when SQL_CACHE_MAX_BYTES is 0
+    """
+    global _sql_cache
+    if SQL_CACHE_MAX_BYTES <= 0:
+        return None
+    if _sql_cache is None:
+        with _sql_cache_lock:
+            if _sql_cache is None:
+                cache = SQLResultCache(max_bytes=SQL_CACHE_MAX_BYTES, ttl=SQL_CACHE_TTL, family_ttl=SQL_CACHE_FAMILY_TTL)
+                cache.start_refresher(SQL_CACHE_REFRESH_INTERVAL)
+                _sql_cache = cache
+    return _sql_cache
@@ -0,0 +1,243 @@
+"""SQL cost module, which gates the generated SQLs on their EXPLAIN before they run
+
+A SELECT missing a join predicate over the multi-million-row BGP and prefix
+tables can hold the production server for the whole timeout. RefineTool asks
+for the plan first (EXPLAIN FORMAT=JSON, cheap and cached per normalized SQL)
+and estimates the rows the server would examine: rows read per scan of each
+table times the scans, i.e. the rows the join produced before it. A SQL over
+budget is not run; the LLM gets the hot spots of its plan to fix instead.
+"""
+
+import re
+import json
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from cachetools import TTLCache
+
+from mysql import MySQLDatabase
+from sql_cache import normalize_sql
+from globals import *
+from logger import logger
+
+# server errors are numbered 1000-1999 and from 3000, client / connection errors 2000-2999
+_SERVER_ERROR_RE = re.compile(r"^\[ERROR\] \((1\d{3}|[3-9]\d{3}),")
+
+
+class PlanTable(NamedTuple):
+    table: str
+    access_type: str
+    key: Optional[str]
+    possible_keys: List[str]
+    rows_per_scan: float
+    scans: float
+    rows_examined: float
+    dependent: bool
+
+
+class PlanEstimate(NamedTuple):
+    query_cost: float
+    rows_examined: float
+    tables: List[PlanTable]
+    # filesort / temporary table / dependent subquery notes
+    notes: List[str]
+
+    @property
+    def full_scans(self) -> List[PlanTable]:
+        return [table for table in self.tables if table.access_type in ('ALL', 'index')]
+
+
+class CostVerdict(NamedTuple):
+    allowed: bool
+    estimate: Optional[PlanEstimate]
+    # the EXPLAIN error, e.g. a syntax error of the SQL
+    error: Optional[str] = None
+
+
+def _number(value: Any, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _plan_table(node: Dict[str, Any], scans: float, dependent: bool) -> PlanTable:
+    rows_per_scan = _number(node.get('rows_examined_per_scan'), 1.0)
+    return PlanTable(
+        table=node.get('table_name', '?'),
+        access_type=node.get('access_type', '?'),
+        key=node.get('key'),
+        possible_keys=list(node.get('possible_keys') or []),
+        rows_per_scan=rows_per_scan,
+        scans=scans,
+        rows_examined=rows_per_scan * scans,
+        dependent=dependent,
+    )
+
+
+def _walk(node: Any, tables: List[PlanTable], notes: List[str], dependent: bool = False) -> None:
+    if isinstance(node, list):
+        for item in node:
+            _walk(item, tables, notes, dependent)
+        return
+    if not isinstance(node, dict):
+        return
+    dependent = dependent or node.get('dependent') is True
+    if node.get('using_filesort'):
+        notes.append('sorts with a filesort')
+    if node.get('using_temporary_table'):
+        notes.append('builds a temporary table')
+    if isinstance(node.get('nested_loop'), list):
+        # every table is scanned once per row the join produced before it
+        scans = 1.0
+        for item in node['nested_loop']:
+            table = item.get('table') if isinstance(item, dict) else None
+            if isinstance(table, dict):
+                tables.append(_plan_table(table, scans, dependent))
+                scans = _number(table.get('rows_produced_per_join'), scans)
+                _walk({k: v for k, v in table.items() if isinstance(v, (dict, list))}, tables, notes, dependent)
+    elif isinstance(node.get('table'), dict):
+        tables.append(_plan_table(node['table'], 1.0, dependent))
+        _walk({k: v for k, v in node['table'].items() if isinstance(v, (dict, list))}, tables, notes, dependent)
+    for key, value in node.items():
+        if key not in ('nested_loop', 'table') and isinstance(value, (dict, list)):
+            _walk(value, tables, notes, dependent)
+
+
+def parse_plan(plan: Dict[str, Any]) -> PlanEstimate:
+    """Estimate of an EXPLAIN FORMAT=JSON plan
+    """
+    query_block = plan.get('query_block', plan)
+    tables, notes = [], []
+    _walk(query_block, tables, notes)
+    for table in tables:
+        if table.dependent:
+            notes.append(f'runs a dependent subquery on {table.table} once per outer row')
+    return PlanEstimate(
+        query_cost=_number(query_block.get('cost_info', {}).get('query_cost')),
+        rows_examined=sum(table.rows_examined for table in tables),
+        tables=tables,
+        notes=list(dict.fromkeys(notes)),
+    )
+
+
+def format_count(n: float) -> str:
+    for unit, size in (('T', 1e12), ('B', 1e9), ('M', 1e6), ('K', 1e3)):
+        if n >= size:
+            return f'{n / size:.1f}{unit}'
+    return f'{n:.0f}'
+
+
+def hot_spots(estimate: PlanEstimate, k: int = 3) -> List[str]:
+    """The k tables examining the most rows, with why, and the plan notes
+    """
+    spots = []
+    for table in sorted(estimate.tables, key=lambda t: t.rows_examined, reverse=True)[:k]:
+        if table.access_type == 'ALL':
+            access = 'full table scan'
+        elif table.access_type == 'index':
+            access = 'full index scan'
+        else:
+            access = f'{table.access_type} access on index {table.key}'
+        spot = f'{table.table}: {access}, ~{format_count(table.rows_per_scan)} rows per scan'
+        if table.scans > 1:
+            # a large scan count means the table is joined without a usable join condition
+            spot += f' x {format_count(table.scans)} scans (check the join condition)'
+        if table.access_type in ('ALL', 'index'):
+            spot += f"; possible keys: {', '.join(table.possible_keys) or 'none'}"
+        spots.append(spot)
+    return spots + estimate.notes
+
+
+class CostGate:
+    """EXPLAIN-based budget of the SQLs, with the plans cached per normalized SQL
+
+    :param max_rows_examined: estimated rows examined at most, 0 for no limit
+    :param max_query_cost:    optimizer query_cost at most, 0 for no limit
+    """
+
+    def __init__(self, max_rows_examined: float = 20_000_000, max_query_cost: float = 0,
+                 cache_size: int = 1024, cache_ttl: float = 3600, explain_timeout: float = 2):
+        self.max_rows_examined = max_rows_examined
+        self.max_query_cost = max_query_cost
+        self.explain_timeout = explain_timeout
+        self.plans = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._metrics = {'checks': 0, 'plan_hits': 0, 'rejected': 0, 'explain_errors': 0}
+        self._lock = threading.Lock()
+
+    def estimate(self, sql: str, db: Optional[MySQLDatabase] = None):
+        """(True, PlanEstimate) of the sql, from the cache or EXPLAIN; (False, error) if EXPLAIN fails
+        """
+        key = normalize_sql(sql)
+        with self._lock:
+            self._metrics['checks'] += 1
+            estimate = self.plans.get(key)
+            if estimate is not None:
+                self._metrics['plan_hits'] += 1
+                return True, estimate
+        db = db if db is not None else MySQLDatabase(in_product=True, read_only=True)
+        try:
+            flag, result = db.fetch("EXPLAIN FORMAT=JSON {}".format(sql), timeout=self.explain_timeout)
+        except Exception as e:
+            # e.g. PoolTimeout
+            flag, result = False, '[ERROR] {}'.format(str(e))
+        if not flag:
+            with self._lock:
+                self._metrics['explain_errors'] += 1
+            return False, result
+        try:
+            estimate = parse_plan(json.loads(result[0][0]))
+        except (ValueError, IndexError, TypeError, AttributeError) as e:
+            return False, '[ERROR] Unreadable plan: {}'.format(str(e))
+        with self._lock:
+            self.plans[key] = estimate
+        return True, estimate
+
+    def over_budget(self, estimate: PlanEstimate) -> bool:
+        return (0 < self.max_rows_examined < estimate.rows_examined) or (0 < self.max_query_cost < estimate.query_cost)
+
+    def check(self, sql: str, db: Optional[MySQLDatabase] = None) -> CostVerdict:
+        """
+        Whether the sql may run. A SQL the server cannot explain is rejected with the
+        error when it is a SQL error (it would fail the same way when run), and let
+        through when EXPLAIN itself timed out or is unavailable.
+        """
+        db = db if db is not None else MySQLDatabase(in_product=True, read_only=True)
+        if not db.capabilities.explain_json:
+            # no plan to estimate from, e.g. on the sqlite backend
+            return CostVerdict(allowed=True, estimate=None)
+        flag, result = self.estimate(sql, db)
+        if not flag:
+            sql_error = bool(_SERVER_ERROR_RE.match(result))
+            if not sql_error:
+                logger.error(f"EXPLAIN failed, running the SQL unchecked: {result}")
+            return CostVerdict(allowed=not sql_error, estimate=None, error=result)
+        if self.over_budget(result):
+            with self._lock:
+                self._metrics['rejected'] += 1
+            return CostVerdict(allowed=False, estimate=result)
+        return CostVerdict(allowed=True, estimate=result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update(plans=len(self.plans), max_rows_examined=self.max_rows_examined,
+                         max_query_cost=self.max_query_cost)
+            return stats
+
+
+_cost_gate = None
+_cost_gate_lock = threading.Lock()
+
+def get_cost_gate() -> Optional[CostGate]:
+    """Process-wide CostGate, None when both SQL_COST budgets are 0
+    """
+    global _cost_gate
+    if SQL_COST_MAX_ROWS_EXAMINED <= 0 and SQL_COST_MAX_QUERY_COST <= 0:
+        return None
+    if _cost_gate is None:
+        with _cost_gate_lock:
+            if _cost_gate is None:
+                _cost_gate = CostGate(SQL_COST_MAX_ROWS_EXAMINED, SQL_COST_MAX_QUERY_COST,
+                                      SQL_PLAN_CACHE_SIZE, SQL_PLAN_CACHE_TTL, SQL_EXPLAIN_TIMEOUT)
+    return _cost_gate
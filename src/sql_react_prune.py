@@ -8,7 +8,6 @@ import traceback
 from collections import defaultdict
 
 from pydantic import BaseModel, Field, model_validator, ConfigDict
-from cachetools import cached, TTLCache
 from langchain_core.messages import (
     AIMessage,
     HumanMessage,
@@ -48,7 +47,7 @@ class QuestionDAGLLM(BaseLLM):
         if not chat_history:
             history_qa = "None"
         else:
-            history_qa = '\n'.join([f"{idx+1}. {item[0]}\t{item[1]}" for idx, item in enumerate(chat_history)])
+            history_qa = '\n'.join([f"{idx+1}. Question: {item[0]}\tAnswer: {item[1]}" for idx, item in enumerate(chat_history)])
 
         message = [
             SystemMessage(content=prompts.query_dag_prompt),
@@ -145,6 +144,7 @@ class SQLChatAgent(BaseModel):
     tool_descriptions: Optional[List[str]] = Field(default=None, description="Tool name: Tool description & The args info")
     tool2args: Optional[Dict[str, dict]] = Field(default=None, description="Map tool name to its callable function input args")
     tool2func: Optional[Dict[str, callable]] = Field(default=None, description="Map tool name to its callable function")
+    few_shot_index: Optional[Any] = Field(default=None, description="FewShotIndex of the qa.csv traces; the process-wide one if None")
 
     def __init__(self, model_zoo: Dict[str, Any], knowledge: Optional[Any] = None):
         super().__init__(model_zoo=model_zoo, knowledge=knowledge)
@@ -188,8 +188,26 @@ class SQLChatAgent(BaseModel):
         # Get tool2func
         self.tool2func = {tool.name: tool.run for tool in self.tool_set}
 
+    def _few_shot_examples(self, query: str) -> str:
+        """The <Examples> section for the query; "None" when disabled or unavailable
+        """
+        if FEW_SHOT_K <= 0:
+            return "None"
+        try:
+            # imported here to keep faiss and the embedding model out of the server start-up
+            from knn_icl import get_knn_schema
+            from few_shot import get_few_shot_index
+            few_shot_index = self.few_shot_index or get_few_shot_index()
+            return few_shot_index.render(get_knn_schema().embed_query(query))
+        except Exception as e:
+            logger.error(f"Few-shot retrieval failed: {e}")
+            return "None"
+
     # execute a single query and got the answer
-    def _dql_needed_execute(self, query: str, external_info: Union[str, None]) -> Tuple[bool, str]:
+    def _dql_needed_execute(self, query: str, external_info: Union[str, None], use_examples: bool = True,
+                            stats: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        """Run the ReAct loop; stats, if given, receives the number of rounds (LLM calls) used
+        """
         def extract_input_args(tool_input: str) -> Dict:
             """Extract input args from the json style string
             """
@@ -239,7 +257,8 @@ class SQLChatAgent(BaseModel):
             SystemMessage(content=prompts.sql_react_prompt.format(
                 tools="\n".join(self.tool_descriptions),
                 tool_names=",".join([tool.name for tool in self.tool_set]),
-                external_info=external_info if external_info else "None"
+                external_info=external_info if external_info else "None",
+                examples=self._few_shot_examples(query) if use_examples else "None"
             )),
             HumanMessage(content=user_prompt)
         ]
@@ -255,6 +274,8 @@ class SQLChatAgent(BaseModel):
                 return False, ''
             
             react_round += 1
+            if stats is not None:
+                stats['rounds'] = react_round
 
             content = model.invoke(messages).content # AI answer
             
@@ -268,6 +289,7 @@ class SQLChatAgent(BaseModel):
                 final_answer_match = re.search(final_answer_pattern, content, re.DOTALL)
                 if final_answer_match:
                     final_answer = final_answer_match.group(1).strip()
+                    logger.info(f"ReAct finished in {react_round} rounds")
                     return True, final_answer
                 else:
                     # Parse error. Let LLM re-try.
@@ -1,13 +1,23 @@
 import re
+import time
+import asyncio
 from typing import List, Dict, Union, Any
 from pydantic import BaseModel, Field
 
-import concurrent
+import concurrent.futures
 
 from bases import BaseTool
-from knn_icl import KNNSchema
 from sql_react_prune import SQLAnswer
-from mysql import MySQLDatabase
+from mysql import MySQLDatabase, TIMEOUT_ERROR
+from async_mysql import get_db_executor
+from sql_cache import get_sql_cache
+from sql_cost import get_cost_gate, hot_spots, format_count
+from globals import *
+
+# error of a SQL RefineTool does not run, as it could modify the tables
+REFUSED_ERROR = '[ERROR] Refused'
+# seconds RefineTool waits for a validation: the EXPLAIN, the sql, and the grace for the server to stop it
+REFINE_WAIT_TIMEOUT = SQL_EXPLAIN_TIMEOUT + REFINE_SQL_TIMEOUT + SQL_TIMEOUT_GRACE
 
 class RAGTool(BaseTool):
     name: str = "Retrieve_table"
@@ -18,13 +28,15 @@ class RAGTool(BaseTool):
             name=self.name,
             description=self.description
         )
-        self.knn_schema = KNNSchema()
     
     def run(self, query: str, table_list_record: List[str]):
         """Doing RAG from our Vector Databse
         """
-        observation, table_list = self.knn_schema.create_structured_table_schema(query, exclude_list=table_list_record, k=3)
-        table_list_record = list(set(table_list_record) | set(table_list))
+        # knn_icl is imported on first use; the server loads it in its warm-up stage
+        from knn_icl import get_knn_schema
+        observation, table_list = get_knn_schema().create_structured_table_schema(query, exclude_list=table_list_record, k=3)
+        # extend the caller's record in place, so the next round excludes these tables
+        table_list_record.extend(table_name for table_name in table_list if table_name not in table_list_record)
         return  observation
         
 
@@ -32,35 +44,100 @@ class RefineTool(BaseTool):
     name: str = "Refine_sql"
     description: str = "Recheck the SQL you generated. If the execution result of the SQL has Error, the SQL is needed for further correction. Use this tool when you need to check the correctness of a SQL."
 
+    @staticmethod
+    def _refused(sql: str) -> bool:
+        return 'create' in sql.lower() or 'delete' in sql.lower() or 'drop' in sql.lower() or 'insert' in sql.lower()
+
     def run(self, sql: str):
         """Execute the sql and get the feedback from our DB
         """
-        SQL_TIMEOUT = 5
-        mysql = MySQLDatabase(in_product=True)
-        if 'create' in sql.lower() or 'delete' in sql.lower() or 'drop' in sql.lower() or 'insert' in sql.lower():
-            return 'Execute fail. You can\'t modify these tables! Your wrong SQL is \"{sql}\".'
-        
-        # Limit the number of returns
-        if 'limit' not in sql.lower():
-            sql = sql.rstrip(';')
-            sql += ' LIMIT 5;'
+        feedback = self._early_feedback(sql)
+        if feedback is not None:
+            return feedback
+        # the server stops the sql at REFINE_SQL_TIMEOUT; the shared executor is not waited for past the grace
+        future = get_db_executor().submit(self._validate, sql)
+        try:
+            return future.result(timeout=REFINE_WAIT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            return self._feedback(sql, (False, TIMEOUT_ERROR))
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(mysql.fetch, sql)
-            try:
-                result = future.result(timeout=SQL_TIMEOUT)
-            except concurrent.futures.TimeoutError:
-                return 'Execute timeout. You should optimize the SQL: "{sql}".'
+    async def arun(self, sql: str):
+        """Same as run, for an async agent: the sql runs on the shared DB thread pool
+        """
+        feedback = self._early_feedback(sql)
+        if feedback is not None:
+            return feedback
+        future = asyncio.get_running_loop().run_in_executor(get_db_executor(), self._validate, sql)
+        try:
+            return await asyncio.wait_for(future, REFINE_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            return self._feedback(sql, (False, TIMEOUT_ERROR))
+
+    def _early_feedback(self, sql: str):
+        """The feedback of a refused sql or of a cached result, None if the sql has to run
+        """
+        if self._refused(sql):
+            return self._feedback(sql, (False, REFUSED_ERROR))
+        sql_cache = get_sql_cache()
+        cached = sql_cache.get(sql, REFINE_MAX_ROWS, REFINE_MAX_BYTES) if sql_cache is not None else None
+        if cached is not None:
+            return self._feedback(sql, (True, cached))
+        return None
 
+    def _validate(self, sql: str):
+        """Check the plan, run the sql and cache its result; blocking, run and arun call it on the DB executor
+        """
+        # read-only validation: served by a replica when there are any
+        mysql = MySQLDatabase(in_product=True, read_only=True)
+        # the plan is checked first, so a runaway SQL never reaches the server
+        cost_gate = get_cost_gate()
+        if cost_gate is not None:
+            verdict = cost_gate.check(sql, mysql)
+            if not verdict.allowed:
+                return self._cost_feedback(sql, verdict, cost_gate)
+        started_at = time.monotonic()
+        # Only the first rows are read from the server; the rest of the result is never transferred
+        result = mysql.fetch_bounded(sql, REFINE_MAX_ROWS, REFINE_MAX_BYTES, timeout=REFINE_SQL_TIMEOUT)
+        sql_cache = get_sql_cache()
+        if result[0] and sql_cache is not None:
+            sql_cache.put(sql, REFINE_MAX_ROWS, REFINE_MAX_BYTES, result[1], started_at=started_at)
+        return self._feedback(sql, result)
+
+    def _cost_feedback(self, sql: str, verdict, cost_gate):
+        if verdict.error is not None:
+            return self._feedback(sql, (False, verdict.error))
+        estimate = verdict.estimate
+        if 0 < cost_gate.max_rows_examined < estimate.rows_examined:
+            cost = (f'its plan examines about {format_count(estimate.rows_examined)} rows, over the budget of '
+                    f'{format_count(cost_gate.max_rows_examined)} rows')
+        else:
+            cost = f'its plan costs {estimate.query_cost:.0f}, over the budget of {cost_gate.max_query_cost:.0f}'
+        spots = '; '.join(hot_spots(estimate))
+        return (f'Execute refused. The SQL is too expensive to run on the shared database: {cost}. '
+                f'Hot spots of the plan: {spots}. You should optimize the SQL "{sql}", e.g. add the missing '
+                f'join condition, or filter or join on an indexed column.')
+
+    def _feedback(self, sql: str, result):
+        """The message shown to the LLM for the (flag, BoundedResult or error) result of the sql
+        """
         if result[0]:
             final_result = result[1]
-            s = f'Execute success. The SQL is correct. The result is {final_result}.'
+            s = f'Execute success. The SQL is correct. The result is {final_result.rows}.'
+            if final_result.truncated:
+                s += f' Only the first {len(final_result.rows)} rows are shown; the result has more rows.'
+        elif result[1] == REFUSED_ERROR:
+            s = f'Execute fail. You can\'t modify these tables! Your wrong SQL is \"{sql}\".'
+        elif result[1].startswith(TIMEOUT_ERROR):
+            s = f'Execute timeout. You should optimize the SQL: "{sql}".'
         else:
             pattern = r"[\s\S]*\([\s\S]*,([\s\S]*)\)"
             error_info = result[1]
             m = re.search(pattern, error_info)
             if m:
                 s = f'Execute fail. The Error is {m.group(1).strip()}. Your wrong SQL is \"{sql}\", you need to modify it.'
+            else:
+                s = f'Execute fail. The Error is {error_info}. Your wrong SQL is \"{sql}\", you need to modify it.'
         return s
 
 
@@ -26,7 +26,7 @@ def parse(s):
     return result
 
 def sample_data(table_name, col_list):
-    mysql = MySQLDatabase()
+    mysql = MySQLDatabase(read_only=True)
     result = []
     for col_item in col_list:
         col, descr = col_item
@@ -0,0 +1,144 @@
+"""Vector index module, which keeps the FAISS index used by the schema retrieval
+"""
+
+import os
+import json
+import hashlib
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import numpy as np
+import faiss
+
+from logger import logger
+
+
+class VectorIndex:
+    """FAISS index addressed by string keys (e.g. table names)
+
+    The vectors live in an IndexIDMap2 over an exact L2 index, so the ranking is
+    the same as the sklearn NearestNeighbors search it replaces. The key mapping
+    and a fingerprint of the indexed texts are stored next to the index file, so
+    a stale index can be detected and rebuilt at startup.
+    """
+
+    def __init__(self, dim: int, fingerprint: str = ""):
+        self.dim = dim
+        self.fingerprint = fingerprint
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        self.id2key: Dict[int, str] = {}
+        self.key2id: Dict[str, int] = {}
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.key2id)
+
+    @staticmethod
+    def make_fingerprint(model_name: str, keys: List[str], texts: List[str]) -> str:
+        """Hash of everything the index content depends on
+        """
+        h = hashlib.sha1(model_name.encode('utf-8'))
+        for key, text in zip(keys, texts):
+            h.update(key.encode('utf-8'))
+            h.update(b'\0')
+            h.update(text.encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    @classmethod
+    def build(cls, keys: List[str], embeddings: np.ndarray, fingerprint: str = "") -> "VectorIndex":
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        index = cls(dim=embeddings.shape[1], fingerprint=fingerprint)
+        index.add(keys, embeddings)
+        return index
+
+    def copy(self) -> "VectorIndex":
+        """Independent copy, to be updated while searches still run on this one
+        """
+        index = VectorIndex(dim=self.dim, fingerprint=self.fingerprint)
+        index.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+        index.id2key = dict(self.id2key)
+        index.key2id = dict(self.key2id)
+        index.next_id = self.next_id
+        return index
+
+    def add(self, keys: List[str], embeddings: np.ndarray) -> None:
+        """Add (or replace) the vectors of the given keys
+        """
+        if len(keys) == 0:
+            return
+        self.remove([key for key in keys if key in self.key2id])
+        ids = np.arange(self.next_id, self.next_id + len(keys), dtype='int64')
+        self.index.add_with_ids(np.ascontiguousarray(embeddings, dtype='float32'), ids)
+        for key, idx in zip(keys, ids.tolist()):
+            self.id2key[idx] = key
+            self.key2id[key] = idx
+        self.next_id += len(keys)
+
+    def remove(self, keys: Iterable[str]) -> None:
+        ids = [self.key2id.pop(key) for key in keys if key in self.key2id]
+        if not ids:
+            return
+        self.index.remove_ids(np.array(ids, dtype='int64'))
+        for idx in ids:
+            del self.id2key[idx]
+
+    def search(self, query_embedding: np.ndarray, k: int, exclude: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """Return the k nearest keys with their distances, skipping the excluded keys
+
+        Excluded keys are filtered out of an enlarged result list instead of
+        rebuilding the index without them.
+        """
+        exclude = {key for key in exclude if key in self.key2id}
+        n = min(k + len(exclude), len(self))
+        if n <= 0:
+            return []
+        query = np.ascontiguousarray(query_embedding, dtype='float32').reshape(1, -1)
+        distances, ids = self.index.search(query, n)
+        result = []
+        for distance, idx in zip(distances[0].tolist(), ids[0].tolist()):
+            if idx < 0:
+                continue
+            key = self.id2key[idx]
+            if key in exclude:
+                continue
+            result.append((key, distance))
+            if len(result) >= k:
+                break
+        return result
+
+    def distances(self, query_embedding: np.ndarray, keys: List[str]) -> List[float]:
+        """Squared L2 distances from the query to the stored vectors of the given keys
+        """
+        query = np.asarray(query_embedding, dtype='float32').reshape(-1)
+        vectors = np.stack([self.index.reconstruct(self.key2id[key]) for key in keys])
+        return ((vectors - query) ** 2).sum(axis=1).tolist()
+
+    def save(self, path: str) -> None:
+        """Persist the index and its key mapping, replacing the old files atomically
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        faiss.write_index(self.index, path + '.tmp')
+        meta = {
+            'dim': self.dim,
+            'fingerprint': self.fingerprint,
+            'next_id': self.next_id,
+            'id2key': {str(idx): key for idx, key in self.id2key.items()},
+        }
+        with open(path + '.keys.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(path + '.tmp', path)
+        os.replace(path + '.keys.json.tmp', path + '.keys.json')
+        logger.info(f"Saved vector index with {len(self)} entries to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VectorIndex"]:
+        if not (os.path.exists(path) and os.path.exists(path + '.keys.json')):
+            return None
+        with open(path + '.keys.json', 'r') as f:
+            meta = json.load(f)
+        index = cls(dim=meta['dim'], fingerprint=meta['fingerprint'])
+        index.index = faiss.read_index(path)
+        index.next_id = meta['next_id']
+        index.id2key = {int(idx): key for idx, key in meta['id2key'].items()}
+        index.key2id = {key: idx for idx, key in index.id2key.items()}
+        return index
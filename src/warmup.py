@@ -0,0 +1,116 @@
+"""Warm-up module, which loads the models in the background and tracks when retrieval is usable
+
+The server binds its port first; the embedding model, the indexes and
+(optionally) the reranker are then loaded stage by stage in a daemon thread,
+and the readiness state tells /ready and /query whether they are there yet.
+"""
+
+import time
+import threading
+from enum import Enum
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+from logger import logger
+
+
+class StageStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    READY = "ready"
+    FAILED = "failed"
+
+
+@dataclass
+class StageState:
+    name: str
+    required: bool
+    status: StageStatus = StageStatus.PENDING
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+
+
+class Readiness:
+    """Status of the warm-up stages; ready once every required stage is ready, failed once one of them failed
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        # set when ready or failed: the waiters have nothing more to wait for
+        self._settled = threading.Event()
+        self.stages: Dict[str, StageState] = {}
+        self.started_at = time.time()
+
+    def add_stage(self, name: str, required: bool = True) -> None:
+        with self._lock:
+            self.stages[name] = StageState(name=name, required=required)
+
+    def set_status(self, name: str, status: StageStatus, seconds: Optional[float] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            stage = self.stages[name]
+            stage.status, stage.seconds, stage.error = status, seconds, error
+            if all(s.status == StageStatus.READY for s in self.stages.values() if s.required):
+                self._ready.set()
+                self._settled.set()
+            elif status == StageStatus.FAILED and stage.required:
+                self._settled.set()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until ready, at most timeout seconds; returns at once when a required stage failed
+        """
+        self._settled.wait(timeout)
+        return self._ready.is_set()
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.failed_stages())
+
+    def failed_stages(self) -> Dict[str, Optional[str]]:
+        """Error of every required stage that failed, by stage name
+        """
+        with self._lock:
+            return {s.name: s.error for s in self.stages.values() if s.required and s.status == StageStatus.FAILED}
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'ready': self._ready.is_set(),
+                'uptime': round(time.time() - self.started_at, 3),
+                'stages': {s.name: {'status': s.status.value, 'required': s.required, 'seconds': s.seconds, 'error': s.error}
+                           for s in self.stages.values()},
+            }
+
+
+readiness = Readiness()
+
+
+def run_stages(stages: List[Tuple[str, Callable[[], Any], bool]], state: Readiness = readiness) -> None:
+    """Run the (name, load function, required) stages in order; a failed required stage stops the warm-up
+    """
+    for name, func, required in stages:
+        state.set_status(name, StageStatus.RUNNING)
+        s = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            logger.error(f"Warm-up stage {name} failed: {e}")
+            state.set_status(name, StageStatus.FAILED, seconds=time.perf_counter() - s, error=str(e))
+            if required:
+                return
+            continue
+        seconds = time.perf_counter() - s
+        logger.info(f"Warm-up stage {name} ready in {seconds:.2f}s")
+        state.set_status(name, StageStatus.READY, seconds=seconds)
+
+
+def start_warmup(stages: List[Tuple[str, Callable[[], Any], bool]], state: Readiness = readiness) -> threading.Thread:
+    for name, _, required in stages:
+        state.add_stage(name, required=required)
+    thread = threading.Thread(target=run_stages, args=(stages, state), name='warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,20 @@
+"""The modules of src/ import each other as top-level modules, as when run from src/
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    """Run MySQLDatabase on an empty SQLite file (DB_BACKEND = 'sqlite'); returns its path
+    """
+    import db_routing
+    path = str(tmp_path / 'offline.sqlite')
+    monkeypatch.setattr(db_routing, 'DB_BACKEND', 'sqlite')
+    monkeypatch.setattr(db_routing, 'SQLITE_PATH', path)
+    return path
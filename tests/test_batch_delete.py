@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from benchmark import bench_batch_delete
+from mysql import MySQLDatabase
+
+N_ROWS = 500
+
+
+@pytest.fixture
+def db(sqlite_backend):
+    db = MySQLDatabase()
+    assert db.executes(["CREATE TABLE items (id INT PRIMARY KEY, name VARCHAR(32))",
+                        "CREATE INDEX idx_items_name ON items (name)"])[0]
+    assert db.batch_insert('items', [[i, f"key-{i}"] for i in range(N_ROWS)], ['id', 'name'])[0]
+    return db
+
+
+def remaining(db):
+    _, rows = db.fetch("SELECT id FROM items ORDER BY id")
+    return [row[0] for row in rows]
+
+
+@pytest.mark.parametrize('strategy, commit_every', [('in', 0), ('in', 2), ('temp_table', 0), ('auto', 0)])
+@pytest.mark.parametrize('col', ['id', 'name'])
+def test_batch_delete_removes_exactly_the_keys(db, strategy, commit_every, col):
+    ids = random.Random(0).sample(range(N_ROWS), 123)
+    keys = ids if col == 'id' else [f"key-{i}" for i in ids]
+    # chunks of 10, the last one partial, and keys that match no row
+    flag, error = db.batch_delete('items', keys + ([N_ROWS + 1] if col == 'id' else ['missing']), col,
+                                  chunk_size=10, strategy=strategy, commit_every=commit_every)
+    assert flag, error
+    assert remaining(db) == sorted(set(range(N_ROWS)) - set(ids))
+
+
+def test_temp_table_is_dropped_with_the_transaction_kept(db):
+    assert db.batch_delete('items', list(range(100)), 'id', chunk_size=7, strategy='temp_table')[0]
+    assert db.batch_delete('items', list(range(100, 200)), 'id', chunk_size=7, strategy='temp_table')[0]
+    assert remaining(db) == list(range(200, N_ROWS))
+
+
+def test_benchmark_runs_offline(sqlite_backend, capsys):
+    bench_batch_delete.run(300, [40], chunk_size=16, seed=0)
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.strip().startswith('40 ')]
+    assert len(lines) == 8
+    assert all(line.endswith('ok') for line in lines), lines
@@ -0,0 +1,59 @@
+import random
+
+from db_routing import Endpoint, ReplicaRouter
+
+
+def endpoints(n):
+    return [Endpoint(f'replica{i}', f'10.0.0.{i}', 3306, 'root', '', 'chat2sql') for i in range(n)]
+
+
+def route(router, seconds, n_reads):
+    for _ in range(n_reads):
+        endpoint = router.choose()
+        router.record_latency(endpoint, seconds[endpoint])
+    return {stats['endpoint']: stats['reads'] for stats in router.stats()}
+
+
+def test_least_latency_measures_a_replica_slow_once_again():
+    fast, slow = endpoints(2)
+    primary = Endpoint('primary', '10.0.0.9', 3306, 'root', '', 'chat2sql')
+    router = ReplicaRouter([fast, slow], primary, 'least_latency', check_interval=0, explore=0.1,
+                           rng=random.Random(0))
+    # fast had one slow read, e.g. a cold buffer pool; it is the faster one from then on
+    router.record_latency(fast, 2.0)
+    router.record_latency(slow, 0.1)
+    seconds = {fast: 0.01, slow: 0.1}
+    before = route(router, seconds, 1000)
+    after = route(router, seconds, 500)
+    # once measured again, it gets all the reads but the explored ones
+    assert after[fast.label] - before[fast.label] > 400
+
+
+def test_least_latency_without_exploration_sticks_to_the_first_measure():
+    fast, slow = endpoints(2)
+    primary = Endpoint('primary', '10.0.0.9', 3306, 'root', '', 'chat2sql')
+    router = ReplicaRouter([fast, slow], primary, 'least_latency', check_interval=0, explore=0)
+    router.record_latency(fast, 2.0)
+    router.record_latency(slow, 0.1)
+    reads = route(router, {fast: 0.01, slow: 0.1}, 1000)
+    assert reads[fast.label] == 0
+
+
+def test_read_goes_to_the_primary_when_the_replica_is_unreachable(sqlite_backend, monkeypatch):
+    import db_routing
+    from mysql import MySQLDatabase
+
+    # nothing listens on port 1: the connect is refused
+    replica = Endpoint('replica0', '127.0.0.1', 1, 'root', '', 'chat2sql')
+    primary = db_routing.get_endpoint('primary')
+    router = ReplicaRouter([replica], primary, check_interval=0, retry_interval=60)
+    monkeypatch.setattr(db_routing, '_router', router)
+
+    db = MySQLDatabase(in_product=True, read_only=True)
+    assert db.fetch("SELECT 1") == (True, ((1,),))
+    assert [row for row in db.fetch_iter("SELECT 2")] == [(2,)]
+    flag, result = db.fetch_bounded("SELECT 3")
+    assert flag and result.rows == [(3,)]
+    # the replica was tried once, then left alone until retry_interval passes
+    reads = {stats['endpoint']: stats['reads'] for stats in router.stats()}
+    assert reads == {replica.label: 1, primary.label: 2}
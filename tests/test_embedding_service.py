@@ -0,0 +1,21 @@
+import json
+
+import embedding_service
+from embedding_service import RemoteKNNSchema
+
+
+class StubClient:
+    def wait_ready(self):
+        return {'model_name': 'bge-m3'}
+
+
+def test_remote_knn_schema_has_the_catalog(tmp_path, monkeypatch):
+    path = tmp_path / 'catalog.json'
+    path.write_text(json.dumps({'t': {'description': 'a table', 'column_info': [['id', 'the id', '1, 2']]}}))
+    monkeypatch.setattr(embedding_service, 'TABLE_JSON_PATH', str(path))
+    monkeypatch.setattr(embedding_service, 'CATALOG_RELOAD_INTERVAL', 0)
+
+    knn_schema = RemoteKNNSchema(client=StubClient())
+    assert knn_schema.catalog.table_names() == ['t']
+    assert knn_schema.catalog is knn_schema.catalog
+    assert '# Table: t' in knn_schema.catalog.render_schema(['t'])
@@ -0,0 +1,34 @@
+import numpy as np
+
+from embedding_store import EmbeddingStore
+
+
+def vectors(n, dim, value):
+    return np.full((n, dim), value, dtype='float32')
+
+
+def test_compaction_keeps_the_rows_of_other_models(tmp_path):
+    small = EmbeddingStore(str(tmp_path), model_name='org/small')
+    large = EmbeddingStore(str(tmp_path), model_name='org/large')
+    small.add(['a', 'b', 'c'], vectors(3, 4, 1))
+    large.add(['a', 'b'], vectors(2, 8, 2))
+
+    assert small.compact(['a'])
+    assert len(small) == 1 and small.get(['b']) == [None]
+    assert not large.compact(['a', 'b'])
+    reopened = EmbeddingStore(str(tmp_path), model_name='org/large')
+    assert [v.tolist() for v in reopened.get(['a', 'b'])] == [[2.0] * 8] * 2
+
+
+def test_reader_remaps_after_another_store_compacted(tmp_path):
+    reader = EmbeddingStore(str(tmp_path), model_name='m')
+    writer = EmbeddingStore(str(tmp_path), model_name='m')
+    writer.add(['a', 'b', 'c'], np.arange(12, dtype='float32').reshape(3, 4))
+    assert reader.get(['c'])[0].tolist() == [8.0, 9.0, 10.0, 11.0]
+
+    assert writer.compact(['c'])
+    writer.add(['d'], vectors(1, 4, 5))
+    # 'd' is missing from the generation the reader mapped: it switches to the new one
+    c, d = reader.get(['c', 'd'])
+    assert c.tolist() == [8.0, 9.0, 10.0, 11.0] and d.tolist() == [5.0] * 4
+    assert reader.generation == writer.generation == 1
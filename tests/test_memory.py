@@ -0,0 +1,100 @@
+import sqlite3
+import time
+
+import pytest
+
+import db_routing
+import memory_writer
+from memory import LongTermMemory, MEMORY_TABLE
+
+
+@pytest.fixture(autouse=True)
+def fresh_writer(monkeypatch):
+    """A process-wide memory writer per test, on the endpoint the test configures
+    """
+    monkeypatch.setattr(memory_writer, '_memory_writer', None)
+    yield
+    if memory_writer._memory_writer is not None:
+        memory_writer._memory_writer.close(timeout=1)
+
+
+def test_constructor_does_not_touch_an_unreachable_db(monkeypatch):
+    monkeypatch.setattr(db_routing, 'MYSQL_ENDPOINTS', {
+        'primary': {'host': '127.0.0.1', 'port': 1, 'user': 'root', 'password': '', 'db': 'chat2sql'}})
+    memory = LongTermMemory()
+    # the failed schema check is logged, not raised
+    assert memory.search(chat_id=1) is None
+
+
+def test_search_creates_the_table_lazily(sqlite_backend):
+    memory = LongTermMemory()
+    assert memory.search(chat_id=1) == []
+    memory.save({'Q': 'q1', 'A': 'a1'}, chat_id=1)
+    assert memory.search(chat_id=1) == [('q1', 'a1')]
+
+
+def test_former_layout_is_not_migrated_implicitly(sqlite_backend):
+    conn = sqlite3.connect(sqlite_backend)
+    conn.execute(f"CREATE TABLE {MEMORY_TABLE} (chat_id INTEGER, memory TEXT, timestamp INTEGER)")
+    conn.execute(f"INSERT INTO {MEMORY_TABLE} VALUES (1, 'Question: q\tAnswer: a', 1)")
+    conn.commit()
+
+    memory = LongTermMemory()
+    assert memory.search(chat_id=1) is None
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({MEMORY_TABLE})")]
+    assert columns == ['chat_id', 'memory', 'timestamp']
+
+    flag, result = memory.migrate()
+    assert flag, result
+    assert memory.search(chat_id=1) == [('q', 'a')]
+    conn.close()
+
+
+def test_failed_swap_keeps_the_live_table(sqlite_backend, monkeypatch):
+    import pymysql
+    import db_backend
+
+    conn = sqlite3.connect(sqlite_backend)
+    conn.execute(f"CREATE TABLE {MEMORY_TABLE} (chat_id INTEGER, memory TEXT, timestamp INTEGER)")
+    conn.execute(f"INSERT INTO {MEMORY_TABLE} VALUES (1, 'Question: q\tAnswer: a', 1)")
+    conn.commit()
+
+    translate = db_backend.translate
+
+    def failing_second_rename(sql, args=None):
+        if sql.startswith(f"ALTER TABLE {MEMORY_TABLE}_new RENAME"):
+            raise pymysql.err.OperationalError(1050, 'rename failed')
+        return translate(sql, args)
+
+    monkeypatch.setattr(db_backend, 'translate', failing_second_rename)
+    flag, result = LongTermMemory().migrate()
+    assert not flag and 'rename failed' in result
+
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert MEMORY_TABLE in tables and f"{MEMORY_TABLE}_legacy" not in tables
+    assert conn.execute(f"SELECT memory FROM {MEMORY_TABLE}").fetchall() == [('Question: q\tAnswer: a',)]
+    conn.close()
+
+
+def test_swap_is_one_rename_table_statement_on_mysql(sqlite_backend, monkeypatch):
+    import db_backend
+
+    conn = sqlite3.connect(sqlite_backend)
+    conn.execute(f"CREATE TABLE {MEMORY_TABLE} (chat_id INTEGER, memory TEXT, timestamp INTEGER)")
+    conn.commit()
+
+    statements, translate = [], db_backend.translate
+
+    def recording(sql, args=None):
+        statements.append(sql)
+        return translate(sql, args)
+
+    monkeypatch.setattr(db_backend, 'translate', recording)
+    monkeypatch.setattr(db_backend, 'SQLITE_CAPABILITIES', db_backend.SQLITE_CAPABILITIES._replace(rename_tables=True))
+    # SQLite has no RENAME TABLE: the statement fails, as one
+    flag, _ = LongTermMemory().migrate()
+    assert not flag
+    assert [sql for sql in statements if 'RENAME' in sql] == [
+        f"RENAME TABLE {MEMORY_TABLE} TO {MEMORY_TABLE}_legacy, {MEMORY_TABLE}_new TO {MEMORY_TABLE}"]
+    assert conn.execute(f"SELECT COUNT(*) FROM {MEMORY_TABLE}").fetchone() == (0,)
+    conn.close()
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import fcntl
+
+import pymysql
+import pytest
+
+from memory_writer import MemoryWriter
+
+COLUMNS = ['chat_id', 'question', 'answer', 'memory', 'timestamp']
+
+
+class FlakyDB:
+    """batch_insert raises like a lost connection for the first calls, then succeeds
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.rows = []
+
+    def batch_insert(self, table, res_list, col_list=None, is_replace=False):
+        if self.failures > 0:
+            self.failures -= 1
+            raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+        self.rows.extend(res_list)
+        return True, None
+
+
+def test_flusher_retries_after_raising_db():
+    db = FlakyDB(failures=2)
+    writer = MemoryWriter(db, 'user_memory', COLUMNS, durability='async', flush_rows=10, flush_interval=0.01)
+    writer.put([1, 'q1', 'a1', None, 1])
+    writer.put([1, 'q2', 'a2', None, 2])
+    deadline = time.monotonic() + 5
+    while writer.stats()['written'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    writer.close(timeout=1)
+
+    stats = writer.stats()
+    assert writer._flusher.is_alive() is False
+    assert stats['failures'] == 2
+    assert stats['written'] == 2 and stats['backlog'] == 0
+    assert [row[1] for row in db.rows] == ['q1', 'q2']
+
+
+def test_sync_put_waits_through_a_raising_db():
+    db = FlakyDB(failures=1)
+    writer = MemoryWriter(db, 'user_memory', COLUMNS, durability='sync', flush_rows=10, flush_interval=0.01,
+                          sync_timeout=5)
+    assert writer.put([1, 'q', 'a', None, 1]) is True
+    writer.close(timeout=1)
+    assert len(db.rows) == 1
+
+
+class RecordingDB:
+    def __init__(self):
+        self.rows = []
+
+    def batch_insert(self, table, res_list, col_list=None, is_replace=False):
+        self.rows.extend(res_list)
+        return True, None
+
+
+def _orphan_segment(prefix, pid, rows):
+    """Segment and lock file as a process with that pid leaves them; returns the lock file path
+    """
+    with open(f"{prefix}.{pid}.{time.time_ns()}", 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+    lock_path = f"{prefix}.{pid}.lock"
+    open(lock_path, 'a').close()
+    return lock_path
+
+
+def test_wal_replays_only_segments_of_dead_processes(tmp_path):
+    prefix = str(tmp_path / 'segment')
+    _orphan_segment(prefix, 999991, [[1, 'dead', 'a', None, 1]])
+    live_lock = _orphan_segment(prefix, 999992, [[2, 'live', 'a', None, 2]])
+    # an flock held on another open file stands for the live process
+    holder = open(live_lock, 'a')
+    fcntl.flock(holder, fcntl.LOCK_EX)
+
+    db = RecordingDB()
+    writer = MemoryWriter(db, 'user_memory', COLUMNS, durability='wal', flush_rows=10, flush_interval=0.01,
+                          wal_path=prefix)
+    writer.close(timeout=1)
+
+    assert [row[1] for row in db.rows] == ['dead']
+    assert writer.stats()['replayed'] == 1
+    remaining = sorted(os.listdir(tmp_path))
+    assert not any(name.startswith('segment.999991') for name in remaining)
+    assert sum(name.startswith('segment.999992.') for name in remaining) == 2
+
+    holder.close()
+    db = RecordingDB()
+    writer = MemoryWriter(db, 'user_memory', COLUMNS, durability='wal', flush_rows=10, flush_interval=0.01,
+                          wal_path=prefix)
+    writer.close(timeout=1)
+    assert [row[1] for row in db.rows] == ['live']
+
+
+def test_wal_keeps_rows_of_a_crashed_writer(tmp_path):
+    prefix = str(tmp_path / 'segment')
+
+    class DownDB:
+        def batch_insert(self, *args, **kwargs):
+            return False, "[ERROR] (2003, \"Can't connect to MySQL server\")"
+
+    crashed = MemoryWriter(DownDB(), 'user_memory', COLUMNS, durability='wal', flush_rows=10,
+                           flush_interval=10, wal_path=prefix)
+    crashed.put([1, 'q', 'a', None, 1])
+    # the process dies: its log stays, its lock is released
+    crashed.wal._lock_file.close()
+    crashed.wal._lock_file = None
+
+    # same pid as the dead writer: its lock is taken over with its segments
+    db = RecordingDB()
+    writer = MemoryWriter(db, 'user_memory', COLUMNS, durability='wal', flush_rows=10, flush_interval=0.01,
+                          wal_path=prefix)
+    writer.close(timeout=1)
+    assert [row[1] for row in db.rows] == ['q']
+
+
+def test_wal_prefix_is_not_shared_in_a_process(tmp_path):
+    prefix = str(tmp_path / 'segment')
+    writer = MemoryWriter(RecordingDB(), 'user_memory', COLUMNS, durability='wal', wal_path=prefix)
+    with pytest.raises(RuntimeError):
+        MemoryWriter(RecordingDB(), 'user_memory', COLUMNS, durability='wal', wal_path=prefix)
+    writer.close(timeout=1)
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+from mysql import MySQLDatabase, with_row_limit
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT a FROM t", "SELECT a FROM t LIMIT 6"),
+    ("select a from t order by a;", "select a from t order by a LIMIT 6"),
+    ("SELECT a FROM t LIMIT 100", "SELECT a FROM t LIMIT 6"),
+    ("SELECT a FROM t LIMIT 20, 100", "SELECT a FROM t LIMIT 20, 6"),
+    ("SELECT a FROM t LIMIT 100 OFFSET 20", "SELECT a FROM t LIMIT 6 OFFSET 20"),
+    ("SELECT a FROM t LIMIT 3", "SELECT a FROM t LIMIT 3"),
+    # not the last clause, not a number, or a statement a LIMIT would break
+    ("SELECT a FROM (SELECT a FROM t LIMIT 100) x", "SELECT a FROM (SELECT a FROM t LIMIT 100) x"),
+    ("SELECT a FROM t LIMIT %s", "SELECT a FROM t LIMIT %s"),
+    ("SELECT a FROM t -- newest", "SELECT a FROM t -- newest"),
+    ("SELECT a FROM t FOR UPDATE", "SELECT a FROM t FOR UPDATE"),
+    ("SHOW TABLES", "SHOW TABLES"),
+    ("SELECT 1; SELECT 2", "SELECT 1; SELECT 2"),
+])
+def test_with_row_limit(sql, expected):
+    assert with_row_limit(sql, 6) == expected
+
+
+@pytest.fixture
+def numbers(sqlite_backend):
+    conn = sqlite3.connect(sqlite_backend)
+    conn.execute("CREATE TABLE numbers (n INTEGER)")
+    conn.executemany("INSERT INTO numbers VALUES (?)", [(i,) for i in range(5000)])
+    conn.commit()
+    conn.close()
+    return MySQLDatabase(in_product=False)
+
+
+def discarded(db):
+    return sum(stats['discarded'] for stats in db.pool_stats())
+
+
+def test_truncated_fetch_keeps_the_connection(numbers):
+    before = discarded(numbers)
+    for sql in ["SELECT n FROM numbers", "SELECT n FROM numbers WHERE n >= %s LIMIT %s"]:
+        flag, result = numbers.fetch_bounded(sql, max_rows=5, args=(0, 100) if '%s' in sql else None)
+        assert flag and result.truncated and len(result.rows) == 5
+    # a bytes cap stops the stream without a LIMIT to help
+    flag, result = numbers.fetch_bounded("SELECT n FROM numbers", max_rows=4000, max_bytes=80)
+    assert flag and result.truncated and len(result.rows) == 10
+    assert discarded(numbers) == before
+    # the connections that went back are usable
+    assert numbers.fetch("SELECT COUNT(*) FROM numbers") == (True, ((5000,),))
+
+
+def test_fetch_iter_stopped_early_keeps_the_connection(numbers):
+    before = discarded(numbers)
+    rows = numbers.fetch_iter("SELECT n FROM numbers", batch_size=10)
+    assert [next(rows) for _ in range(3)] == [(0,), (1,), (2,)]
+    rows.close()
+    assert discarded(numbers) == before
+    assert numbers.fetch("SELECT MAX(n) FROM numbers") == (True, ((4999,),))
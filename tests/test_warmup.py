@@ -0,0 +1,41 @@
+import threading
+import time
+
+from warmup import Readiness, run_stages
+
+
+def fail():
+    raise RuntimeError('model file missing')
+
+
+def test_wait_returns_at_once_after_a_required_stage_failed():
+    readiness = Readiness()
+    for name in ('imports', 'retrieval'):
+        readiness.add_stage(name)
+    run_stages([('imports', lambda: None, True), ('retrieval', fail, True)], readiness)
+
+    s = time.monotonic()
+    assert not readiness.wait(60)
+    assert time.monotonic() - s < 1
+    assert readiness.failed and readiness.failed_stages() == {'retrieval': 'model file missing'}
+
+
+def test_failure_releases_the_requests_already_waiting():
+    readiness = Readiness()
+    readiness.add_stage('retrieval')
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(readiness.wait(60)))
+    waiter.start()
+    run_stages([('retrieval', fail, True)], readiness)
+    waiter.join(timeout=5)
+    assert waited == [False]
+
+
+def test_optional_stage_failure_does_not_stop_the_wait():
+    readiness = Readiness()
+    readiness.add_stage('retrieval')
+    readiness.add_stage('reranker', required=False)
+    run_stages([('reranker', fail, False)], readiness)
+    assert not readiness.failed and not readiness.wait(0.05)
+    run_stages([('retrieval', lambda: None, True)], readiness)
+    assert readiness.wait(0)